@@ -0,0 +1,890 @@
+import sys
+import argparse
+from fractions import Fraction
+
+from sim import (
+    Cosmo8, CosmoError, load_program, cost_table, instruction_lines, label_addresses,
+    COST_MODELS, CONDITIONAL_JUMPS,
+    OP_HLT, OP_MOV, OP_ADD, OP_SUB, OP_CMP, OP_LOAD, OP_JMP, OP_JZ, OP_JNZ, OP_JN,
+    OP_CALL, OP_RET, OP_PUSH, OP_POP, OP_READ, OP_BAD, OP_SHR,
+)
+from jit import find_blocks, FLAG_DEFS
+
+# Static analysis of a decoded program, before anything runs. The control-flow
+# graph is built over jit.find_blocks' basic blocks, with CALL edges to the
+# callee and RET edges to every return site. Unreachable blocks are dead code;
+# dominators give the natural loops.
+#
+# A loop is bounded when a register changes by a constant step exactly once
+# per iteration and is tested against zero, or with CMP against an
+# invariant, by a conditional jump that runs every iteration and leaves the
+# loop. Start values are traced back through MOV/ADD/SUB to constants, to
+# values READ outside any loop (the input symbols N, N2, ...), to the exit
+# value of an earlier counted loop, or to the range an enclosing loop's
+# counter sweeps. Cycle counts and stack depths are then bounded over paths
+# with inner loops collapsed, as polynomials in the input symbols. Bounds
+# assume symbols are at least 1 and that counters do not wrap at 16 bits,
+# and they ignore runs that fault; they are estimates, best and worst.
+#
+# Errors are claims that hold for every run: no run can halt, or no run can
+# halt within the cycle limit, or every run overflows the stack. They are only
+# made when the graph is exact (no negative jump targets, no RET that may use
+# a pushed value, no irreducible loops) and every trip count is proven free of
+# wraparound: the counter and the value it is compared against stay within
+# 16 bits for every input.
+
+HALT, FAULT = 'halt', 'fault'
+NO_PATH = 'no path'
+IN_PROGRESS = 'in progress'
+# Registers written by each op; CMP only sets flags.
+WRITES_R = set(range(OP_MOV, OP_SHR + 1)) | {OP_LOAD, OP_POP, OP_READ}
+
+
+class Poly:
+    # Polynomial with rational coefficients in the input symbols. A monomial
+    # is a sorted tuple of symbol names, () for the constant term.
+    __slots__ = ('terms',)
+
+    def __init__(self, terms=()):
+        self.terms = {m: Fraction(c) for m, c in dict(terms).items() if c}
+
+    @classmethod
+    def symbol(cls, name):
+        return cls({(name,): 1})
+
+    def __add__(self, other):
+        terms = dict(self.terms)
+        for m, c in _poly(other).terms.items():
+            terms[m] = terms.get(m, 0) + c
+        return Poly(terms)
+
+    __radd__ = __add__
+
+    def __neg__(self):
+        return Poly({m: -c for m, c in self.terms.items()})
+
+    def __sub__(self, other):
+        return self + -_poly(other)
+
+    def __rsub__(self, other):
+        return _poly(other) - self
+
+    def __mul__(self, other):
+        terms = {}
+        for m1, c1 in self.terms.items():
+            for m2, c2 in _poly(other).terms.items():
+                m = tuple(sorted(m1 + m2))
+                terms[m] = terms.get(m, 0) + c1 * c2
+        return Poly(terms)
+
+    __rmul__ = __mul__
+
+    def __truediv__(self, k):
+        return Poly({m: c / k for m, c in self.terms.items()})
+
+    def __eq__(self, other):
+        return isinstance(other, (Poly, int, Fraction)) and self.terms == _poly(other).terms
+
+    @property
+    def constant(self):
+        return self.terms.get((), Fraction(0))
+
+    def is_constant(self):
+        return all(m == () for m in self.terms)
+
+    def symbols(self):
+        return sorted({s for m in self.terms for s in m})
+
+    def evaluate(self, values):
+        total = Fraction(0)
+        for m, c in self.terms.items():
+            for s in m:
+                c *= values[s]
+            total += c
+        return total
+
+    def __str__(self):
+        if not self.terms:
+            return "0"
+        parts = []
+        for m in sorted(self.terms, key=lambda m: (-len(m), m)):
+            c = self.terms[m]
+            names = ''.join(f"{s}^{m.count(s)}" if m.count(s) > 1 else s
+                            for s in sorted(set(m)))
+            size = abs(c)
+            if size.denominator == 1:
+                text = str(size.numerator) if size != 1 or not names else ''
+            else:
+                text = f"({size})" if names else str(size)
+            term = text + names
+            parts.append(('- ' if c < 0 else '+ ') + term)
+        text = ' '.join(parts)
+        return text[2:] if text.startswith('+ ') else '-' + text[2:]
+
+
+def _poly(value):
+    return value if isinstance(value, Poly) else Poly({(): value})
+
+
+def _offset(poly, delta):
+    # `poly` with every symbol s replaced by s + delta.
+    result = Poly()
+    for m, c in poly.terms.items():
+        term = Poly({(): c})
+        for s in m:
+            term = term * (Poly.symbol(s) + delta)
+        result = result + term
+    return result
+
+
+def upper(a, b):
+    # Coefficient-wise maximum over powers of (s - 1): an upper bound of both
+    # for every symbol s >= 1, and exactly the larger one when one dominates.
+    # None stands for an unbounded value.
+    if a is None or b is None:
+        return None
+    a, b = _offset(a, 1), _offset(b, 1)
+    return _offset(Poly({m: max(a.terms.get(m, 0), b.terms.get(m, 0))
+                         for m in set(a.terms) | set(b.terms)}), -1)
+
+
+def lower(a, b):
+    if a is None:
+        return b
+    if b is None:
+        return a
+    a, b = _offset(a, 1), _offset(b, 1)
+    return _offset(Poly({m: min(a.terms.get(m, 0), b.terms.get(m, 0))
+                         for m in set(a.terms) | set(b.terms)}), -1)
+
+
+def _hull(values):
+    # Smallest interval holding every (lo, hi) interval, or None if any is
+    # unknown.
+    if not values or any(v is None for v in values):
+        return None
+    lo, hi = values[0]
+    for v_lo, v_hi in values[1:]:
+        lo, hi = lower(lo, v_lo), upper(hi, v_hi)
+    return lo, hi
+
+
+def _span(poly):
+    # (least, greatest) a poly can take for symbols in 1..32767, the range of
+    # positive input words; a bound, exact for constants.
+    lo = hi = Fraction(0)
+    for m, c in _offset(poly, 1).terms.items():
+        size = c * 32766 ** len(m) if m else c
+        if size < 0 or not m:
+            lo += size
+        if size > 0 or not m:
+            hi += size
+    return lo, hi
+
+
+def _fits(values):
+    # Whether every poly in `values` stays a signed 16-bit word.
+    return all(-32768 <= _span(v)[0] and _span(v)[1] <= 32767 for v in values)
+
+
+def _shift(value, k):
+    return None if value is None else (value[0] + k, value[1] + k)
+
+
+def _step(ins, reg):
+    # The constant a counter update `ins` adds to `reg`, or None.
+    if ins.r != reg:
+        return None
+    if ins.op == OP_ADD:
+        if not ins.a_imm and ins.a == reg and ins.b_imm:
+            return ins.b or None
+        if ins.a_imm and not ins.b_imm and ins.b == reg:
+            return ins.a or None
+    if ins.op == OP_SUB and not ins.a_imm and ins.a == reg and ins.b_imm:
+        return -ins.b or None
+    return None
+
+
+class Loop:
+    def __init__(self, header, blocks, latches):
+        self.header = header
+        self.blocks = blocks
+        self.latches = latches
+        self.parent = None
+        self.children = []
+        self.exits = []
+        self.defs = {}
+        self.counters = {}
+        # Header executions, (fewest, most); None for no bound.
+        self.trips = (Poly({(): 1}), None)
+        self.test = None
+        self.counter = None
+
+    def depth(self):
+        return 0 if self.parent is None else self.parent.depth() + 1
+
+
+class CycleAlgebra:
+    def __init__(self, analysis):
+        self.analysis = analysis
+
+    def block(self, start):
+        a = self.analysis
+        return Poly({(): sum(a.op_costs[a.code[ip].op] for ip in range(start, a.blocks[start]))})
+
+    def edge(self, extra):
+        return Poly({(): extra})
+
+    def seq(self, mode, x, y):
+        return None if x is None or y is None else x + y
+
+    def choose(self, mode, values):
+        pick = upper if mode == 'worst' else lower
+        result = values[0]
+        for value in values[1:]:
+            result = pick(result, value)
+        return result
+
+    def repeat(self, mode, trips, iteration, exit):
+        if trips is None or iteration is None:
+            return None
+        return self.seq(mode, (trips - 1) * iteration, exit)
+
+
+class StackAlgebra:
+    # Values are (net change, peak depth above the start) pairs.
+    def __init__(self, analysis):
+        self.analysis = analysis
+
+    def block(self, start):
+        a = self.analysis
+        depth = peak = 0
+        for ip in range(start, a.blocks[start]):
+            op = a.code[ip].op
+            if op in (OP_PUSH, OP_CALL):
+                depth += 1
+                peak = max(peak, depth)
+            elif op in (OP_POP, OP_RET):
+                depth -= 1
+        return Poly({(): depth}), Poly({(): peak})
+
+    def edge(self, extra):
+        return Poly(), Poly()
+
+    def seq(self, mode, x, y):
+        if x is None or y is None:
+            return None
+        peak = upper(x[1], x[0] + y[1])
+        if mode == 'best' and peak != x[1] and peak != x[0] + y[1]:
+            # Neither dominates: the first part's peak is still a lower bound.
+            peak = x[1]
+        return x[0] + y[0], peak
+
+    def choose(self, mode, values):
+        if any(v is None for v in values):
+            if mode == 'worst':
+                return None
+            values = [v for v in values if v is not None]
+            if not values:
+                return None
+        pick = upper if mode == 'worst' else lower
+        delta, peak = values[0]
+        for d, p in values[1:]:
+            delta, peak = pick(delta, d), pick(peak, p)
+        return delta, peak
+
+    def repeat(self, mode, trips, iteration, exit):
+        if iteration is None:
+            return None
+        delta, peak = iteration
+        if trips is None:
+            # Iterations that never grow the stack need no trip count for
+            # the worst case.
+            if mode == 'best' or not delta.is_constant() or delta.constant > 0:
+                return None
+            return self.seq(mode, (Poly(), peak), exit)
+        runs = trips - 1
+        if not delta.is_constant():
+            peak = (upper if mode == 'worst' else lower)(peak, peak + (runs - 1) * delta)
+        elif delta.constant > 0:
+            peak = peak + (runs - 1) * delta
+        return self.seq(mode, (runs * delta, peak), exit)
+
+
+class Analysis:
+    def __init__(self, code, costs=None):
+        self.code = tuple(code)
+        self.op_costs, self.taken_extra = cost_table(costs)
+        self.exact = True
+        self.notes = []
+        n = len(self.code)
+        self.blocks = dict(find_blocks(self.code))
+        self.block_of = {}
+        for start, end in self.blocks.items():
+            for ip in range(start, end):
+                self.block_of[ip] = start
+
+        self.has_push = any(ins.op == OP_PUSH for ins in self.code)
+        self.return_sites = sorted(ip + 1 for ip, ins in enumerate(self.code)
+                                   if ins.op == OP_CALL and ip + 1 < n)
+        self.succs = {start: self._edges(start, end) for start, end in self.blocks.items()}
+        self.reachable = self._reachable()
+        self.dead = [ip for ip in range(n) if self.block_of[ip] not in self.reachable]
+        self.preds = {b: [] for b in self.reachable}
+        for b in self.reachable:
+            for t, _ in self.succs[b]:
+                if t in self.preds and b not in self.preds[t]:
+                    self.preds[t].append(b)
+        self.dom = self._dominators()
+        self.loops = self._loops()
+        self.symbols = {}
+        for ip, ins in enumerate(self.code):
+            if ins.op == OP_READ and self.block_of[ip] in self.reachable \
+                    and self._loop_of(self.block_of[ip]) is None:
+                self.symbols[ip] = 'N' if not self.symbols else f"N{len(self.symbols) + 1}"
+        for loop in sorted(self.loops.values(), key=lambda l: (l.depth(), l.header)):
+            self._trip_count(loop)
+
+        self.cycles = self._bounds(CycleAlgebra(self), 'halt')
+        self.stack = self._bounds(StackAlgebra(self), 'end')
+        self.errors, self.warnings = self._check()
+
+    # --- control flow ---
+
+    def _edges(self, start, end):
+        ins = self.code[end - 1]
+        n = len(self.code)
+
+        def at(ip):
+            if 0 <= ip < n:
+                return ip
+            if -n <= ip < 0:
+                self._inexact("jumps to negative addresses are not followed")
+            return FAULT
+
+        op = ins.op
+        if op == OP_HLT:
+            return [(HALT, 0)]
+        if op == OP_BAD:
+            return [(FAULT, 0)]
+        if op in (OP_JMP, OP_CALL):
+            return [(at(ins.a), 0)]
+        if op in CONDITIONAL_JUMPS:
+            if ins.a == end:
+                return [(at(end), 0)]
+            return [(at(end), 0), (at(ins.a), self.taken_extra[op])]
+        if op == OP_RET:
+            if self.has_push:
+                self._inexact("RET may return to a pushed value")
+            return [(site, 0) for site in self.return_sites] or [(FAULT, 0)]
+        return [(at(end), 0)]
+
+    def _inexact(self, note):
+        self.exact = False
+        if note not in self.notes:
+            self.notes.append(note)
+
+    def _reachable(self):
+        seen = set()
+        stack = [0] if self.code else []
+        while stack:
+            b = stack.pop()
+            if b in seen:
+                continue
+            seen.add(b)
+            stack.extend(t for t, _ in self.succs[b] if t not in (HALT, FAULT))
+        return seen
+
+    def _dominators(self):
+        order = []
+        seen = set()
+
+        def visit(b):
+            seen.add(b)
+            for t, _ in self.succs[b]:
+                if t in self.reachable and t not in seen:
+                    visit(t)
+            order.append(b)
+
+        if self.code:
+            visit(0)
+        order.reverse()
+        dom = {b: set(self.reachable) for b in self.reachable}
+        if self.code:
+            dom[0] = {0}
+        changed = True
+        while changed:
+            changed = False
+            for b in order[1:]:
+                new = set.intersection(*(dom[p] for p in self.preds[b])) | {b}
+                if new != dom[b]:
+                    dom[b] = new
+                    changed = True
+        return dom
+
+    def _loops(self):
+        loops = {}
+        for u in self.reachable:
+            for h, _ in self.succs[u]:
+                if h in self.reachable and h in self.dom[u]:
+                    body = {h}
+                    stack = [u]
+                    while stack:
+                        x = stack.pop()
+                        if x not in body:
+                            body.add(x)
+                            stack.extend(self.preds[x])
+                    if h in loops:
+                        loops[h].blocks |= body
+                        loops[h].latches.append(u)
+                    else:
+                        loops[h] = Loop(h, body, [u])
+        for loop in loops.values():
+            enclosing = [other for other in loops.values()
+                         if other is not loop and loop.header in other.blocks
+                         and loop.blocks <= other.blocks]
+            if enclosing:
+                loop.parent = min(enclosing, key=lambda other: len(other.blocks))
+                loop.parent.children.append(loop)
+            loop.exits = [(b, t, extra) for b in sorted(loop.blocks)
+                          for t, extra in self.succs[b] if t not in loop.blocks]
+            for b in loop.blocks:
+                for ip in range(b, self.blocks[b]):
+                    ins = self.code[ip]
+                    if ins.op in WRITES_R:
+                        loop.defs.setdefault(ins.r, []).append(ip)
+        for loop in loops.values():
+            inner = set().union(*(child.blocks for child in loop.children))
+            for reg, ips in loop.defs.items():
+                if len(ips) != 1:
+                    continue
+                b = self.block_of[ips[0]]
+                step = _step(self.code[ips[0]], reg)
+                if step and b not in inner and all(b in self.dom[l] for l in loop.latches):
+                    loop.counters[reg] = (ips[0], step)
+        return loops
+
+    def _loop_of(self, b):
+        # Innermost loop holding block b.
+        holding = [loop for loop in self.loops.values() if b in loop.blocks]
+        return min(holding, key=lambda loop: len(loop.blocks)) if holding else None
+
+    # --- values and trip counts ---
+
+    def _value_before(self, reg, loop, visiting):
+        # Interval of `reg` on entry to `loop` from outside it.
+        values = [self._value_along(reg, p, loop.header, visiting)
+                  for p in self.preds[loop.header] if p not in loop.blocks]
+        if loop.header == 0:
+            values.append((Poly(), Poly()))
+        return _hull(values)
+
+    def _value_at(self, reg, b, pos, visiting):
+        # Interval of `reg` just before IP `pos` of block b.
+        for ip in range(pos - 1, b - 1, -1):
+            ins = self.code[ip]
+            if ins.op in WRITES_R and ins.r == reg:
+                return self._definition(ins, ip, b, visiting)
+        return self._value_entry(reg, b, visiting)
+
+    def _definition(self, ins, ip, b, visiting):
+        if ins.op == OP_MOV:
+            if ins.a_imm:
+                return Poly({(): ins.a}), Poly({(): ins.a})
+            return self._value_at(ins.a, b, ip, visiting)
+        if ins.op in (OP_ADD, OP_SUB) and ins.a_imm != ins.b_imm:
+            if ins.b_imm:
+                return _shift(self._value_at(ins.a, b, ip, visiting),
+                              ins.b if ins.op == OP_ADD else -ins.b)
+            if ins.op == OP_ADD:
+                return _shift(self._value_at(ins.b, b, ip, visiting), ins.a)
+        if ins.op == OP_READ and ip in self.symbols:
+            value = Poly.symbol(self.symbols[ip])
+            return value, value
+        return None
+
+    def _value_entry(self, reg, b, visiting):
+        if (reg, b) in visiting:
+            return None
+        visiting = visiting | {(reg, b)}
+        loop = self.loops.get(b)
+        if loop is not None:
+            if reg in loop.counters and loop.trips[1] is not None:
+                start = self._value_before(reg, loop, visiting)
+                if start is None:
+                    return None
+                _, step = loop.counters[reg]
+                end = (start[0] + step * (loop.trips[1] - 1),
+                       start[1] + step * (loop.trips[1] - 1))
+                return _hull([start, end])
+            if reg not in loop.defs:
+                return self._value_before(reg, loop, visiting)
+            return None
+
+        values = [(Poly(), Poly())] if b == 0 else []
+        values += [self._value_along(reg, p, b, visiting) for p in self.preds[b]]
+        return _hull(values)
+
+    def _value_along(self, reg, p, b, visiting):
+        # Interval of `reg` on the edge from block p to block b.
+        exited = [l for l in self.loops.values() if p in l.blocks and b not in l.blocks]
+        if exited:
+            return self._value_exit(reg, max(exited, key=lambda l: len(l.blocks)), p, visiting)
+        return self._value_at(reg, p, self.blocks[p], visiting)
+
+    def _value_exit(self, reg, loop, p, visiting):
+        # Interval of `reg` when `loop` is left from block p.
+        if reg not in loop.defs:
+            return self._value_before(reg, loop, visiting)
+        if reg not in loop.counters or loop.test is None or loop.test[0] != p:
+            return None
+        start = self._value_before(reg, loop, visiting)
+        if start is None or loop.trips[1] is None:
+            return None
+        _, step = loop.counters[reg]
+        updates_lo = loop.trips[0] - (0 if loop.test[1] else 1)
+        updates_hi = loop.trips[1] - (0 if loop.test[1] else 1)
+        return _hull([(start[0] + step * updates_lo, start[1] + step * updates_lo),
+                      (start[0] + step * updates_hi, start[1] + step * updates_hi)])
+
+    def _trip_count(self, loop):
+        if not loop.exits:
+            loop.trips = (None, None)
+            return
+        inner = set().union(*(child.blocks for child in loop.children))
+        for b, _, _ in loop.exits:
+            if b in inner or not all(b in self.dom[l] for l in loop.latches):
+                continue
+            result = self._counted(loop, b)
+            if result is not None:
+                loop.trips, loop.test, loop.counter = result
+                if any(e != b for e, _, _ in loop.exits):
+                    # Another exit can leave in the first iteration.
+                    loop.trips = (Poly({(): 1}), loop.trips[1])
+                return
+
+    def _counted(self, loop, b):
+        jump_ip = self.blocks[b] - 1
+        jump = self.code[jump_ip]
+        if jump.op not in (OP_JZ, OP_JNZ, OP_JN):
+            return None
+        n = len(self.code)
+        taken = jump.a if 0 <= jump.a < n else FAULT
+        fall = jump_ip + 1 if jump_ip + 1 < n else FAULT
+        if (taken in loop.blocks) == (fall in loop.blocks):
+            return None
+        kind = {OP_JZ: 'zero', OP_JNZ: 'nonzero', OP_JN: 'negative'}[jump.op]
+        if taken in loop.blocks:
+            kind = {'zero': 'nonzero', 'nonzero': 'zero', 'negative': 'non-negative'}[kind]
+
+        setter = next((ip for ip in range(jump_ip - 1, b - 1, -1)
+                       if self.code[ip].op in FLAG_DEFS), None)
+        if setter is None:
+            return None
+        ins = self.code[setter]
+        if ins.op == OP_SHR and kind == 'zero':
+            return self._shifted(loop, b, setter)
+        if ins.op in (OP_ADD, OP_SUB) and loop.counters.get(ins.r, (None,))[0] == setter:
+            reg, sign, bound = ins.r, 1, (Poly(), Poly())
+        elif ins.op == OP_CMP:
+            if not ins.a_imm and ins.a in loop.counters:
+                reg, sign, other = ins.a, 1, (ins.b, ins.b_imm)
+            elif not ins.b_imm and ins.b in loop.counters:
+                reg, sign, other = ins.b, -1, (ins.a, ins.a_imm)
+            else:
+                return None
+            value, imm = other
+            if imm:
+                bound = Poly({(): value}), Poly({(): value})
+            elif value in loop.defs:
+                return None
+            else:
+                bound = self._value_before(value, loop, frozenset())
+        else:
+            return None
+
+        update, step = loop.counters[reg]
+        update_block = self.block_of[update]
+        if update_block == b:
+            before = update < jump_ip
+        elif update_block in self.dom[b]:
+            before = True
+        elif b in self.dom[update_block]:
+            before = False
+        else:
+            return None
+        start = self._value_before(reg, loop, frozenset())
+        if start is None or bound is None:
+            return None
+
+        # The flags tested in iteration i come from x_i = a + slope * i.
+        shift = 0 if before else step
+        if sign > 0:
+            ends = (start[0] - bound[1] - shift, start[1] - bound[0] - shift)
+        else:
+            ends = (bound[0] - start[1] + shift, bound[1] - start[0] + shift)
+        slope = sign * step
+
+        trips = [self._first(kind, a, slope) for a in ends]
+        if None in trips:
+            return None
+        # Trip counts follow the exact values only if neither the counter nor
+        # the difference the jump tests ever wraps.
+        most = upper(*trips)
+        if not _fits([*start, *(x + step * most for x in start),
+                      *ends, *(a + slope * most for a in ends)]):
+            self._inexact(f"R{reg} may wrap at 16 bits in the loop at IP {loop.header}")
+        described = f"R{reg} {'+' if step > 0 else '-'}= {abs(step)}, exits when " + {
+            'zero': "it reaches the bound" if ins.op == OP_CMP else "it reaches 0",
+            'negative': "it passes the bound" if ins.op == OP_CMP else "it goes negative",
+            'non-negative': "it reaches the bound" if ins.op == OP_CMP else "it reaches 0",
+        }[kind]
+        return (lower(*trips), upper(*trips)), (b, before), described
+
+    def _shifted(self, loop, b, setter):
+        # A register shifted right by a constant until it reaches zero, from
+        # a known constant start.
+        ins = self.code[setter]
+        reg = ins.r
+        if ins.a_imm or ins.a != reg or not ins.b_imm or ins.b < 1 \
+                or loop.defs.get(reg) != [setter]:
+            return None
+        start = self._value_before(reg, loop, frozenset())
+        if start is None or not (start[0].is_constant() and start[1].is_constant()):
+            return None
+        trips = []
+        for value in (start[0].constant, start[1].constant):
+            value, count = int(value) & 0xFFFF, 1
+            while value >> ins.b:
+                value >>= ins.b
+                count += 1
+            trips.append(Poly({(): count}))
+        return ((lower(*trips), upper(*trips)), None,
+                f"R{reg} >>= {ins.b}, exits when it reaches 0")
+
+    def _first(self, kind, a, slope):
+        # First iteration i >= 1 with the exit condition on a + slope * i.
+        if kind == 'zero':
+            trips = -a / slope
+        elif kind == 'negative' and slope < 0:
+            trips = a / -slope + 1
+            if a.is_constant():
+                trips = Poly({(): (a.constant // -slope) + 1})
+        elif kind == 'non-negative' and slope > 0:
+            trips = -a / slope
+            if a.is_constant():
+                trips = Poly({(): -((a.constant) // slope)})
+        else:
+            return None
+        if trips.is_constant():
+            value = trips.constant
+            if kind == 'zero' and (value.denominator != 1 or value < 1):
+                return None
+            trips = Poly({(): max(value, 1)})
+        return trips
+
+    # --- bounds ---
+
+    def _bounds(self, algebra, goal):
+        # (best, worst) over the paths from IP 0 to `goal`; NO_PATH if there
+        # are none and None if unbounded.
+        if not self.code:
+            return NO_PATH, NO_PATH
+        return tuple(self._walk(0, None, goal, mode, algebra, {})
+                     for mode in ('best', 'worst'))
+
+    def _walk(self, node, region, goal, mode, algebra, memo):
+        key = (node, region.header if region else None, goal)
+        if key in memo:
+            if memo[key] is IN_PROGRESS:
+                self._inexact("irreducible control flow")
+                return None
+            return memo[key]
+        memo[key] = IN_PROGRESS
+
+        child = self.loops.get(node)
+        if child is not None and child is not region:
+            trips = child.trips[0 if mode == 'best' else 1]
+            iteration = self._walk(node, child, 'latch', mode, algebra, memo)
+            exit = self._walk(node, child, 'exit', mode, algebra, memo)
+            if exit is NO_PATH:
+                value = NO_PATH
+            else:
+                if iteration is NO_PATH:
+                    iteration = None
+                looped = algebra.repeat(mode, trips, iteration, exit)
+                value = self._continue(
+                    [(t, 0) for _, t, _ in child.exits], looped, region, goal, mode,
+                    algebra, memo)
+        else:
+            value = self._continue(self.succs[node], algebra.block(node), region, goal, mode,
+                                   algebra, memo)
+        memo[key] = value
+        return value
+
+    def _continue(self, edges, here, region, goal, mode, algebra, memo):
+        options = []
+        for t, extra in edges:
+            value = self._follow(t, extra, region, goal, mode, algebra, memo)
+            if value is not NO_PATH:
+                options.append(value)
+        if not options:
+            return NO_PATH
+        return algebra.seq(mode, here, algebra.choose(mode, options))
+
+    def _follow(self, t, extra, region, goal, mode, algebra, memo):
+        edge = algebra.edge(extra)
+        if region is not None and t == region.header:
+            return edge if goal == 'latch' else NO_PATH
+        if t in (HALT, FAULT) or (region is not None and t not in region.blocks):
+            if goal == 'exit' or goal == 'end' or (goal == 'halt' and t == HALT):
+                return edge
+            return NO_PATH
+        value = self._walk(t, region, goal, mode, algebra, memo)
+        return value if value is NO_PATH else algebra.seq(mode, edge, value)
+
+    # --- checks ---
+
+    def _threshold(self, poly, limit):
+        # Smallest value of the poly's single symbol for which it exceeds
+        # `limit`, scanning 1..32767; None if never or not a single symbol.
+        if poly is None or len(poly.symbols()) != 1:
+            return None
+        name = poly.symbols()[0]
+        return next((value for value in range(1, 32768)
+                     if poly.evaluate({name: value}) > limit), None)
+
+    def _exceeds(self, best, worst, limit, what, unit, errors, warnings):
+        # A None bound is unknown: no claim about every run, and for the worst
+        # case only a warning that a run may exceed the limit.
+        if best is not None and best.is_constant() and best.constant > limit:
+            errors.append(f"every run {what.format('s')} (at least {best} {unit})")
+            return
+        at_best = self._threshold(best, limit)
+        if at_best is not None:
+            warnings.append(f"every run {what.format('s')} for {best.symbols()[0]} >= {at_best}")
+        at_worst = self._threshold(worst, limit)
+        if worst is None:
+            unbounded = any(loop.trips[1] is None for loop in self.loops.values())
+            reason = "a loop has no trip count bound" if unbounded else "no bound is known"
+            warnings.append(f"may {what.format('')}: {reason}")
+        elif at_worst is not None and at_worst != at_best:
+            warnings.append(f"may {what.format('')} for {worst.symbols()[0]} >= {at_worst}")
+        elif worst.is_constant() and worst.constant > limit:
+            warnings.append(f"may {what.format('')} (up to {worst} {unit})")
+
+    def _check(self):
+        errors, warnings = [], []
+        best, worst = self.cycles
+        if self.code and best is NO_PATH:
+            errors.append("no path reaches HLT: every run faults or hits the cycle limit")
+        elif best is not NO_PATH:
+            self._exceeds(best, worst, Cosmo8.CYCLE_LIMIT, "exceed{} the cycle limit",
+                          "cycles", errors, warnings)
+        best, worst = self.stack
+        if best is not NO_PATH:
+            self._exceeds(best and best[1], worst and worst[1], Cosmo8.STACK_DEPTH,
+                          "overflow{} the stack", "entries", errors, warnings)
+
+        for ip, ins in enumerate(self.code):
+            if ins.op == OP_BAD and self.block_of[ip] in self.reachable:
+                warnings.append(f"IP {ip} faults when reached: {ins.a}")
+        if not self.exact:
+            warnings.append(f"analysis is approximate: {'; '.join(self.notes)}")
+            return [], warnings + [f"(not proven) {e}" for e in errors]
+        return errors, warnings
+
+
+def _bound_text(bounds, unit):
+    best, worst = bounds
+    if best is NO_PATH:
+        return "no path reaches HLT" if unit == 'cycles' else "no path ends"
+    best = "unbounded" if best is None else str(best)
+    worst = "unbounded" if worst is None else str(worst)
+    return f"best {best}, worst {worst} {unit}"
+
+
+def report(analysis, source=None, out=sys.stdout):
+    code = analysis.code
+    where = instruction_lines(source) if source else None
+    names = {}
+    if source:
+        for label, address in label_addresses(source).items():
+            names.setdefault(address, label)
+
+    def place(ip):
+        text = f"IP {ip}"
+        if where and ip < len(where):
+            text += f" (line {where[ip] + 1})"
+        return text
+
+    print(f"Instructions: {len(code)}, basic blocks: {len(analysis.blocks)}", file=out)
+    for ip, name in analysis.symbols.items():
+        print(f"  {name} = value read at {place(ip)}", file=out)
+
+    if analysis.dead:
+        runs = []
+        for ip in analysis.dead:
+            if runs and runs[-1][1] == ip - 1:
+                runs[-1][1] = ip
+            else:
+                runs.append([ip, ip])
+        print("Dead code: " + ', '.join(place(a) if a == b else f"{place(a)} to {place(b)}"
+                                        for a, b in runs), file=out)
+    else:
+        print("Dead code: none", file=out)
+
+    loops = sorted(analysis.loops.values(), key=lambda loop: loop.header)
+    print(f"Loops: {len(loops) or 'none'}", file=out)
+    for loop in loops:
+        ips = [ip for b in loop.blocks for ip in range(b, analysis.blocks[b])]
+        label = f" '{names[loop.header]}'" if loop.header in names else ''
+        indent = '  ' * (loop.depth() + 1)
+        lo, hi = loop.trips
+        if lo is None:
+            trips = "never exits"
+        elif hi is None:
+            trips = "trip count unknown"
+        elif lo == hi:
+            trips = f"runs {lo} times"
+        else:
+            trips = f"runs {lo} to {hi} times"
+        counter = f" ({loop.counter})" if loop.counter else ''
+        print(f"{indent}{place(min(ips))} to {place(max(ips))}{label}: {trips}{counter}",
+              file=out)
+
+    print(f"Cycles: {_bound_text(analysis.cycles, 'cycles')}", file=out)
+    best_stack, worst_stack = analysis.stack
+    peaks = tuple(v if v in (None, NO_PATH) else v[1] for v in (best_stack, worst_stack))
+    print(f"Stack depth: {_bound_text(peaks, 'entries')}", file=out)
+    for error in analysis.errors:
+        print(f"Error: {error}", file=out)
+    for warning in analysis.warnings:
+        print(f"Warning: {warning}", file=out)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Cosmo-8 static analyzer: control flow, "
+                                                 "dead code, loop bounds and cycle estimates")
+    parser.add_argument("program", help="Path to assembly source file")
+    parser.add_argument("--costs", type=str, default=None,
+                        help=f"Cycle cost model: a preset ({', '.join(COST_MODELS)}) and/or "
+                             "OP=cycles overrides, e.g. 'hardware,MUL=4'")
+    args = parser.parse_args()
+
+    with open(args.program) as f:
+        source = f.read()
+    try:
+        code, _ = load_program(source)
+        analysis = Analysis(code, args.costs)
+    except CosmoError as e:
+        print(f"Parse error: {e}", file=sys.stderr)
+        sys.exit(1)
+    except ValueError as e:
+        parser.error(str(e))
+    report(analysis, source)
+    sys.exit(1 if analysis.errors else 0)
+
+
+if __name__ == "__main__":
+    main()
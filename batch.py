@@ -0,0 +1,317 @@
+import numpy as np
+
+from sim import (
+    Cosmo8, parse, decode, s16, cost_table,
+    OP_HLT, OP_NOP, OP_MOV, OP_ADD, OP_SUB, OP_MUL, OP_MOD, OP_AND, OP_OR,
+    OP_XOR, OP_NOT, OP_SHL, OP_SHR, OP_CMP, OP_LOAD, OP_STORE, OP_JMP, OP_JZ,
+    OP_JNZ, OP_JN, OP_JC, OP_CALL, OP_RET, OP_PUSH, OP_POP, OP_READ, OP_WRITE,
+    OP_BAD,
+)
+
+# Lockstep batch simulator: N independent Cosmo-8 machines running the same
+# program, one per input vector, with all state held in NumPy arrays. Each step
+# groups the running lanes by IP and executes every distinct instruction once
+# for all lanes sitting on it, so lanes that diverge (different loop trip
+# counts, different branches) still share work. Lanes that halt or fault are
+# masked out. Arithmetic is done in int64 and wrapped to 16 bits with the same
+# rules as the scalar Cosmo8, including the carry flag and fault messages.
+
+
+def _wrap(values):
+    return ((values + 0x8000) & 0xFFFF) - 0x8000
+
+
+class BatchCosmo8:
+    CYCLE_LIMIT = Cosmo8.CYCLE_LIMIT
+    MEM_SIZE = Cosmo8.MEM_SIZE
+    STACK_DEPTH = Cosmo8.STACK_DEPTH
+    NUM_REGS = Cosmo8.NUM_REGS
+
+    def __init__(self, program, inputs, costs=None):
+        self.code = decode(program)
+        self.op_costs, self.taken_extra = cost_table(Cosmo8.COSTS if costs is None else costs)
+        lanes = len(inputs)
+        self.lanes = lanes
+        self.regs = np.zeros((lanes, self.NUM_REGS), dtype=np.int16)
+        self.memory = np.zeros((lanes, self.MEM_SIZE), dtype=np.int16)
+        self.stack = np.zeros((lanes, self.STACK_DEPTH), dtype=np.int16)
+        self.ip = np.zeros(lanes, dtype=np.int64)
+        self.sp = np.zeros(lanes, dtype=np.int64)
+        self.flag_z = np.zeros(lanes, dtype=bool)
+        self.flag_c = np.zeros(lanes, dtype=bool)
+        self.flag_n = np.zeros(lanes, dtype=bool)
+        self.cycles = np.zeros(lanes, dtype=np.int64)
+
+        width = max((len(values) for values in inputs), default=0)
+        self.inputs = np.zeros((lanes, max(width, 1)), dtype=np.int16)
+        self.input_len = np.zeros(lanes, dtype=np.int64)
+        for lane, values in enumerate(inputs):
+            self.inputs[lane, :len(values)] = [s16(v) for v in values]
+            self.input_len[lane] = len(values)
+        self.input_idx = np.zeros(lanes, dtype=np.int64)
+
+        self.out_values = np.zeros((lanes, 16), dtype=np.int16)
+        self.out_ports = np.zeros((lanes, 16), dtype=np.int64)
+        self.out_count = np.zeros(lanes, dtype=np.int64)
+
+        self.running = np.ones(lanes, dtype=bool)
+        self.halted = np.zeros(lanes, dtype=bool)
+        self.errors = [None] * lanes
+
+    def outputs(self, lane):
+        count = self.out_count[lane]
+        return [(int(p), int(v)) for p, v in zip(self.out_ports[lane, :count],
+                                                 self.out_values[lane, :count])]
+
+    def output_values(self, lane):
+        return self.out_values[lane, :self.out_count[lane]].tolist()
+
+    def _fault(self, idx, message):
+        self.running[idx] = False
+        for i, lane in enumerate(idx.tolist()):
+            self.errors[lane] = message(i) if callable(message) else message
+
+    def run(self):
+        code = self.code
+        n = len(code)
+        limit = self.CYCLE_LIMIT
+
+        while True:
+            lanes = np.flatnonzero(self.running)
+            if not len(lanes):
+                return
+            ips = self.ip[lanes]
+
+            over = self.cycles[lanes] >= limit
+            if over.any():
+                self._fault(lanes[over], f"Cycle limit exceeded ({limit})")
+                lanes, ips = lanes[~over], ips[~over]
+
+            off = ips >= n
+            if off.any():
+                stopped = ips[off]
+                self._fault(lanes[off],
+                            lambda i: f"Execution fell off end of program at IP={stopped[i]}")
+                lanes, ips = lanes[~off], ips[~off]
+
+            bad = ips < -n
+            if bad.any():
+                stopped = ips[bad]
+                self._fault(lanes[bad], lambda i: f"Invalid instruction address: IP={stopped[i]}")
+                lanes, ips = lanes[~bad], ips[~bad]
+
+            if not len(lanes):
+                continue
+            if ips[0] == ips.min() == ips.max():
+                groups = [(int(ips[0]), lanes)]
+            else:
+                order = np.argsort(ips, kind='stable')
+                sorted_ips = ips[order]
+                starts = np.flatnonzero(np.diff(sorted_ips)) + 1
+                groups = zip(sorted_ips[np.r_[0, starts]].tolist(),
+                             np.split(lanes[order], starts))
+
+            for ip, idx in groups:
+                self.cycles[idx] += self.op_costs[code[ip].op]
+                self._execute(ip, code[ip], idx)
+
+    def _source(self, idx, value, imm):
+        if imm:
+            return np.int64(value)
+        return self.regs[idx, value].astype(np.int64)
+
+    def _set_zn(self, idx, result):
+        self.flag_z[idx] = result == 0
+        self.flag_n[idx] = result < 0
+
+    def _check_mem(self, idx, addr):
+        addr = np.broadcast_to(addr, idx.shape)
+        bad = (addr < 0) | (addr >= self.MEM_SIZE)
+        if bad.any():
+            addrs = addr[bad]
+            self._fault(idx[bad], lambda i: f"Memory access out of bounds: address {addrs[i]}")
+            return idx[~bad], addr[~bad]
+        return idx, addr
+
+    def _push(self, idx, values):
+        sp = self.sp[idx]
+        full = sp >= self.STACK_DEPTH
+        if full.any():
+            sps = sp[full]
+            self._fault(idx[full], lambda i: f"Stack overflow: SP={sps[i]}")
+            idx, sp = idx[~full], sp[~full]
+            values = values if np.ndim(values) == 0 else values[~full]
+        self.stack[idx, sp] = values
+        self.sp[idx] = sp + 1
+        return idx
+
+    def _pop(self, idx):
+        sp = self.sp[idx]
+        empty = sp <= 0
+        if empty.any():
+            sps = sp[empty]
+            self._fault(idx[empty], lambda i: f"Stack underflow: SP={sps[i]}")
+            idx, sp = idx[~empty], sp[~empty]
+        sp = sp - 1
+        self.sp[idx] = sp
+        return idx, self.stack[idx, sp].astype(np.int64)
+
+    def _grow_outputs(self, needed):
+        width = self.out_values.shape[1]
+        while width < needed:
+            width *= 2
+        extra = width - self.out_values.shape[1]
+        self.out_values = np.pad(self.out_values, ((0, 0), (0, extra)))
+        self.out_ports = np.pad(self.out_ports, ((0, 0), (0, extra)))
+
+    def _execute(self, ip, ins, idx):
+        op = ins.op
+        nxt = ip + 1
+
+        if op == OP_HLT:
+            self.running[idx] = False
+            self.halted[idx] = True
+            return
+
+        if op == OP_BAD:
+            self._fault(idx, ins.a)
+            return
+
+        if op in (OP_JMP, OP_JZ, OP_JNZ, OP_JN, OP_JC):
+            if op == OP_JMP:
+                self.ip[idx] = ins.a
+            else:
+                flag = {OP_JZ: self.flag_z, OP_JNZ: self.flag_z,
+                        OP_JN: self.flag_n, OP_JC: self.flag_c}[op][idx]
+                if op == OP_JNZ:
+                    flag = ~flag
+                self.ip[idx] = np.where(flag, ins.a, nxt)
+                if self.taken_extra[op] and ins.a != nxt:
+                    self.cycles[idx] += np.where(flag, self.taken_extra[op], 0)
+            return
+
+        if op == OP_CALL:
+            idx = self._push(idx, np.int64(nxt))
+            self.ip[idx] = ins.a
+            return
+
+        if op == OP_RET:
+            idx, target = self._pop(idx)
+            self.ip[idx] = target
+            return
+
+        a = self._source(idx, ins.a, ins.a_imm)
+        b = self._source(idx, ins.b, ins.b_imm)
+        r = ins.r
+
+        if op == OP_NOP:
+            pass
+
+        elif op == OP_MOV:
+            self._set_zn(idx, a)
+            self.regs[idx, r] = a
+
+        elif op in (OP_ADD, OP_SUB, OP_CMP):
+            if op == OP_ADD:
+                result = _wrap(a + b)
+                carry = (a & 0xFFFF) + (b & 0xFFFF) > 0xFFFF
+            else:
+                result = _wrap(a - b)
+                carry = (a & 0xFFFF) < (b & 0xFFFF)
+            self._set_zn(idx, result)
+            self.flag_c[idx] = carry
+            if op != OP_CMP:
+                self.regs[idx, r] = result
+
+        elif op == OP_MUL:
+            raw = a * b
+            result = _wrap(raw)
+            self._set_zn(idx, result)
+            self.flag_c[idx] = raw != result
+            self.regs[idx, r] = result
+
+        elif op == OP_MOD:
+            zero = np.broadcast_to(b == 0, idx.shape)
+            if zero.any():
+                self._fault(idx[zero], "Division by zero in MOD")
+                idx = idx[~zero]
+                a = a if np.ndim(a) == 0 else a[~zero]
+                b = b if np.ndim(b) == 0 else b[~zero]
+                if not len(idx):
+                    return
+            result = _wrap(np.fmod(a, b))
+            self._set_zn(idx, result)
+            self.flag_c[idx] = False
+            self.regs[idx, r] = result
+
+        elif op in (OP_AND, OP_OR, OP_XOR, OP_NOT):
+            if op == OP_AND:
+                result = a & b
+            elif op == OP_OR:
+                result = a | b
+            elif op == OP_XOR:
+                result = a ^ b
+            else:
+                result = ~a
+            self._set_zn(idx, result)
+            self.regs[idx, r] = result
+
+        elif op in (OP_SHL, OP_SHR):
+            val = a & 0xFFFF
+            amt = np.broadcast_to(b, idx.shape)
+            shift = np.clip(amt, 1, 16)
+            if op == OP_SHL:
+                raw = (val << shift) & 0xFFFF
+                carry = ((val >> (16 - shift)) & 1).astype(bool)
+            else:
+                raw = val >> shift
+                carry = ((val >> (shift - 1)) & 1).astype(bool)
+            raw = np.where(amt <= 0, val, np.where(amt > 16, 0, raw))
+            carry = np.where((amt <= 0) | (amt > 16), False, carry)
+            result = _wrap(raw)
+            self._set_zn(idx, result)
+            self.flag_c[idx] = carry
+            self.regs[idx, r] = result
+
+        elif op == OP_LOAD:
+            idx, addr = self._check_mem(idx, a)
+            self.regs[idx, r] = self.memory[idx, addr]
+
+        elif op == OP_STORE:
+            idx, addr = self._check_mem(idx, a)
+            self.memory[idx, addr] = self.regs[idx, r]
+
+        elif op == OP_PUSH:
+            idx = self._push(idx, a)
+
+        elif op == OP_POP:
+            idx, values = self._pop(idx)
+            self.regs[idx, r] = values
+
+        elif op == OP_READ:
+            pos = self.input_idx[idx]
+            empty = pos >= self.input_len[idx]
+            if empty.any():
+                self._fault(idx[empty],
+                            f"No input available on port {ins.a} (all inputs consumed)")
+                idx, pos = idx[~empty], pos[~empty]
+            self.regs[idx, r] = self.inputs[idx, pos]
+            self.input_idx[idx] = pos + 1
+
+        elif op == OP_WRITE:
+            count = self.out_count[idx]
+            if len(count) and count.max() >= self.out_values.shape[1]:
+                self._grow_outputs(int(count.max()) + 1)
+            self.out_values[idx, count] = self.regs[idx, r]
+            self.out_ports[idx, count] = ins.a
+            self.out_count[idx] = count + 1
+
+        self.ip[idx] = nxt
+
+
+def run_batch(source, inputs, costs=None):
+    program, _ = parse(source)
+    machine = BatchCosmo8(program, inputs, costs)
+    machine.run()
+    return [machine.output_values(lane) if machine.errors[lane] is None else None
+            for lane in range(machine.lanes)]
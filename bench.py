@@ -0,0 +1,179 @@
+import sys
+import os
+import argparse
+import json
+import platform
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from sim import Cosmo8, CosmoError, ENGINES, decode, _parse_source
+from challenge import CHALLENGES, SOLUTION_FILENAMES, SOLUTION_DIRS, run_test
+
+# Simulator benchmark over the shipped solution sets. For every solution and
+# challenge it measures assembling from scratch (parse + decode, bypassing the
+# program cache), executing every test on a fresh Cosmo8 (simulated cycles per
+# second), and the harness path end to end (run_test for each test, as
+# challenge.py does). Each figure is the best of --repeat timing rounds.
+
+
+def best_time(fn, repeat, min_time):
+    # Seconds per call of fn(): each round calls it until at least `min_time`
+    # has passed, and the fastest round wins.
+    best = float("inf")
+    for _ in range(repeat):
+        calls = 0
+        start = time.perf_counter()
+        while True:
+            fn()
+            calls += 1
+            elapsed = time.perf_counter() - start
+            if elapsed >= min_time:
+                break
+        best = min(best, elapsed / calls)
+    return best
+
+
+def bench_solution(source, tests, engine, repeat, min_time):
+    code = decode(_parse_source(source)[0])
+    cycles = 0
+
+    def assemble():
+        decode(_parse_source(source)[0])
+
+    def execute():
+        nonlocal cycles
+        cycles = 0
+        for test in tests:
+            machine = Cosmo8(code, inputs=test["input"], engine=engine)
+            try:
+                machine.run()
+            except CosmoError:
+                pass
+            cycles += machine.cycles
+
+    def harness():
+        for test in tests:
+            run_test(source, test["input"])
+
+    parse_time = best_time(assemble, repeat, min_time)
+    run_time = best_time(execute, repeat, min_time)
+    wall_time = best_time(harness, repeat, min_time)
+    return {
+        "cycles": cycles,
+        "cycles_per_sec": cycles / run_time,
+        "parse_ms": parse_time * 1000,
+        "run_ms": run_time * 1000,
+        "wall_ms": wall_time * 1000,
+    }
+
+
+def run_bench(solutions_dirs, engine, repeat, min_time):
+    results = {}
+    for solutions_dir in solutions_dirs:
+        for challenge in CHALLENGES:
+            path = os.path.join(solutions_dir, SOLUTION_FILENAMES[challenge["number"]])
+            try:
+                with open(path) as f:
+                    source = f.read()
+                _parse_source(source)
+            except (OSError, CosmoError):
+                continue
+            results[path] = bench_solution(source, challenge["tests"], engine, repeat,
+                                           min_time)
+    return results
+
+
+def summarize(results):
+    cycles = sum(r["cycles"] for r in results.values())
+    run_ms = sum(r["run_ms"] for r in results.values())
+    return {
+        "cycles": cycles,
+        "cycles_per_sec": cycles / (run_ms / 1000) if run_ms else 0.0,
+        "parse_ms": sum(r["parse_ms"] for r in results.values()),
+        "run_ms": run_ms,
+        "wall_ms": sum(r["wall_ms"] for r in results.values()),
+    }
+
+
+def print_results(results, total):
+    print(f"{'Solution':<42} {'Cycles':>8} {'Mcyc/s':>8} {'Parse ms':>9} {'Wall ms':>9}")
+    print("-" * 80)
+    rows = list(results.items()) + [("TOTAL", total)]
+    for path, r in rows:
+        if path == "TOTAL":
+            print("-" * 80)
+        print(f"{path:<42} {r['cycles']:>8} {r['cycles_per_sec'] / 1e6:>8.2f} "
+              f"{r['parse_ms']:>9.3f} {r['wall_ms']:>9.3f}")
+
+
+def compare(report, baseline, threshold):
+    # A regression is throughput falling, or parse/wall time rising, by more
+    # than `threshold` (a fraction) relative to the baseline.
+    regressions = []
+    pairs = [("TOTAL", report["total"], baseline.get("total"))]
+    pairs += [(path, r, baseline.get("results", {}).get(path))
+              for path, r in report["results"].items()]
+    for path, new, old in pairs:
+        if old is None:
+            continue
+        if old["cycles_per_sec"] and \
+                new["cycles_per_sec"] < old["cycles_per_sec"] * (1 - threshold):
+            regressions.append((path, "cycles_per_sec", old["cycles_per_sec"],
+                                new["cycles_per_sec"]))
+        for key in ("parse_ms", "wall_ms"):
+            if old[key] and new[key] > old[key] * (1 + threshold):
+                regressions.append((path, key, old[key], new[key]))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Cosmo-8 Simulator Benchmark")
+    parser.add_argument("--solutions-dir", type=str, nargs="+", default=SOLUTION_DIRS,
+                        help="Solution directories to benchmark (default: all shipped sets)")
+    parser.add_argument("--engine", choices=ENGINES, default=Cosmo8.ENGINE,
+                        help="Execution engine")
+    parser.add_argument("--repeat", type=int, default=5,
+                        help="Timing rounds per measurement; the best is reported (default: 5)")
+    parser.add_argument("--min-time", type=float, default=0.02,
+                        help="Minimum seconds per timing round (default: 0.02)")
+    parser.add_argument("--output", type=str, default=None,
+                        help="Write the results as JSON to this file")
+    parser.add_argument("--baseline", type=str, default=None,
+                        help="JSON results of an earlier run to compare against")
+    parser.add_argument("--threshold", type=float, default=0.10,
+                        help="Relative slowdown that counts as a regression (default: 0.10)")
+    args = parser.parse_args()
+
+    results = run_bench(args.solutions_dir, args.engine, args.repeat, args.min_time)
+    report = {
+        "python": platform.python_version(),
+        "engine": args.engine,
+        "repeat": args.repeat,
+        "min_time": args.min_time,
+        "results": results,
+        "total": summarize(results),
+    }
+    print_results(results, report["total"])
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"\nResults written to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(report, baseline, args.threshold)
+        print()
+        if not regressions:
+            print(f"No regressions beyond {args.threshold:.0%} against {args.baseline}")
+            return
+        print(f"REGRESSIONS beyond {args.threshold:.0%} against {args.baseline}:")
+        for path, key, old, new in regressions:
+            print(f"  {path}: {key} {old:.6g} -> {new:.6g} ({new / old - 1:+.1%})")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
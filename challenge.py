@@ -1,7 +1,17 @@
-from sim import run_program, parse, CosmoError
+from sim import (Cosmo8, load_program, parse, CosmoError, PROGRAM_CACHE, configure_cache,
+                 COST_MODELS, cost_table)
+from oracles import fuzz, exhaustive
 import sys
 import os
 import argparse
+import contextlib
+import functools
+import hashlib
+import io
+import json
+import time
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
 
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 
@@ -19,6 +29,7 @@ CHALLENGES = [
             {"input": [0], "expected": [0]},
         ],
         "thresholds": {"gold": 8, "silver": 10},
+        "cycle_thresholds": {"gold": 65, "silver": 100},
     },
     {
         "number": 2,
@@ -32,6 +43,7 @@ CHALLENGES = [
             {"input": [4, 0, 0, 0, 1], "expected": [1, 0, 0, 0]},
         ],
         "thresholds": {"gold": 13, "silver": 15},
+        "cycle_thresholds": {"gold": 120, "silver": 180},
     },
     {
         "number": 3,
@@ -45,6 +57,7 @@ CHALLENGES = [
             {"input": [2], "expected": [1, 1]},
         ],
         "thresholds": {"gold": 9, "silver": 13},
+        "cycle_thresholds": {"gold": 110, "silver": 165},
     },
     {
         "number": 4,
@@ -59,6 +72,7 @@ CHALLENGES = [
             {"input": [6, 5, 5, 5, 1, 1, 1], "expected": [1, 1, 1, 5, 5, 5]},
         ],
         "thresholds": {"gold": 18, "silver": 25},
+        "cycle_thresholds": {"gold": 610, "silver": 900},
     },
     {
         "number": 5,
@@ -72,6 +86,7 @@ CHALLENGES = [
             {"input": [30], "expected": [2, 3, 5, 7, 11, 13, 17, 19, 23, 29]},
         ],
         "thresholds": {"gold": 20, "silver": 28},
+        "cycle_thresholds": {"gold": 820, "silver": 1200},
     },
     {
         "number": 6,
@@ -85,6 +100,7 @@ CHALLENGES = [
             {"input": [0, 1, 1, 0, 1, 2, 3, 4], "expected": [3, 4, 1, 2]},
         ],
         "thresholds": {"gold": 22, "silver": 30},
+        "cycle_thresholds": {"gold": 420, "silver": 630},
     },
     {
         "number": 7,
@@ -99,6 +115,7 @@ CHALLENGES = [
             {"input": [1, 42], "expected": [42]},
         ],
         "thresholds": {"gold": 13, "silver": 18},
+        "cycle_thresholds": {"gold": 110, "silver": 165},
     },
     {
         "number": 8,
@@ -114,6 +131,7 @@ CHALLENGES = [
             {"input": [7, 2, 4, 6, 8, 10, 12, 14, 15], "expected": [0]},
         ],
         "thresholds": {"gold": 16, "silver": 22},
+        "cycle_thresholds": {"gold": 250, "silver": 375},
     },
     {
         "number": 9,
@@ -130,6 +148,7 @@ CHALLENGES = [
                 "expected": [0, 2, 1, 3, 0, 3]},
         ],
         "thresholds": {"gold": 13, "silver": 18},
+        "cycle_thresholds": {"gold": 210, "silver": 315},
     },
     {
         "number": 10,
@@ -149,6 +168,7 @@ CHALLENGES = [
             {"input": [624], "expected": [24]},
         ],
         "thresholds": {"gold": 11, "silver": 15},
+        "cycle_thresholds": {"gold": 550, "silver": 825},
     },
 ]
 
@@ -165,6 +185,9 @@ SOLUTION_FILENAMES = {
     10: "10_isqrt.asm",
 }
 
+SOLUTION_DIRS = ["solutions", "zuqini_solutions", "ai_solutions_reference",
+                 "ai_solutions_explained"]
+
 
 def get_tier(instruction_count, thresholds):
     if instruction_count <= thresholds["gold"]:
@@ -174,6 +197,22 @@ def get_tier(instruction_count, thresholds):
     return "Bronze"
 
 
+TIERS = ("Gold", "Silver", "Bronze")
+SCORE_MODES = ("size", "cycles", "both")
+
+
+def score_tier(challenge, instruction_count, total_cycles, score="size"):
+    # "size" ranks on static instruction count, "cycles" on the cycles used
+    # over all tests, and "both" gives the lower of the two tiers.
+    size_tier = get_tier(instruction_count, challenge["thresholds"])
+    cycle_tier = get_tier(total_cycles, challenge["cycle_thresholds"])
+    if score == "size":
+        return size_tier
+    if score == "cycles":
+        return cycle_tier
+    return max(size_tier, cycle_tier, key=TIERS.index)
+
+
 def show_challenge(challenge):
     print(f"Challenge {challenge['number']}: {challenge['name']}")
     print(f"  {challenge['description']}")
@@ -187,9 +226,271 @@ def show_challenge(challenge):
     print(f"    Gold:   <= {challenge['thresholds']['gold']}")
     print(f"    Silver: <= {challenge['thresholds']['silver']}")
     print(f"    Bronze: correct output")
+    print()
+    print("  Cycle thresholds (total cycles over all tests, --score cycles):")
+    print(f"    Gold:   <= {challenge['cycle_thresholds']['gold']}")
+    print(f"    Silver: <= {challenge['cycle_thresholds']['silver']}")
 
 
-def run_challenge(challenge, solution_path):
+def run_test(source, inputs, detect_loops=False, costs=None):
+    # Returns (outputs, error, cycles); outputs is None if the run failed.
+    machine = None
+    try:
+        program, _ = load_program(source)
+        machine = Cosmo8(program, inputs=inputs, detect_loops=detect_loops, costs=costs)
+        machine.run()
+    except CosmoError as e:
+        return None, str(e), machine.cycles if machine else 0
+    return [val for _, val in machine.outputs], None, machine.cycles
+
+
+Evaluation = namedtuple('Evaluation', 'passed instructions cycles error')
+
+
+class CandidateEvaluator:
+    # Pass/fail, instruction count and total cycles of many candidate
+    # programs for one challenge, printing nothing. A candidate stops at its
+    # first failing test, and tests are kept ordered by how often they have
+    # failed so far, so the ones most likely to reject the next candidate run
+    # first. Programs come from PROGRAM_CACHE, so identical sources share one
+    # decoded program, and every run reuses a single Cosmo8 through reset().
+    def __init__(self, challenge, engine=None, detect_loops=False, costs=None):
+        self.challenge = challenge
+        self.engine = engine
+        self.detect_loops = detect_loops
+        self.costs = costs
+        self.tests = [(test["input"], test["expected"]) for test in challenge["tests"]]
+        self.order = list(range(len(self.tests)))
+        self.failures = [0] * len(self.tests)
+        self.machine = None
+
+    def evaluate(self, source):
+        try:
+            program, instruction_count = load_program(source)
+        except CosmoError as e:
+            return Evaluation(False, None, None, f"Parse error: {e}")
+        machine = self.machine
+        if machine is None:
+            machine = self.machine = Cosmo8(program, engine=self.engine,
+                                            detect_loops=self.detect_loops, costs=self.costs)
+
+        total = 0
+        for i in self.order:
+            inputs, expected = self.tests[i]
+            machine.reset(inputs, program)
+            try:
+                machine.run()
+            except CosmoError as e:
+                return self._fail(i, instruction_count, f"Test {i + 1}: runtime error: {e}")
+            if [val for _, val in machine.outputs] != expected:
+                return self._fail(i, instruction_count, f"Test {i + 1}: wrong output")
+            total += machine.cycles
+        return Evaluation(True, instruction_count, total, None)
+
+    def _fail(self, i, instruction_count, error):
+        self.failures[i] += 1
+        self.order.sort(key=lambda j: -self.failures[j])
+        return Evaluation(False, instruction_count, None, error)
+
+    def evaluate_all(self, sources):
+        return [self.evaluate(source) for source in sources]
+
+
+def evaluate_candidates(challenge, sources, engine=None, detect_loops=False, costs=None):
+    evaluator = CandidateEvaluator(challenge, engine, detect_loops, costs)
+    return evaluator.evaluate_all(sources)
+
+
+def _run_test_job(job):
+    return run_test(*job)
+
+
+def run_tests_parallel(tasks, jobs, detect_loops=False, costs=None):
+    # Fans (solution, test) pairs out to a process pool. Returns the outcomes
+    # of each solution's tests keyed by path, in test order, so printing and
+    # scoring stay deterministic regardless of which worker finishes first.
+    batch = []
+    for challenge, solution_path in tasks:
+        try:
+            with open(solution_path) as f:
+                source = f.read()
+            parse(source)
+        except (OSError, CosmoError):
+            continue
+        for test in challenge["tests"]:
+            batch.append((solution_path, source, test["input"]))
+
+    with ProcessPoolExecutor(max_workers=jobs, initializer=configure_cache,
+                             initargs=(PROGRAM_CACHE.cache_dir,)) as pool:
+        chunksize = max(1, len(batch) // (jobs * 4))
+        outcomes = pool.map(_run_test_job,
+                            [(source, inputs, detect_loops, costs)
+                             for _, source, inputs in batch],
+                            chunksize=chunksize)
+        by_path = {}
+        for (solution_path, _, _), outcome in zip(batch, outcomes):
+            by_path.setdefault(solution_path, []).append(outcome)
+    return by_path
+
+
+def static_errors(source, costs=None):
+    # Problems analyze.py can prove before anything runs: no path reaches HLT,
+    # or every run exceeds the cycle limit or overflows the stack.
+    from analyze import Analysis
+    try:
+        code, _ = load_program(source)
+    except CosmoError:
+        return []
+    return Analysis(code, costs).errors
+
+
+def grade(challenge, source, outcomes=None, detect_loops=False, score="size", costs=None,
+          fuzz_cases=0, fuzz_seed=0, sweep=False, jobs=1, static_check=False):
+    # Grades a solution's source without printing anything, as JSON-ready
+    # data: what run_challenge reports and server.py sends its clients.
+    # `outcomes` are the tests' run_test results when already run elsewhere.
+    result = {
+        "number": challenge["number"],
+        "name": challenge["name"],
+        "passed": False,
+        "instructions": None,
+        "error": None,
+        "static_errors": [],
+        "tests": [],
+        "fuzz": None,
+        "exhaustive": None,
+        "total_cycles": None,
+        "worst_cycles": None,
+        "tier": "-",
+        "size_tier": None,
+        "cycles_tier": None,
+    }
+    try:
+        _, result["instructions"] = parse(source)
+    except CosmoError as e:
+        result["error"] = f"Parse error: {e}"
+        return result
+
+    if static_check:
+        result["static_errors"] = static_errors(source, costs)
+        if result["static_errors"]:
+            return result
+
+    cycles = []
+    for i, test in enumerate(challenge["tests"]):
+        if outcomes is not None:
+            actual, error, test_cycles = outcomes[i]
+        else:
+            actual, error, test_cycles = run_test(source, test["input"], detect_loops, costs)
+        cycles.append(test_cycles)
+        result["tests"].append({"input": test["input"], "expected": test["expected"],
+                                "actual": actual, "error": error,
+                                "passed": error is None and actual == test["expected"],
+                                "cycles": test_cycles})
+    passed = all(test["passed"] for test in result["tests"])
+
+    if passed and fuzz_cases:
+        # Random inputs checked against the challenge's Python oracle.
+        failure = fuzz(source, challenge, fuzz_cases, fuzz_seed, detect_loops=detect_loops,
+                       costs=costs)
+        result["fuzz"] = {"cases": fuzz_cases, "seed": fuzz_seed, "passed": failure is None}
+        if failure is not None:
+            result["fuzz"].update(case=failure.case, inputs=failure.inputs,
+                                  expected=failure.expected, actual=failure.outputs,
+                                  error=failure.error)
+            passed = False
+
+    if passed and sweep:
+        # Every input of the challenge's domain against its Python oracle;
+        # None cases if the domain is too large to enumerate.
+        sweep_result = exhaustive(source, challenge, jobs, costs)
+        if sweep_result is None:
+            result["exhaustive"] = {"cases": None, "passed": True}
+        else:
+            result["exhaustive"] = {
+                "cases": sweep_result.cases,
+                "passed": not sweep_result.failures,
+                "worst_cycles": sweep_result.worst_cycles,
+                "worst_inputs": sweep_result.worst_inputs,
+                "failures": [{"input": inputs, "expected": expected, "actual": outputs,
+                              "error": error}
+                             for inputs, expected, outputs, error in sweep_result.failures],
+            }
+            passed = passed and not sweep_result.failures
+
+    result["passed"] = passed
+    result["total_cycles"] = sum(cycles)
+    result["worst_cycles"] = max(cycles, default=0)
+    if passed:
+        result["tier"] = score_tier(challenge, result["instructions"], sum(cycles), score)
+        result["size_tier"] = score_tier(challenge, result["instructions"], sum(cycles))
+        result["cycles_tier"] = score_tier(challenge, result["instructions"], sum(cycles),
+                                           "cycles")
+    return result
+
+
+def print_grade(result, score="size"):
+    # The report for a grade() result, below run_challenge's header.
+    if result["error"] is not None:
+        print(f"  {result['error']}")
+        return
+    for error in result["static_errors"]:
+        print(f"  Rejected by static analysis: {error}")
+    if result["static_errors"]:
+        return
+
+    for i, test in enumerate(result["tests"], 1):
+        if test["error"] is not None:
+            print(f"  Test {i}: FAIL (runtime error: {test['error']})")
+        elif test["passed"]:
+            print(f"  Test {i}: PASS")
+        else:
+            print(f"  Test {i}: FAIL")
+            print(f"    Input:    {test['input']}")
+            print(f"    Expected: {test['expected']}")
+            print(f"    Actual:   {test['actual']}")
+
+    fuzzed = result["fuzz"]
+    if fuzzed and fuzzed["passed"]:
+        print(f"  Fuzz: PASS ({fuzzed['cases']} random cases, seed {fuzzed['seed']})")
+    elif fuzzed:
+        print(f"  Fuzz: FAIL (case {fuzzed['case'] + 1} of seed {fuzzed['seed']}, shrunk)")
+        print(f"    Input:    {fuzzed['inputs']}")
+        print(f"    Expected: {fuzzed['expected']}")
+        if fuzzed["error"] is not None:
+            print(f"    Error:    {fuzzed['error']}")
+        else:
+            print(f"    Actual:   {fuzzed['actual']}")
+
+    swept = result["exhaustive"]
+    if swept and swept["cases"] is None:
+        print("  Exhaustive: skipped (input domain too large to enumerate)")
+    elif swept:
+        print(f"  Exhaustive: {'PASS' if swept['passed'] else 'FAIL'} ({swept['cases']} inputs, "
+              f"worst case {swept['worst_cycles']} cycles at input {swept['worst_inputs']})")
+        for failure in swept["failures"]:
+            print(f"    Input:    {failure['input']}")
+            print(f"    Expected: {failure['expected']}")
+            if failure["error"] is not None:
+                print(f"    Error:    {failure['error']}")
+            else:
+                print(f"    Actual:   {failure['actual']}")
+
+    print()
+    print(f"  Instructions: {result['instructions']}")
+    print(f"  Cycles: {result['total_cycles']} total, {result['worst_cycles']} worst case")
+    if not result["passed"]:
+        print(f"  Tier: - (not all tests passed)")
+    elif score == "both":
+        print(f"  Tier: {result['tier']} (size: {result['size_tier']}, "
+              f"cycles: {result['cycles_tier']})")
+    else:
+        print(f"  Tier: {result['tier']}")
+
+
+def run_challenge(challenge, solution_path, outcomes=None, detect_loops=False, score="size",
+                  costs=None, fuzz_cases=0, fuzz_seed=0, sweep=False, jobs=1,
+                  static_check=False):
     print(f"Challenge {challenge['number']}: {challenge['name']}")
     print(f"  Solution: {solution_path}")
     print()
@@ -201,50 +502,165 @@ def run_challenge(challenge, solution_path):
         print(f"  Solution file not found: {solution_path}")
         return None
 
-    try:
-        _, instruction_count = parse(source)
-    except CosmoError as e:
-        print(f"  Parse error: {e}")
+    result = grade(challenge, source, outcomes, detect_loops, score, costs, fuzz_cases,
+                   fuzz_seed, sweep, jobs, static_check)
+    print_grade(result, score)
+    if result["error"] is not None or result["static_errors"]:
         return None
-
-    all_passed = True
-    for i, test in enumerate(challenge["tests"], 1):
+    return {key: result[key] for key in ("number", "name", "passed", "instructions",
+                                         "total_cycles", "worst_cycles", "tier")}
+
+
+# Files whose code decides grading results; their contents are part of every
+# result cache key.
+SIMULATOR_FILES = ("sim.py", "jit.py", "oracles.py", "challenge.py", "analyze.py",
+                   "batch.py")
+
+
+@functools.lru_cache(maxsize=None)
+def simulator_version():
+    # Hash of the simulator as loaded by this process.
+    digest = hashlib.sha256()
+    here = os.path.dirname(os.path.abspath(__file__))
+    for name in SIMULATOR_FILES:
+        with open(os.path.join(here, name), "rb") as f:
+            digest.update(f.read())
+    return digest.hexdigest()
+
+
+class ResultCache:
+    # Grading results of single solutions, keyed by the SHA-256 of everything
+    # that decides them: the solution path (which its report names) and
+    # source, the challenge (tests and thresholds), the grading options and
+    # simulator_version(). An entry holds the report run_challenge printed and
+    # the scoreboard row it returned. With a cache_dir, entries are also kept
+    # on disk as JSON, written atomically like ProgramCache's, so later runs
+    # regrade only what changed.
+    VERSION = 1
+
+    def __init__(self, cache_dir=None):
+        self.cache_dir = cache_dir
+        self.entries = {}
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, challenge, solution_path, source, options):
+        data = json.dumps([self.VERSION, simulator_version(), challenge, solution_path, source,
+                           options], sort_keys=True)
+        return hashlib.sha256(data.encode()).hexdigest()
+
+    def __contains__(self, key):
+        return self._load(key) is not None
+
+    def get(self, key):
+        entry = self._load(key)
+        if entry is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return entry
+
+    def _load(self, key):
+        entry = self.entries.get(key)
+        if entry is None and self.cache_dir:
+            try:
+                with open(os.path.join(self.cache_dir, f"{key}.json")) as f:
+                    entry = json.load(f)
+            except (OSError, ValueError):
+                return None
+            self.entries[key] = entry
+        return entry
+
+    def put(self, key, entry):
+        self.entries[key] = entry
+        if not self.cache_dir:
+            return
+        path = os.path.join(self.cache_dir, f"{key}.json")
         try:
-            actual = run_program(source, test["input"])
-        except CosmoError as e:
-            print(f"  Test {i}: FAIL (runtime error: {e})")
-            all_passed = False
-            continue
+            os.makedirs(self.cache_dir, exist_ok=True)
+            tmp = f"{path}.{os.getpid()}.tmp"
+            with open(tmp, "w") as f:
+                json.dump(entry, f)
+            os.replace(tmp, path)
+        except OSError:
+            pass
 
-        if actual == test["expected"]:
-            print(f"  Test {i}: PASS")
-        else:
-            print(f"  Test {i}: FAIL")
-            print(f"    Input:    {test['input']}")
-            print(f"    Expected: {test['expected']}")
-            print(f"    Actual:   {actual}")
-            all_passed = False
 
-    print()
-    print(f"  Instructions: {instruction_count}")
+def _cache_key(cache, challenge, solution_path, options):
+    try:
+        with open(solution_path) as f:
+            source = f.read()
+    except OSError:
+        return None
+    return cache.key(challenge, solution_path, source, options)
 
-    if all_passed:
-        tier = get_tier(instruction_count, challenge["thresholds"])
-        print(f"  Tier: {tier}")
-    else:
-        tier = "-"
-        print(f"  Tier: - (not all tests passed)")
 
-    return {
-        "number": challenge["number"],
-        "name": challenge["name"],
-        "passed": all_passed,
-        "instructions": instruction_count,
-        "tier": tier,
-    }
+def _statically_rejected(solution_path, costs):
+    try:
+        with open(solution_path) as f:
+            source = f.read()
+    except OSError:
+        return False
+    return bool(static_errors(source, costs))
+
+
+def run_all(solutions_dirs, jobs=1, detect_loops=False, score="size", costs=None,
+            fuzz_cases=0, fuzz_seed=0, cache=None, show_cached=True, sweep=False,
+            static_check=False):
+    if isinstance(solutions_dirs, str):
+        solutions_dirs = [solutions_dirs]
+
+    outcomes = {}
+    if jobs > 1:
+        tasks = [(challenge, os.path.join(d, SOLUTION_FILENAMES[challenge["number"]]))
+                 for d in solutions_dirs for challenge in CHALLENGES]
+        if cache is not None:
+            options = [detect_loops, score, costs, fuzz_cases, fuzz_seed, sweep, static_check]
+            tasks = [(challenge, path) for challenge, path in tasks
+                     if _cache_key(cache, challenge, path, options) not in cache]
+        if static_check:
+            tasks = [(challenge, path) for challenge, path in tasks
+                     if not _statically_rejected(path, costs)]
+        outcomes = run_tests_parallel(tasks, jobs, detect_loops, costs)
+
+    for solutions_dir in solutions_dirs:
+        if len(solutions_dirs) > 1:
+            print("#" * 60)
+            print(f"SOLUTIONS: {solutions_dir}")
+            print("#" * 60)
+            print()
+        run_solutions_dir(solutions_dir, outcomes, detect_loops, score, costs, fuzz_cases,
+                          fuzz_seed, cache, show_cached, sweep, jobs, static_check)
+        if len(solutions_dirs) > 1:
+            print()
 
 
-def run_all(solutions_dir):
+def run_challenge_cached(cache, challenge, solution_path, outcomes=None, detect_loops=False,
+                         score="size", costs=None, fuzz_cases=0, fuzz_seed=0,
+                         show_cached=True, sweep=False, jobs=1, static_check=False):
+    # run_challenge, unless the cache holds a result for the same key; then
+    # its report is printed again (or skipped if not show_cached).
+    options = [detect_loops, score, costs, fuzz_cases, fuzz_seed, sweep, static_check]
+    key = _cache_key(cache, challenge, solution_path, options)
+    entry = cache.get(key) if key else None
+    if entry is not None:
+        if show_cached:
+            sys.stdout.write(entry["report"])
+        return entry["result"]
+
+    report = io.StringIO()
+    with contextlib.redirect_stdout(report):
+        result = run_challenge(challenge, solution_path, outcomes, detect_loops, score, costs,
+                               fuzz_cases, fuzz_seed, sweep, jobs, static_check)
+    sys.stdout.write(report.getvalue())
+    if key:
+        cache.put(key, {"report": report.getvalue(), "result": result})
+    return result
+
+
+def run_solutions_dir(solutions_dir, outcomes, detect_loops=False, score="size", costs=None,
+                      fuzz_cases=0, fuzz_seed=0, cache=None, show_cached=True, sweep=False,
+                      jobs=1, static_check=False):
     os.makedirs(solutions_dir, exist_ok=True)
     results = []
 
@@ -261,28 +677,40 @@ def run_all(solutions_dir):
                 "name": challenge["name"],
                 "passed": False,
                 "instructions": None,
+                "total_cycles": None,
+                "worst_cycles": None,
                 "tier": "-",
             })
             continue
 
-        result = run_challenge(challenge, solution_path)
+        if cache is None:
+            result = run_challenge(challenge, solution_path, outcomes.get(solution_path),
+                                   detect_loops, score, costs, fuzz_cases, fuzz_seed, sweep,
+                                   jobs, static_check)
+        else:
+            result = run_challenge_cached(cache, challenge, solution_path,
+                                          outcomes.get(solution_path), detect_loops, score,
+                                          costs, fuzz_cases, fuzz_seed, show_cached, sweep,
+                                          jobs, static_check)
         if result is None:
             results.append({
                 "number": challenge["number"],
                 "name": challenge["name"],
                 "passed": False,
                 "instructions": None,
+                "total_cycles": None,
+                "worst_cycles": None,
                 "tier": "-",
             })
         else:
             results.append(result)
         print()
 
-    print("=" * 60)
-    print("SCOREBOARD")
-    print("=" * 60)
-    print(f"{'#':<4} {'Challenge':<25} {'Instructions':<14} {'Tier':<8}")
-    print("-" * 60)
+    print("=" * 76)
+    print(f"SCOREBOARD (score: {score})")
+    print("=" * 76)
+    print(f"{'#':<4} {'Challenge':<25} {'Instructions':<14} {'Cycles':<8} {'Worst':<7} {'Tier':<8}")
+    print("-" * 76)
 
     gold_count = 0
     silver_count = 0
@@ -292,8 +720,10 @@ def run_all(solutions_dir):
     for r in results:
         instr_str = str(r["instructions"]
                         ) if r["instructions"] is not None else "-"
+        total_str = str(r["total_cycles"]) if r["total_cycles"] is not None else "-"
+        worst_str = str(r["worst_cycles"]) if r["worst_cycles"] is not None else "-"
         print(f"{r['number']:<4} {r['name']:<25} {
-              instr_str:<14} {r['tier']:<8}")
+              instr_str:<14} {total_str:<8} {worst_str:<7} {r['tier']:<8}")
         if r["tier"] == "Gold":
             gold_count += 1
         elif r["tier"] == "Silver":
@@ -303,11 +733,56 @@ def run_all(solutions_dir):
         else:
             missing_count += 1
 
-    print("-" * 60)
+    print("-" * 76)
     print(f"Gold: {gold_count}  Silver: {silver_count}  Bronze: {
           bronze_count}  Incomplete: {missing_count}")
 
 
+WATCH_INTERVAL = 0.5
+
+
+def _solution_stats(solutions_dirs):
+    # (mtime, size) of every solution file, None for missing ones.
+    stats = {}
+    for solutions_dir in solutions_dirs:
+        for filename in SOLUTION_FILENAMES.values():
+            path = os.path.join(solutions_dir, filename)
+            try:
+                st = os.stat(path)
+            except OSError:
+                stats[path] = None
+            else:
+                stats[path] = (st.st_mtime_ns, st.st_size)
+    return stats
+
+
+def watch(solutions_dirs, jobs=1, detect_loops=False, score="size", costs=None, fuzz_cases=0,
+          fuzz_seed=0, cache=None, interval=WATCH_INTERVAL, sweep=False, static_check=False):
+    # Grades everything once, then polls the solution files every `interval`
+    # seconds and regrades after each change. Results come from `cache`, so
+    # only changed solutions actually run, and only their reports are printed
+    # above the rebuilt scoreboard.
+    if isinstance(solutions_dirs, str):
+        solutions_dirs = [solutions_dirs]
+    cache = cache if cache is not None else ResultCache()
+    stats = None
+    while True:
+        current = _solution_stats(solutions_dirs)
+        if current != stats:
+            if stats is not None:
+                changed = sorted(path for path in current if current[path] != stats.get(path))
+                print(f"Changed: {', '.join(changed)}")
+                print()
+            stats = current
+            hits, misses = cache.hits, cache.misses
+            run_all(solutions_dirs, jobs, detect_loops, score, costs, fuzz_cases, fuzz_seed,
+                    cache, show_cached=False, sweep=sweep, static_check=static_check)
+            print(f"Regraded {cache.misses - misses}, {cache.hits - hits} unchanged. "
+                  "Watching for changes (Ctrl-C to stop)...")
+            sys.stdout.flush()
+        time.sleep(interval)
+
+
 def main():
     parser = argparse.ArgumentParser(description="Cosmo-8 Challenge Harness")
     parser.add_argument("--problem", type=int, help="Challenge number (1-10)")
@@ -315,12 +790,65 @@ def main():
                         help="Path to solution .asm file")
     parser.add_argument("--all", action="store_true",
                         help="Run all challenges")
-    parser.add_argument("--solutions-dir", type=str, default="solutions",
-                        help="Directory containing solution files")
+    parser.add_argument("--solutions-dir", type=str, nargs="+", default=["solutions"],
+                        help="Directory (or directories) containing solution files")
+    parser.add_argument("--jobs", type=int, default=1,
+                        help="Worker processes for running tests (default: 1)")
+    parser.add_argument("--cache-dir", type=str, default=None,
+                        help="Directory for the on-disk assembled program cache")
+    parser.add_argument("--detect-loops", action="store_true",
+                        help="Fail a test as soon as the machine state repeats")
+    parser.add_argument("--score", choices=SCORE_MODES, default="size",
+                        help="Rank on instruction count, cycles used, or both (default: size)")
+    parser.add_argument("--costs", type=str, default=None,
+                        help=f"Cycle cost model: a preset ({', '.join(COST_MODELS)}) and/or "
+                             "OP=cycles overrides, e.g. 'hardware,MUL=4'")
+    parser.add_argument("--fuzz", type=int, default=0, metavar="N",
+                        help="After the tests pass, also check N random inputs against a "
+                             "reference oracle")
+    parser.add_argument("--seed", type=int, default=0,
+                        help="Random seed for --fuzz (default: 0)")
+    parser.add_argument("--exhaustive", action="store_true",
+                        help="After the tests pass, also check every input of challenges "
+                             "with a small input domain (3, 5 and 10) against a reference "
+                             "oracle, on --jobs processes")
+    parser.add_argument("--static-check", action="store_true",
+                        help="Reject a solution without running it if static analysis "
+                             "proves it never halts, exceeds the cycle limit or overflows "
+                             "the stack (see analyze.py)")
+    parser.add_argument("--result-cache", type=str, default=None, metavar="DIR",
+                        help="With --all, keep grading results in DIR and regrade only "
+                             "solutions, tests or simulator code that changed")
+    parser.add_argument("--watch", action="store_true",
+                        help="With --all, keep running and regrade solutions as they change")
     args = parser.parse_args()
+    if (args.watch or args.result_cache) and not args.all:
+        parser.error("--watch and --result-cache need --all")
 
-    if args.all:
-        run_all(args.solutions_dir)
+    if args.costs:
+        try:
+            cost_table(args.costs)
+        except ValueError as e:
+            parser.error(str(e))
+
+    if args.cache_dir:
+        configure_cache(args.cache_dir)
+
+    cache = ResultCache(args.result_cache) if args.result_cache else None
+    if args.watch:
+        try:
+            watch(args.solutions_dir, jobs=args.jobs, detect_loops=args.detect_loops,
+                  score=args.score, costs=args.costs, fuzz_cases=args.fuzz,
+                  fuzz_seed=args.seed, cache=cache, sweep=args.exhaustive,
+                  static_check=args.static_check)
+        except KeyboardInterrupt:
+            pass
+    elif args.all:
+        run_all(args.solutions_dir, jobs=args.jobs, detect_loops=args.detect_loops,
+                score=args.score, costs=args.costs, fuzz_cases=args.fuzz, fuzz_seed=args.seed,
+                cache=cache, sweep=args.exhaustive, static_check=args.static_check)
+        if cache is not None:
+            print(f"Results: {cache.misses} graded, {cache.hits} from cache")
     elif args.problem is not None:
         if args.problem < 1 or args.problem > 10:
             print(f"Invalid problem number: {args.problem} (must be 1-10)")
@@ -329,7 +857,14 @@ def main():
         challenge = CHALLENGES[args.problem - 1]
 
         if args.solution:
-            run_challenge(challenge, args.solution)
+            outcomes = None
+            if args.jobs > 1:
+                outcomes = run_tests_parallel([(challenge, args.solution)], args.jobs,
+                                              args.detect_loops, args.costs)
+                outcomes = outcomes.get(args.solution)
+            run_challenge(challenge, args.solution, outcomes, args.detect_loops, args.score,
+                          args.costs, args.fuzz, args.seed, args.exhaustive, args.jobs,
+                          args.static_check)
         else:
             show_challenge(challenge)
     else:
@@ -0,0 +1,192 @@
+import sys
+import os
+import argparse
+import json
+import socket
+
+# Thin client for server.py. It imports nothing from the simulator, so a call
+# costs little more than interpreter startup and one round trip:
+#
+#   python3 client.py run solutions/01_sum.asm --input "3,10,20,30"
+#   python3 client.py grade --problem 1 --solution solutions/01_sum.asm
+#   python3 client.py stats
+#
+# Output matches sim.py and challenge.py --problem/--solution. The server
+# address comes from --address or $COSMO8_SERVER, as for the server.
+
+DEFAULT_ADDRESS = (os.environ.get('COSMO8_SERVER')
+                   or os.path.join(os.environ.get('TMPDIR', '/tmp'), 'cosmo8.sock'))
+
+
+class Client:
+    def __init__(self, address=DEFAULT_ADDRESS):
+        if ':' in address:
+            host, port = address.rsplit(':', 1)
+            self.sock = socket.create_connection((host or 'localhost', int(port)))
+        else:
+            self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self.sock.connect(address)
+        self.file = self.sock.makefile('rwb')
+
+    def call(self, command, **request):
+        # Sends one request and returns the response; raises RuntimeError if
+        # the server rejected it.
+        self.file.write(json.dumps({'command': command, **request}).encode() + b'\n')
+        self.file.flush()
+        line = self.file.readline()
+        if not line:
+            raise RuntimeError("server closed the connection")
+        response = json.loads(line)
+        if not response.pop('ok'):
+            raise RuntimeError(response['error'])
+        return response
+
+    def close(self):
+        self.file.close()
+        self.sock.close()
+
+
+def print_run(result, costs):
+    if result['error'] is not None:
+        print(f"Runtime error: {result['error']}", file=sys.stderr)
+        return 1
+    for value in result['outputs']:
+        print(value)
+    sys.stdout.flush()
+    print(f"--- Stats ---", file=sys.stderr)
+    print(f"Instruction count: {result['instructions']}", file=sys.stderr)
+    print(f"Cycles used: {result['cycles']}", file=sys.stderr)
+    if costs:
+        print(f"Cost model: {costs}", file=sys.stderr)
+    return 0
+
+
+def print_grade(result, solution_path, score):
+    print(f"Challenge {result['number']}: {result['name']}")
+    print(f"  Solution: {solution_path}")
+    print()
+    if result['error'] is not None:
+        print(f"  {result['error']}")
+        return
+    for error in result['static_errors']:
+        print(f"  Rejected by static analysis: {error}")
+    if result['static_errors']:
+        return
+    for i, test in enumerate(result['tests'], 1):
+        if test['error'] is not None:
+            print(f"  Test {i}: FAIL (runtime error: {test['error']})")
+        elif test['passed']:
+            print(f"  Test {i}: PASS")
+        else:
+            print(f"  Test {i}: FAIL")
+            print(f"    Input:    {test['input']}")
+            print(f"    Expected: {test['expected']}")
+            print(f"    Actual:   {test['actual']}")
+    fuzz = result['fuzz']
+    if fuzz and fuzz['passed']:
+        print(f"  Fuzz: PASS ({fuzz['cases']} random cases, seed {fuzz['seed']})")
+    elif fuzz:
+        print(f"  Fuzz: FAIL (case {fuzz['case'] + 1} of seed {fuzz['seed']}, shrunk)")
+        print(f"    Input:    {fuzz['inputs']}")
+        print(f"    Expected: {fuzz['expected']}")
+        if fuzz['error'] is not None:
+            print(f"    Error:    {fuzz['error']}")
+        else:
+            print(f"    Actual:   {fuzz['actual']}")
+    sweep = result['exhaustive']
+    if sweep and sweep['cases'] is None:
+        print("  Exhaustive: skipped (input domain too large to enumerate)")
+    elif sweep:
+        print(f"  Exhaustive: {'PASS' if sweep['passed'] else 'FAIL'} ({sweep['cases']} inputs, "
+              f"worst case {sweep['worst_cycles']} cycles at input {sweep['worst_inputs']})")
+        for failure in sweep['failures']:
+            print(f"    Input:    {failure['input']}")
+            print(f"    Expected: {failure['expected']}")
+            if failure['error'] is not None:
+                print(f"    Error:    {failure['error']}")
+            else:
+                print(f"    Actual:   {failure['actual']}")
+    print()
+    print(f"  Instructions: {result['instructions']}")
+    print(f"  Cycles: {result['total_cycles']} total, {result['worst_cycles']} worst case")
+    if not result['passed']:
+        print(f"  Tier: - (not all tests passed)")
+    elif score == "both":
+        print(f"  Tier: {result['tier']} (size: {result['size_tier']}, "
+              f"cycles: {result['cycles_tier']})")
+    else:
+        print(f"  Tier: {result['tier']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Cosmo-8 evaluation server client")
+    parser.add_argument("--address", type=str, default=DEFAULT_ADDRESS,
+                        help="Server socket path, or HOST:PORT for TCP "
+                             f"(default: $COSMO8_SERVER or {DEFAULT_ADDRESS})")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run = commands.add_parser("run", help="Run a program, like sim.py")
+    run.add_argument("program", help="Path to assembly source file")
+    run.add_argument("--input", type=str, default="", help="Comma-separated input values")
+    run.add_argument("--engine", type=str, default=None, help="Execution engine")
+    run.add_argument("--detect-loops", action="store_true",
+                     help="Fail as soon as the machine state repeats")
+    run.add_argument("--costs", type=str, default=None, help="Cycle cost model")
+
+    grade = commands.add_parser("grade", help="Grade a solution, like challenge.py")
+    grade.add_argument("--problem", type=int, required=True, help="Challenge number (1-10)")
+    grade.add_argument("--solution", type=str, required=True,
+                       help="Path to solution .asm file")
+    grade.add_argument("--detect-loops", action="store_true",
+                       help="Fail a test as soon as the machine state repeats")
+    grade.add_argument("--score", choices=("size", "cycles", "both"), default="size",
+                       help="Rank on size, cycles or both (default: size)")
+    grade.add_argument("--costs", type=str, default=None, help="Cycle cost model")
+    grade.add_argument("--fuzz", type=int, default=0, metavar="N",
+                       help="Also check N random inputs against a reference oracle")
+    grade.add_argument("--seed", type=int, default=0, help="Random seed for --fuzz")
+    grade.add_argument("--exhaustive", action="store_true",
+                       help="Also check every input of a small input domain")
+    grade.add_argument("--static-check", action="store_true",
+                       help="Reject a solution that static analysis proves fails")
+
+    commands.add_parser("stats", help="Show server request and cache counters")
+    args = parser.parse_args()
+
+    try:
+        client = Client(args.address)
+    except OSError as e:
+        print(f"Cannot connect to {args.address}: {e}", file=sys.stderr)
+        sys.exit(2)
+
+    try:
+        if args.command == "run":
+            with open(args.program) as f:
+                source = f.read()
+            inputs = [int(x.strip()) for x in args.input.split(',') if x.strip()]
+            result = client.call("run", source=source, inputs=inputs, engine=args.engine,
+                                 detect_loops=args.detect_loops, costs=args.costs)
+            sys.exit(print_run(result, args.costs))
+        elif args.command == "grade":
+            try:
+                with open(args.solution) as f:
+                    source = f.read()
+            except FileNotFoundError:
+                print(f"  Solution file not found: {args.solution}")
+                return
+            result = client.call("grade", problem=args.problem, source=source,
+                                 detect_loops=args.detect_loops, score=args.score,
+                                 costs=args.costs, fuzz=args.fuzz, seed=args.seed,
+                                 exhaustive=args.exhaustive, static_check=args.static_check)
+            print_grade(result, args.solution, args.score)
+        else:
+            print(json.dumps(client.call("stats"), indent=2))
+    except RuntimeError as e:
+        print(f"Error: {e}", file=sys.stderr)
+        sys.exit(2)
+    finally:
+        client.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,253 @@
+import cmd
+
+from sim import RUNNING, HALTED, FAULTED, format_instr, instruction_lines, label_addresses
+
+# Time-travel debugger. Execution is measured in steps (instructions run from
+# the start), and a snapshot of the machine is kept every CHECKPOINT_INTERVAL
+# steps. Going back to step n restores the last checkpoint at or before n and
+# replays forward from it, so reverse execution costs at most one interval of
+# replay per checkpoint examined instead of a re-run from IP 0. Since the
+# machine is deterministic, replay reproduces the original run exactly.
+
+CHECKPOINT_INTERVAL = 1000
+
+
+class Debugger:
+    def __init__(self, machine, source=None, interval=CHECKPOINT_INTERVAL, labels=None,
+                 where=None):
+        # Without the source, `labels` and `where` can still come from a
+        # binary image's symbol and line tables.
+        self.machine = machine
+        self.source = source
+        self.labels = label_addresses(source) if source else dict(labels or {})
+        self.lines = source.split('\n') if source else []
+        self.where = instruction_lines(source) if source else list(where or [])
+        self.interval = interval
+        self.breakpoints = set()
+        self.watchpoints = set()
+        self.steps = 0
+        self.checkpoints = {0: machine.snapshot()}
+
+    def address(self, token):
+        # A label or an instruction address.
+        if token in self.labels:
+            return self.labels[token]
+        try:
+            return int(token, 0)
+        except ValueError:
+            raise ValueError(f"unknown label or address: {token}")
+
+    @property
+    def running(self):
+        return self.machine.status == RUNNING
+
+    def _step(self):
+        self.machine.step(1)
+        self.steps += 1
+        if self.steps % self.interval == 0 and self.steps not in self.checkpoints:
+            self.checkpoints[self.steps] = self.machine.snapshot()
+
+    def goto(self, target):
+        # Moves to step `target`, or to the end of the run if it is earlier.
+        if target < self.steps or target >= self.steps + self.interval:
+            base = max(k for k in self.checkpoints if k <= target)
+            if target < self.steps or base > self.steps:
+                self.machine.restore(self.checkpoints[base])
+                self.steps = base
+        while self.steps < target and self.running:
+            self._step()
+
+    def step(self, n=1):
+        self.goto(self.steps + n)
+
+    def cont(self):
+        # Runs until a breakpoint, a watched memory cell changes, or the end.
+        # Returns the reason it stopped.
+        memory = self.machine.memory
+        while self.running:
+            watched = [memory[addr] for addr in self.watchpoints]
+            self._step()
+            reason = self._stop_reason(watched)
+            if reason:
+                return reason
+        return self.machine.status
+
+    def _stop_reason(self, watched):
+        memory = self.machine.memory
+        for addr, old in zip(self.watchpoints, watched):
+            if memory[addr] != old:
+                return f"watchpoint: [{addr}] {old} -> {memory[addr]}"
+        if self.running and self.machine.ip in self.breakpoints:
+            return f"breakpoint at IP {self.machine.ip}"
+        return None
+
+    def reverse_step(self, n=1):
+        self.goto(max(0, self.steps - n))
+
+    def reverse_cont(self):
+        # Goes back to the latest earlier step at which cont() would have
+        # stopped, searching one checkpoint interval at a time from the
+        # current position backwards.
+        end = self.steps
+        upper = end - 1
+        for base in sorted((k for k in self.checkpoints if k < end), reverse=True):
+            self.machine.restore(self.checkpoints[base])
+            self.steps = base
+            last = None
+            memory = self.machine.memory
+            if self.machine.ip in self.breakpoints:
+                last = (base, f"breakpoint at IP {self.machine.ip}")
+            while self.steps < upper and self.running:
+                watched = [memory[addr] for addr in self.watchpoints]
+                self._step()
+                reason = self._stop_reason(watched)
+                if reason:
+                    last = (self.steps, reason)
+            if last is not None:
+                self.goto(last[0])
+                return last[1]
+            upper = base
+        self.goto(0)
+        return "start of execution"
+
+    def location(self):
+        m = self.machine
+        code = m.code
+        if not 0 <= m.ip < len(code):
+            text = "-"
+        elif self.lines:
+            lineno = self.where[m.ip]
+            text = f"line {lineno + 1}: {self.lines[lineno].strip()}"
+        else:
+            names = {address: name for name, address in self.labels.items()}
+            text = format_instr(code[m.ip], names)
+            if self.where:
+                text = f"line {self.where[m.ip] + 1}: {text}"
+        return f"step {self.steps}, IP {m.ip} ({text})"
+
+    def registers(self):
+        m = self.machine
+        regs = ' '.join(f"R{i}={v}" for i, v in enumerate(m.regs))
+        flags = f"Z={int(m.flag_z)} C={int(m.flag_c)} N={int(m.flag_n)}"
+        return f"{regs}\n{flags} SP={m.sp} cycles={m.cycles} status={m.status}"
+
+
+class DebuggerShell(cmd.Cmd):
+    prompt = '(c8db) '
+
+    def __init__(self, debugger, stdin=None, stdout=None):
+        super().__init__(stdin=stdin, stdout=stdout)
+        if stdin is not None:
+            self.use_rawinput = False
+        self.db = debugger
+        self.intro = ("Cosmo-8 debugger. Type help for commands.\n" + debugger.location())
+
+    def _say(self, text):
+        print(text, file=self.stdout)
+
+    def _where(self, reason=None):
+        m = self.db.machine
+        if reason:
+            self._say(f"Stopped: {reason}")
+        if m.status == FAULTED:
+            self._say(f"Runtime error: {m.error}")
+        elif m.status == HALTED:
+            self._say("Program halted")
+        self._say(self.db.location())
+        self._say(self.db.registers())
+
+    def _count(self, arg):
+        return int(arg) if arg.strip() else 1
+
+    def onecmd(self, line):
+        try:
+            return super().onecmd(line)
+        except ValueError as e:
+            self._say(f"Error: {e}")
+
+    def emptyline(self):
+        pass
+
+    def do_step(self, arg):
+        """step [N]: run N instructions (default 1)"""
+        self.db.step(self._count(arg))
+        self._where()
+
+    def do_continue(self, arg):
+        """continue: run to the next breakpoint, watchpoint change or the end"""
+        self._where(self.db.cont())
+
+    def do_rstep(self, arg):
+        """rstep [N]: go back N instructions (default 1)"""
+        self.db.reverse_step(self._count(arg))
+        self._where()
+
+    def do_rcontinue(self, arg):
+        """rcontinue: go back to the previous breakpoint or watchpoint change"""
+        self._where(self.db.reverse_cont())
+
+    def do_goto(self, arg):
+        """goto N: move to step N"""
+        self.db.goto(int(arg))
+        self._where()
+
+    def do_break(self, arg):
+        """break LABEL|ADDR: stop before the instruction there; with no argument, list"""
+        if arg.strip():
+            self.db.breakpoints.add(self.db.address(arg.strip()))
+        self._say(f"Breakpoints: {sorted(self.db.breakpoints)}")
+
+    def do_watch(self, arg):
+        """watch ADDR: stop when memory cell ADDR changes; with no argument, list"""
+        if arg.strip():
+            addr = int(arg, 0)
+            if not 0 <= addr < self.db.machine.MEM_SIZE:
+                raise ValueError(f"memory address out of range: {addr}")
+            self.db.watchpoints.add(addr)
+        self._say(f"Watchpoints: {sorted(self.db.watchpoints)}")
+
+    def do_delete(self, arg):
+        """delete LABEL|ADDR: remove a breakpoint; delete watch ADDR: remove a watchpoint"""
+        words = arg.split()
+        if len(words) != (2 if words[:1] == ['watch'] else 1):
+            raise ValueError("usage: delete LABEL|ADDR or delete watch ADDR")
+        if words[0] == 'watch':
+            self.db.watchpoints.discard(int(words[1], 0))
+        else:
+            self.db.breakpoints.discard(self.db.address(words[0]))
+
+    def do_regs(self, arg):
+        """regs: show registers, flags, SP and cycles"""
+        self._say(self.db.registers())
+
+    def do_mem(self, arg):
+        """mem ADDR [COUNT]: show COUNT memory cells from ADDR (default 8)"""
+        words = arg.split()
+        if not 1 <= len(words) <= 2:
+            raise ValueError("usage: mem ADDR [COUNT]")
+        start = int(words[0], 0)
+        count = int(words[1]) if len(words) > 1 else 8
+        memory = self.db.machine.memory
+        self._say(' '.join(f"[{a}]={memory[a]}"
+                           for a in range(max(0, start), min(len(memory), start + count))))
+
+    def do_out(self, arg):
+        """out: show the outputs written so far"""
+        self._say(str([value for _, value in self.db.machine.outputs]))
+
+    def do_where(self, arg):
+        """where: show the current position"""
+        self._where()
+
+    def do_quit(self, arg):
+        """quit: leave the debugger"""
+        return True
+
+    do_s, do_c, do_rs, do_rc, do_b, do_w = do_step, do_continue, do_rstep, do_rcontinue, \
+        do_break, do_watch
+    do_r, do_x, do_q, do_EOF = do_regs, do_mem, do_quit, do_quit
+
+
+def debug(machine, source, stdin=None, stdout=None, labels=None, where=None):
+    debugger = Debugger(machine, source, labels=labels, where=where)
+    DebuggerShell(debugger, stdin, stdout).cmdloop()
@@ -0,0 +1,306 @@
+import functools
+
+from sim import (
+    CosmoError,
+    OP_HLT, OP_NOP, OP_MOV, OP_ADD, OP_SUB, OP_MUL, OP_MOD, OP_AND, OP_OR,
+    OP_XOR, OP_NOT, OP_SHL, OP_SHR, OP_CMP, OP_LOAD, OP_STORE, OP_JMP, OP_JZ,
+    OP_JNZ, OP_JN, OP_JC, OP_CALL, OP_RET, OP_PUSH, OP_POP, OP_READ, OP_WRITE,
+    OP_BAD,
+)
+
+# Basic-block compiler: the decoded program is split into basic blocks, each
+# block becomes straight-line Python with registers and flags held in locals,
+# and the whole program is compiled into one function that dispatches between
+# blocks on the IP. Anything the compiled code cannot reproduce exactly
+# (a block that does not fit under the cycle limit it is called with, jumps to
+# IPs that are not block leaders, falling off the end) exits back to the
+# machine with its state written back, and the interpreter takes over.
+
+FLAG_Z, FLAG_C, FLAG_N = 1, 2, 4
+ALL_FLAGS = FLAG_Z | FLAG_C | FLAG_N
+
+JUMPS = (OP_JMP, OP_JZ, OP_JNZ, OP_JN, OP_JC, OP_CALL)
+BLOCK_ENDS = JUMPS + (OP_RET, OP_HLT, OP_BAD)
+# Instructions that can fault; the compiled code records their IP in `pc`
+# first so a fault reports the exact IP and cycle count.
+FAULTING = (OP_MOD, OP_LOAD, OP_STORE, OP_CALL, OP_RET, OP_PUSH, OP_POP,
+            OP_READ, OP_BAD)
+
+FLAG_USES = {OP_JZ: FLAG_Z, OP_JNZ: FLAG_Z, OP_JN: FLAG_N, OP_JC: FLAG_C,
+             OP_HLT: ALL_FLAGS}
+FLAG_DEFS = {op: FLAG_Z | FLAG_N for op in (OP_MOV, OP_AND, OP_OR, OP_XOR, OP_NOT)}
+FLAG_DEFS.update({op: ALL_FLAGS for op in (OP_ADD, OP_SUB, OP_MUL, OP_MOD,
+                                           OP_SHL, OP_SHR, OP_CMP)})
+
+
+def find_blocks(code):
+    n = len(code)
+    leaders = {0} if n else set()
+    for ip, ins in enumerate(code):
+        if ins.op in JUMPS and 0 <= ins.a < n:
+            leaders.add(ins.a)
+        if ins.op in BLOCK_ENDS and ip + 1 < n:
+            leaders.add(ip + 1)
+    starts = sorted(leaders)
+    return list(zip(starts, starts[1:] + [n]))
+
+
+def flag_liveness(code, blocks):
+    # Backward scan of each block. Leaving compiled code counts as reading
+    # every flag, so the machine state seen after a halt or a hand-off to the
+    # interpreter matches the reference engine. Every block starts with a
+    # cycle guard that can leave (at the end of a run_for slice or at the
+    # cycle limit), so every flag is live at the end of every block, and only
+    # flags a later instruction of the same block overwrites are left out.
+    # A READ is an exit as well: with input_open it pauses the machine, before
+    # it runs, when no input is left. A fault is not such an exit: flags that instructions before the faulting
+    # one would have set, and that the rest of the block overwrites, keep
+    # their older values.
+    live_after = [0] * len(code)
+    for start, end in blocks:
+        live = ALL_FLAGS
+        for ip in range(end - 1, start - 1, -1):
+            live_after[ip] = live
+            op = code[ip].op
+            live = (live & ~FLAG_DEFS.get(op, 0)) | FLAG_USES.get(op, 0)
+            if op == OP_READ:
+                live = ALL_FLAGS
+    return live_after
+
+
+def _src(value, imm):
+    return repr(value) if imm else f"r{value}"
+
+
+def _wrap(expr):
+    return f"((({expr}) + 0x8000) & 0xFFFF) - 0x8000"
+
+
+def _set_flags(lines, live, dest, carry=None):
+    if live & FLAG_C and carry is not None:
+        lines.insert(0, f"fc = {carry}")
+    if live & FLAG_Z:
+        lines.append(f"fz = {dest} == 0")
+    if live & FLAG_N:
+        lines.append(f"fn = {dest} < 0")
+    return lines
+
+
+def _shift_lines(ins, live):
+    dest = f"r{ins.r}"
+    val = f"({_src(ins.a, ins.a_imm)} & 0xFFFF)"
+    left = ins.op == OP_SHL
+    if not ins.b_imm:
+        helper = 'shl' if left else 'shr'
+        lines = [f"t, carry = {helper}({val}, r{ins.b})", f"{dest} = {_wrap('t')}"]
+        if live & FLAG_C:
+            lines.append("fc = carry")
+        return _set_flags(lines, live, dest)
+    amt = ins.b
+    if amt <= 0:
+        raw, carry = val, 'False'
+    elif amt > 16:
+        raw, carry = '0', 'False'
+    elif left:
+        raw, carry = f"({val} << {amt}) & 0xFFFF", f"bool({val} & {1 << (16 - amt)})"
+    else:
+        raw, carry = f"{val} >> {amt}", f"bool({val} & {1 << (amt - 1)})"
+    return _set_flags([f"{dest} = {_wrap(raw)}"], live, dest, carry)
+
+
+def _address(lines, value, imm, size):
+    if imm:
+        if not 0 <= value < size:
+            lines.append(f"raise CosmoError('Memory access out of bounds: address {value}')")
+        return repr(value)
+    lines.append(f"if not 0 <= r{value} < {size}: "
+                 f"raise CosmoError(f'Memory access out of bounds: address {{r{value}}}')")
+    return f"r{value}"
+
+
+def _instr_lines(ip, ins, live, size, depth, taken_extra):
+    # Returns (lines, ends_block). Jumps assign `ip` and end the block.
+    op = ins.op
+    dest = f"r{ins.r}"
+    a = _src(ins.a, ins.a_imm)
+    b = _src(ins.b, ins.b_imm)
+
+    if op == OP_NOP:
+        return [], False
+    if op == OP_HLT:
+        return [f"ip = {ip}", "return True"], True
+    if op == OP_BAD:
+        return [f"raise CosmoError({ins.a!r})"], True
+    if op == OP_MOV:
+        return _set_flags([f"{dest} = {a}"], live, dest), False
+    if op == OP_ADD:
+        lines = [f"{dest} = {_wrap(f'{a} + {b}')}"]
+        return _set_flags(lines, live, dest, f"({a} & 0xFFFF) + ({b} & 0xFFFF) > 0xFFFF"), False
+    if op == OP_SUB:
+        lines = [f"{dest} = {_wrap(f'{a} - {b}')}"]
+        return _set_flags(lines, live, dest, f"({a} & 0xFFFF) < ({b} & 0xFFFF)"), False
+    if op == OP_MUL:
+        lines = [f"t = {a} * {b}", f"{dest} = {_wrap('t')}"]
+        if live & FLAG_C:
+            lines.append(f"fc = t != {dest}")
+        return _set_flags(lines, live, dest), False
+    if op == OP_MOD:
+        lines = [f"if {b} == 0: raise CosmoError('Division by zero in MOD')",
+                 f"{dest} = {_wrap(f'{a} - {b} * int({a} / {b})')}"]
+        if live & FLAG_C:
+            lines.append("fc = False")
+        return _set_flags(lines, live, dest), False
+    if op in (OP_AND, OP_OR, OP_XOR):
+        symbol = {OP_AND: '&', OP_OR: '|', OP_XOR: '^'}[op]
+        return _set_flags([f"{dest} = {a} {symbol} {b}"], live, dest), False
+    if op == OP_NOT:
+        return _set_flags([f"{dest} = ~{a}"], live, dest), False
+    if op in (OP_SHL, OP_SHR):
+        return _shift_lines(ins, live), False
+    if op == OP_CMP:
+        lines = [f"t = {_wrap(f'{a} - {b}')}"] if live & (FLAG_Z | FLAG_N) else []
+        return _set_flags(lines, live, 't', f"({a} & 0xFFFF) < ({b} & 0xFFFF)"), False
+    if op == OP_LOAD:
+        lines = []
+        addr = _address(lines, ins.a, ins.a_imm, size)
+        return lines + [f"{dest} = memory[{addr}]"], False
+    if op == OP_STORE:
+        lines = []
+        addr = _address(lines, ins.a, ins.a_imm, size)
+        return lines + [f"memory[{addr}] = {dest}"], False
+    if op == OP_PUSH:
+        return [f"if sp >= {depth}: raise CosmoError(f'Stack overflow: SP={{sp}}')",
+                f"stack[sp] = {a}", "sp += 1"], False
+    if op == OP_POP:
+        return ["if sp <= 0: raise CosmoError(f'Stack underflow: SP={sp}')",
+                "sp -= 1", f"{dest} = stack[sp]"], False
+    if op == OP_READ:
+        return [f"{dest} = read_input({ins.a})"], False
+    if op == OP_WRITE:
+        return [f"out_append(({ins.a}, {dest}))"], False
+    if op == OP_JMP:
+        return [f"ip = {ins.a}"], True
+    if op in (OP_JZ, OP_JNZ, OP_JN, OP_JC):
+        flag = {OP_JZ: 'fz', OP_JNZ: 'not fz', OP_JN: 'fn', OP_JC: 'fc'}[op]
+        extra = taken_extra[op]
+        if extra and ins.a != ip + 1:
+            return [f"if {flag}: ip = {ins.a}; cycles += {extra}", f"else: ip = {ip + 1}"], True
+        return [f"ip = {ins.a} if {flag} else {ip + 1}"], True
+    if op == OP_CALL:
+        return [f"if sp >= {depth}: raise CosmoError(f'Stack overflow: SP={{sp}}')",
+                f"stack[sp] = {ip + 1}", "sp += 1", f"ip = {ins.a}"], True
+    if op == OP_RET:
+        return ["if sp <= 0: raise CosmoError(f'Stack underflow: SP={sp}')",
+                "sp -= 1", "ip = stack[sp]"], True
+    raise CosmoError(f"Unknown opcode {op}")
+
+
+def _block_source(code, block, live_after, fault_adjust, size, depth, op_costs, taken_extra):
+    start, end = block
+    # The block runs only if its last instruction starts under the limit.
+    total = sum(op_costs[code[ip].op] for ip in range(start, end))
+    last = total - op_costs[code[end - 1].op]
+    lines = [f"if cycles > limit - {last + 1}: break", f"cycles += {total}"]
+    ends_block = False
+    spent = 0
+    for ip in range(start, end):
+        ins = code[ip]
+        spent += op_costs[ins.op]
+        if ins.op in FAULTING:
+            lines.append(f"pc = {ip}")
+            fault_adjust[ip] = spent - total
+        body, ends_block = _instr_lines(ip, ins, live_after[ip], size, depth, taken_extra)
+        lines.extend(body)
+    if not ends_block:
+        lines.append(f"ip = {end}")
+    if lines[-1] != "return True":
+        lines.append("continue")
+    return lines
+
+
+def _dispatch(blocks, sources, indent):
+    pad = '    ' * indent
+    if len(blocks) == 1:
+        start = blocks[0][0]
+        out = [f"{pad}if ip == {start}:"]
+        out += [f"{pad}    {line}" for line in sources[start]]
+        out.append(f"{pad}break")
+        return out
+    mid = len(blocks) // 2
+    out = [f"{pad}if ip < {blocks[mid][0]}:"]
+    out += _dispatch(blocks[:mid], sources, indent + 1)
+    out.append(f"{pad}else:")
+    out += _dispatch(blocks[mid:], sources, indent + 1)
+    return out
+
+
+def _shl(val, amt):
+    if amt <= 0:
+        return val, False
+    if amt > 16:
+        return 0, False
+    return (val << amt) & 0xFFFF, bool(val & (1 << (16 - amt)))
+
+
+def _shr(val, amt):
+    if amt <= 0:
+        return val, False
+    if amt > 16:
+        return 0, False
+    return val >> amt, bool(val & (1 << (amt - 1)))
+
+
+def generate_source(code, size, depth, op_costs, taken_extra):
+    blocks = find_blocks(code)
+    live_after = flag_liveness(code, blocks)
+    fault_adjust = {}
+    sources = {block[0]: _block_source(code, block, live_after, fault_adjust, size, depth,
+                                       op_costs, taken_extra)
+               for block in blocks}
+    regs = ', '.join(f"r{i}" for i in range(8))
+
+    lines = [
+        "def run(m, limit):",
+        "    regs = m.regs",
+        f"    {regs} = regs",
+        "    memory = m.memory",
+        "    stack = m.stack",
+        "    read_input = m._read_input",
+        "    out_append = m._emit",
+        "    fz, fc, fn = m.flag_z, m.flag_c, m.flag_n",
+        "    sp, ip, cycles = m.sp, m.ip, m.cycles",
+        "    pc = ip",
+        "    try:",
+        "        while True:",
+    ]
+    if blocks:
+        lines += _dispatch(blocks, sources, 3)
+    else:
+        lines.append("            break")
+    lines += [
+        "    except BaseException:",
+        "        ip = pc",
+        "        cycles += FAULT_ADJUST.get(pc, 0)",
+        "        raise",
+        "    finally:",
+        f"        regs[:] = {regs}",
+        "        m.flag_z, m.flag_c, m.flag_n = fz, fc, fn",
+        "        m.sp, m.ip, m.cycles = sp, ip, cycles",
+        "    return False",
+    ]
+    return '\n'.join(lines) + '\n', fault_adjust
+
+
+@functools.lru_cache(maxsize=256)
+def compile_program(code, size, depth, op_costs, taken_extra):
+    source, fault_adjust = generate_source(code, size, depth, op_costs, taken_extra)
+    namespace = {
+        'CosmoError': CosmoError,
+        'FAULT_ADJUST': fault_adjust,
+        'shl': _shl,
+        'shr': _shr,
+    }
+    exec(compile(source, f"<cosmo8-jit {hash(code) & 0xFFFFFFFF:08x}>", 'exec'), namespace)
+    run = namespace['run']
+    run.leaders = frozenset(block[0] for block in find_blocks(code))
+    return run
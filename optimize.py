@@ -0,0 +1,375 @@
+import sys
+import os
+import argparse
+import difflib
+import random
+from collections import namedtuple
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from sim import (
+    Cosmo8, CosmoError, OPERAND_FORMS, COST_MODELS, load_program, parse, cost_table,
+    format_instr, instruction_lines, label_addresses,
+    OP_HLT, OP_MOV, OP_ADD, OP_SUB, OP_MUL, OP_MOD, OP_AND, OP_OR, OP_XOR, OP_SHL, OP_SHR,
+    OP_CMP, OP_JMP, OP_CALL, OP_RET, OP_PUSH,
+)
+import jit
+from superopt import FLAG_DEFS, NUM_REGS, liveness, is_dead, _reads_writes, _successors
+from challenge import CHALLENGES, SOLUTION_FILENAMES
+from oracles import SPECS
+
+# Source-level optimizer: `python3 sim.py optimize PROGRAM`. It repeatedly
+# finds rewrites on the decoded program and applies them to the source text,
+# so labels, comments and layout survive:
+#
+#   - unreachable instructions are removed;
+#   - jumps to the next instruction are removed, jump-to-JMP chains go
+#     straight to the final target, and a JMP to HLT becomes HLT;
+#   - MOV Rx, Rx and other identities (ADD Rx, Rx, 0, ...) whose flags are
+#     never read are removed;
+#   - CMP Rx, 0 straight after an instruction that computed Rx, and CMP A, B
+#     straight after SUB Rd, A, B, are removed when the flags they would set
+#     are already there (a carry that is never read does not count);
+#   - writes of registers and flags that are never read are removed, using
+#     superopt's liveness.
+#
+# Each rewrite is applied only if the new program is equivalent to the
+# original: the same outputs (or the same failure to finish) and no more
+# cycles on every challenge test and on random inputs from the challenge's
+# input spec. The program is reanalysed after every accepted rewrite, until
+# none is left.
+
+RANDOM_CASES = 200
+
+# A rewrite of the instruction at `ip`: `new` replaces it, or None deletes it.
+# `reason` may name the line of one other instruction, at IP `related`.
+Edit = namedtuple('Edit', 'ip new reason related', defaults=(None,))
+
+CARRY = jit.FLAG_C << NUM_REGS
+
+
+def _identity(ins):
+    # Instructions that leave their register as it was.
+    if OPERAND_FORMS[ins.op] != 'rss' and ins.op != OP_MOV:
+        return False
+    same_a = not ins.a_imm and ins.a == ins.r
+    same_b = not ins.b_imm and ins.b == ins.r
+    if ins.op == OP_MOV:
+        return same_a
+    if ins.op in (OP_ADD, OP_OR, OP_XOR):
+        return (same_a and ins.b_imm and ins.b == 0) or (same_b and ins.a_imm and ins.a == 0) \
+            or (ins.op == OP_OR and same_a and same_b)
+    if ins.op in (OP_SUB, OP_SHL, OP_SHR):
+        return same_a and ins.b_imm and ins.b == 0
+    if ins.op == OP_MUL:
+        return (same_a and ins.b_imm and ins.b == 1) or (same_b and ins.a_imm and ins.a == 1)
+    if ins.op == OP_AND:
+        return same_a and same_b
+    return False
+
+
+def _exact(code):
+    # Whether the control-flow graph is known: no jumps to negative
+    # addresses, and no RET that may return to a pushed value.
+    if any(OPERAND_FORMS[ins.op] == 't' and ins.a < 0 for ins in code):
+        return False
+    ops = {ins.op for ins in code}
+    return not (OP_PUSH in ops and OP_RET in ops)
+
+
+def _reachable(code):
+    return_sites = tuple(ip + 1 for ip, ins in enumerate(code) if ins.op == OP_CALL)
+    seen = set()
+    stack = [0] if code else []
+    while stack:
+        ip = stack.pop()
+        if ip not in seen:
+            seen.add(ip)
+            stack.extend(_successors(code, ip, return_sites))
+    return seen
+
+
+def _thread(code, target):
+    # Final target of a chain of unconditional jumps starting at `target`.
+    seen = set()
+    while 0 <= target < len(code) and code[target].op == OP_JMP and target not in seen:
+        seen.add(target)
+        target = code[target].a
+    return target
+
+
+def _redundant_cmp(code, ip, live_after, leaders):
+    # The instruction whose flags make the CMP at `ip` redundant, or None.
+    cmp = code[ip]
+    reads, _ = _reads_writes(cmp)
+    for j in range(ip - 1, -1, -1):
+        if j + 1 in leaders:
+            return None
+        prev = code[j]
+        if OPERAND_FORMS[prev.op] == 't' or prev.op in (OP_HLT, OP_RET):
+            return None
+        if prev.op in jit.FLAG_DEFS:
+            break
+        if _reads_writes(prev)[1] & reads:
+            return None
+    else:
+        return None
+
+    operands = (cmp.a, cmp.a_imm, cmp.b, cmp.b_imm)
+    if prev.op == OP_SUB and (prev.a, prev.a_imm, prev.b, prev.b_imm) == operands \
+            and not (1 << prev.r) & reads:
+        return j
+    if prev.op != OP_CMP and cmp.b_imm and cmp.b == 0 and not cmp.a_imm and cmp.a == prev.r \
+            and (prev.op == OP_MOD or not live_after & CARRY):
+        return j
+    return None
+
+
+def find_edits(code):
+    # Candidate rewrites of `code`, cheapest to check first.
+    n = len(code)
+    exact = _exact(code)
+    reachable = _reachable(code) if exact else set(range(n))
+    edits = [Edit(ip, None, "unreachable") for ip in range(n) if ip not in reachable]
+
+    for ip, ins in enumerate(code):
+        if OPERAND_FORMS[ins.op] != 't' or ip not in reachable:
+            continue
+        target = _thread(code, ins.a)
+        if ins.op != OP_CALL and target == ip + 1:
+            edits.append(Edit(ip, None, "jump to the next instruction"))
+        elif ins.op == OP_JMP and 0 <= target < n and code[target].op == OP_HLT:
+            edits.append(Edit(ip, code[target], "jump to HLT"))
+        elif target != ins.a:
+            edits.append(Edit(ip, ins._replace(a=target), "jump to a jump"))
+
+    if not exact:
+        return edits
+    live = liveness(code)
+    leaders = {ins.a for ins in code if OPERAND_FORMS[ins.op] == 't'}
+    leaders |= {ip + 1 for ip, ins in enumerate(code) if ins.op == OP_CALL}
+    for ip, ins in enumerate(code):
+        if ip not in reachable:
+            continue
+        if _identity(ins) and not FLAG_DEFS.get(ins.op, 0) & live[ip]:
+            edits.append(Edit(ip, None, "no effect"))
+        elif is_dead(ins, live[ip]):
+            edits.append(Edit(ip, None, "result never read"))
+        elif ins.op == OP_CMP:
+            setter = _redundant_cmp(code, ip, live[ip], leaders)
+            if setter is not None:
+                edits.append(Edit(ip, None, "flags already set by line {}", setter))
+    return edits
+
+
+def _split_comment(text):
+    # (code, comment) parts of a source line, the comment with its marker.
+    cut = min((i for i in (text.find(';'), text.find('#')) if i >= 0), default=len(text))
+    return text[:cut], text[cut:]
+
+
+def apply_edit(lines, edit):
+    # `lines` is a list of (text, original line number or None); returns a
+    # new list with the edit applied to the source text.
+    source = '\n'.join(text for text, _ in lines)
+    code, _ = load_program(source)
+    where = instruction_lines(source)
+    labels = {}
+    for name, address in label_addresses(source).items():
+        labels.setdefault(address, name)
+    lines = list(lines)
+
+    if edit.new is not None:
+        text, origin = lines[where[edit.ip]]
+        body, comment = _split_comment(text)
+        indent = body[:len(body) - len(body.lstrip())]
+        targets = {}
+        if OPERAND_FORMS[edit.new.op] == 't':
+            old_target = body.split()[-1]
+            target = edit.new.a
+            if old_target.lstrip('-').isdigit():
+                targets[target] = str(target)
+            elif target in labels:
+                targets[target] = labels[target]
+            else:
+                name = _fresh_label(label_addresses(source))
+                targets[target] = name
+                at = where[target] if target < len(where) else len(lines)
+                lines.insert(at, (f"{name}:", None))
+                if at <= where[edit.ip]:
+                    where = [line + 1 if line >= at else line for line in where]
+        new_text = indent + format_instr(edit.new, targets)
+        if comment:
+            new_text += ' ' + comment
+        lines[where[edit.ip]] = (new_text, origin)
+        return lines
+
+    # Jumps given as numbers rather than labels move with the deletion.
+    for ip, ins in enumerate(code):
+        if OPERAND_FORMS[ins.op] == 't' and ins.a > edit.ip:
+            text, origin = lines[where[ip]]
+            body, comment = _split_comment(text)
+            token = body.split()[-1]
+            if token.isdigit():
+                head = body.rstrip()
+                head = head[:len(head) - len(token)] + str(ins.a - 1)
+                lines[where[ip]] = (head + body[len(body.rstrip()):] + comment, origin)
+    del lines[where[edit.ip]]
+    return lines
+
+
+def _fresh_label(labels):
+    k = 0
+    while f"opt{k}" in labels:
+        k += 1
+    return f"opt{k}"
+
+
+class Checker:
+    # Runs candidates against the original program on a fixed set of inputs.
+    def __init__(self, code, cases, costs=None):
+        self.machine = Cosmo8((), costs=costs)
+        self.cases = cases
+        self.expected = [self.run(code, inputs) for inputs in cases]
+
+    def run(self, code, inputs):
+        machine = self.machine
+        machine.reset(inputs, code)
+        try:
+            machine.run()
+        except CosmoError:
+            return None, machine.cycles
+        return [val for _, val in machine.outputs], machine.cycles
+
+    def cycles(self, code):
+        # Cycles per case if `code` is equivalent to the original, else None.
+        cycles = []
+        for inputs, (outputs, limit) in zip(self.cases, self.expected):
+            actual, used = self.run(code, inputs)
+            if actual != outputs or used > limit:
+                return None
+            cycles.append(used)
+        return cycles
+
+
+def optimize(source, checker):
+    # Returns (optimized source lines as (text, origin) pairs, [(origin line,
+    # original text, new text or None, reason)]).
+    lines = [(text, lineno) for lineno, text in enumerate(source.split('\n'))]
+    applied = []
+    rejected = set()
+    while True:
+        text = '\n'.join(t for t, _ in lines)
+        code, _ = load_program(text)
+        where = instruction_lines(text)
+        for edit in find_edits(code):
+            line, origin = lines[where[edit.ip]]
+            key = (origin, edit.new, edit.reason)
+            if key in rejected:
+                continue
+            candidate = apply_edit(lines, edit)
+            try:
+                new_code, _ = load_program('\n'.join(t for t, _ in candidate))
+            except CosmoError:
+                rejected.add(key)
+                continue
+            if checker.cycles(new_code) is None:
+                rejected.add(key)
+                continue
+            new_line = None
+            if edit.new is not None:
+                new_line = next(t for t, o in candidate if o == origin)
+            reason = edit.reason
+            if edit.related is not None:
+                reason = reason.format(lines[where[edit.related]][1] + 1)
+            applied.append((origin, line.strip(), new_line and new_line.strip(), reason))
+            lines = candidate
+            break
+        else:
+            return lines, applied
+
+
+def infer_problem(path):
+    name = os.path.basename(path)
+    for number, filename in SOLUTION_FILENAMES.items():
+        if name == filename:
+            return number
+    return None
+
+
+def optimize_main(argv):
+    parser = argparse.ArgumentParser(prog='sim.py optimize',
+                                     description='Remove dead code and redundant instructions '
+                                                 'from a Cosmo-8 program, keeping only rewrites '
+                                                 'that pass an equivalence check')
+    parser.add_argument('program', help='Path to assembly source file')
+    parser.add_argument('-o', '--output', type=str, default=None,
+                        help='Write the optimized source here (default: only print the report)')
+    parser.add_argument('--problem', type=int, default=None,
+                        help='Challenge whose tests and input spec check equivalence '
+                             '(default: from the file name, e.g. 04_sort.asm)')
+    parser.add_argument('--random', type=int, default=RANDOM_CASES, metavar='N',
+                        help=f'Random inputs to check besides the tests (default: {RANDOM_CASES})')
+    parser.add_argument('--seed', type=int, default=0, help='Seed for the random inputs')
+    parser.add_argument('--costs', type=str, default=None,
+                        help=f"Cycle cost model: a preset ({', '.join(COST_MODELS)}) and/or "
+                             "OP=cycles overrides, e.g. 'hardware,MUL=4'")
+    args = parser.parse_args(argv)
+
+    problem = args.problem or infer_problem(args.program)
+    if problem is None:
+        parser.error('cannot tell which challenge this solves; pass --problem')
+    if not 1 <= problem <= len(CHALLENGES):
+        parser.error(f'invalid problem number: {problem}')
+    if args.costs:
+        try:
+            cost_table(args.costs)
+        except ValueError as e:
+            parser.error(str(e))
+    challenge = CHALLENGES[problem - 1]
+
+    with open(args.program) as f:
+        source = f.read()
+    try:
+        code, count = load_program(source)
+    except CosmoError as e:
+        print(f"Parse error: {e}", file=sys.stderr)
+        sys.exit(1)
+
+    tests = [list(test['input']) for test in challenge['tests']]
+    rng = random.Random(args.seed)
+    cases = tests + [SPECS[problem].generate(rng) for _ in range(args.random)]
+    checker = Checker(code, cases, args.costs)
+    if any(outputs != test['expected']
+           for (outputs, _), test in zip(checker.expected, challenge['tests'])):
+        print(f"Warning: {args.program} fails some of the challenge tests; rewrites keep "
+              "its behaviour as it is", file=sys.stderr)
+    lines, applied = optimize(source, checker)
+    result = '\n'.join(text for text, _ in lines)
+    new_code, _ = load_program(result)
+    _, parsed_count = parse(result)
+    before = [cycles for _, cycles in checker.expected]
+    after = checker.cycles(new_code)
+
+    print(f"Optimized {args.program} (challenge {problem}: {challenge['name']}; checked on "
+          f"{len(tests)} tests and {args.random} random inputs)")
+    for origin, old, new, reason in sorted(applied, key=lambda change: change[0]):
+        change = f"`{old}` -> `{new}`" if new is not None else f"removed `{old}`"
+        print(f"  line {origin + 1}: {change} ({reason})")
+    if not applied:
+        print("  no rewrites found")
+    print(f"  Instructions: {count} -> {parsed_count} ({parsed_count - count:+d})")
+    n = len(tests)
+    print(f"  Cycles on the tests: {sum(before[:n])} -> {sum(after[:n])} "
+          f"({sum(after[:n]) - sum(before[:n]):+d})")
+    print(f"  Cycles on all inputs: {sum(before)} -> {sum(after)} "
+          f"({sum(after) - sum(before):+d})")
+    if applied:
+        print()
+        sys.stdout.writelines(difflib.unified_diff(
+            [line + '\n' for line in source.split('\n')],
+            [line + '\n' for line in result.split('\n')],
+            args.program, args.output or 'optimized'))
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(result)
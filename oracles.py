@@ -0,0 +1,342 @@
+import itertools
+import math
+import random
+from collections import deque, namedtuple
+from concurrent.futures import ProcessPoolExecutor
+
+from sim import Cosmo8, CosmoError, load_program, s16
+
+# Reference implementations and random input generators for every challenge,
+# for differential testing beyond the hand-written tests. Each Spec describes
+# the shape of a challenge's input (an optional leading count N, the values,
+# and a trailing search target for bsearch) and the constraints inputs must
+# meet, and computes the expected output in Python. Arithmetic results wrap to
+# 16 bits like the machine's. A failing case is shrunk by deleting values and
+# moving them towards zero while the program still fails, so the reported
+# counterexample is small. Everything is driven by one seed.
+
+FULL = (-32768, 32767)
+# Values whose differences fit in 16 bits, so comparison by subtraction is exact.
+HALF = (-16384, 16383)
+
+FuzzFailure = namedtuple('FuzzFailure', 'case original inputs expected outputs error')
+# Result of exhaustive(): the number of inputs checked, failing ones as
+# (inputs, expected, outputs, error) in input order, and the most cycles any
+# checked input took with the first input that took them.
+Sweep = namedtuple('Sweep', 'cases failures worst_cycles worst_inputs')
+
+# Largest input domain exhaustive() will enumerate.
+DOMAIN_LIMIT = 1 << 20
+# Domains at least this large run on the NumPy batch engine. Below it, one
+# reused jit machine is faster: a few hundred long, diverging runs (05_primes)
+# took 20 times as long in lockstep.
+BATCH_DOMAIN = 4096
+# exhaustive() first runs this many inputs spread evenly over the domain, then
+# the rest in chunks of SWEEP_CHUNK, and stops at the first point where it has
+# found enough failures. A program that never halts is caught by the probe in
+# a few runs instead of taking every lane to the cycle limit.
+SWEEP_PROBE = 64
+SWEEP_CHUNK = 2048
+
+
+class Spec:
+    def __init__(self, oracle, count=None, length=None, values=FULL, ordered=False,
+                 target=False, runs=False):
+        self.oracle = oracle
+        self.count = count
+        self.length = length
+        self.values = values
+        self.ordered = ordered
+        self.target = target
+        self.runs = runs
+
+    def _value(self, rng):
+        low, high = self.values
+        if rng.random() < 0.1:
+            return rng.choice([v for v in (low, high, 0, 1, -1) if low <= v <= high])
+        return rng.randint(low, high)
+
+    def generate(self, rng):
+        n = rng.randint(*self.count) if self.count else self.length
+        if self.runs:
+            # Few distinct values, so that runs actually occur.
+            alphabet = [self._value(rng) for _ in range(rng.randint(1, 4))]
+            values = []
+            while len(values) < n:
+                values += [rng.choice(alphabet)] * rng.randint(1, 5)
+            values = values[:n]
+        else:
+            values = [self._value(rng) for _ in range(n)]
+        if self.ordered:
+            values.sort()
+        tail = []
+        if self.target:
+            tail = [rng.choice(values) if values and rng.random() < 0.5 else self._value(rng)]
+        return self.join(values, tail)
+
+    def split(self, inputs):
+        start = 1 if self.count else 0
+        end = len(inputs) - (1 if self.target else 0)
+        return inputs[start:end], inputs[end:]
+
+    def join(self, values, tail=()):
+        return ([len(values)] if self.count else []) + list(values) + list(tail)
+
+    def valid(self, inputs):
+        values, tail = self.split(inputs)
+        if self.count:
+            low, high = self.count
+            if not inputs or inputs[0] != len(values) or not low <= len(values) <= high:
+                return False
+        elif len(values) != self.length:
+            return False
+        if self.target and len(tail) != 1:
+            return False
+        low, high = self.values
+        if not all(low <= v <= high for v in values + tail):
+            return False
+        return not self.ordered or values == sorted(values)
+
+    def _simpler(self, value):
+        # Values between `value` and the simplest one (0, or the lowest
+        # allowed), closest to the simplest first: distances shrink by halving.
+        low, high = self.values
+        simplest = 0 if low <= 0 <= high else low
+        distance = abs(value - simplest)
+        sign = 1 if value > simplest else -1
+        steps = [distance >> k for k in range(distance.bit_length() + 1)] + [distance - 1]
+        return [simplest + sign * d for d in sorted(set(steps)) if 0 <= d < distance]
+
+    def shrinks(self, inputs):
+        # Smaller variants of `inputs`, not all of them valid.
+        values, tail = self.split(inputs)
+        if self.count:
+            for i in range(len(values)):
+                yield self.join(values[:i] + values[i + 1:], tail)
+        items = values + tail
+        for i, value in enumerate(items):
+            for simpler in self._simpler(value):
+                changed = items[:i] + [simpler] + items[i + 1:]
+                yield self.join(changed[:len(values)], changed[len(values):])
+
+    def domain(self):
+        # Every valid input, in order, if there is a fixed number of values
+        # and at most DOMAIN_LIMIT combinations of them; otherwise None.
+        if self.count or self.target or self.ordered or self.runs:
+            return None
+        low, high = self.values
+        if (high - low + 1) ** self.length > DOMAIN_LIMIT:
+            return None
+        return [list(values) for values in
+                itertools.product(range(low, high + 1), repeat=self.length)]
+
+    def expected(self, inputs):
+        values, tail = self.split(inputs)
+        return self.oracle(values, *tail)
+
+
+def _sum(values):
+    return [s16(sum(values))]
+
+
+def _reverse(values):
+    return values[::-1]
+
+
+def _fibonacci(values):
+    a, b = 1, 1
+    out = []
+    for _ in range(values[0]):
+        out.append(s16(a))
+        a, b = b, a + b
+    return out
+
+
+def _sort(values):
+    return sorted(values)
+
+
+def _primes(values):
+    n = values[0]
+    return [p for p in range(2, n + 1) if all(p % d for d in range(2, math.isqrt(p) + 1))]
+
+
+def _matmul(values):
+    a, b = values[:4], values[4:]
+    return [s16(a[i] * b[j] + a[i + 1] * b[j + 2]) for i in (0, 2) for j in (0, 1)]
+
+
+def _gcd(values):
+    return [math.gcd(*values)]
+
+
+def _bsearch(values, target):
+    return [int(target in values)]
+
+
+def _rle(values):
+    out = []
+    for value in values:
+        if out and out[-2] == value:
+            out[-1] += 1
+        else:
+            out += [value, 1]
+    return out
+
+
+def _isqrt(values):
+    return [math.isqrt(values[0] & 0xFFFF)]
+
+
+# Input sizes stay within what fits the machine: 256 words of memory and a
+# 32-entry stack.
+SPECS = {
+    1: Spec(_sum, count=(0, 40)),
+    2: Spec(_reverse, count=(1, 30)),
+    3: Spec(_fibonacci, length=1, values=(1, 30)),
+    4: Spec(_sort, count=(1, 30), values=HALF),
+    5: Spec(_primes, length=1, values=(2, 255)),
+    6: Spec(_matmul, length=8),
+    7: Spec(_gcd, count=(1, 20), values=(1, 32767)),
+    8: Spec(_bsearch, count=(1, 30), values=HALF, ordered=True, target=True),
+    9: Spec(_rle, count=(1, 40), runs=True),
+    10: Spec(_isqrt, length=1, values=(0, 65535)),
+}
+
+
+def shrink(spec, inputs, fails):
+    # Greedy: take the first smaller valid variant that still fails, repeat.
+    improved = True
+    while improved:
+        improved = False
+        for candidate in spec.shrinks(inputs):
+            if spec.valid(candidate) and fails(candidate):
+                inputs = candidate
+                improved = True
+                break
+    return inputs
+
+
+def fuzz(source, challenge, cases=1000, seed=0, engine=None, detect_loops=False, costs=None):
+    # Runs `cases` random inputs through the program and the challenge's
+    # oracle. Returns None if they all agree, otherwise a FuzzFailure with the
+    # first failing case shrunk to a minimal one. Raises CosmoError if the
+    # source does not assemble.
+    spec = SPECS[challenge["number"]]
+    program, _ = load_program(source)
+    machine = Cosmo8(program, engine=engine, detect_loops=detect_loops, costs=costs)
+
+    def run(inputs):
+        machine.reset(inputs)
+        try:
+            machine.run()
+        except CosmoError as e:
+            return None, str(e)
+        return [val for _, val in machine.outputs], None
+
+    def fails(inputs):
+        return run(inputs)[0] != [s16(v) for v in spec.expected(inputs)]
+
+    rng = random.Random(seed)
+    for case in range(cases):
+        inputs = spec.generate(rng)
+        if fails(inputs):
+            shrunk = shrink(spec, inputs, fails)
+            outputs, error = run(shrunk)
+            return FuzzFailure(case, inputs, shrunk, [s16(v) for v in spec.expected(shrunk)],
+                               outputs, error)
+    return None
+
+
+def _run_batch(program, cases, costs):
+    from batch import BatchCosmo8
+
+    machine = BatchCosmo8(program, cases, costs)
+    machine.run()
+    for lane in range(len(cases)):
+        error = machine.errors[lane]
+        outputs = machine.output_values(lane) if error is None else None
+        yield outputs, error, int(machine.cycles[lane])
+
+
+def _run_each(program, cases, costs):
+    machine = Cosmo8(program, engine='jit', costs=costs)
+    for inputs in cases:
+        machine.reset(inputs)
+        try:
+            machine.run()
+        except CosmoError as e:
+            yield None, str(e), machine.cycles
+        else:
+            yield [val for _, val in machine.outputs], None, machine.cycles
+
+
+def _sweep_chunk(source, spec_number, cases, costs, limit, batch):
+    # Returns (inputs checked, failures, worst cycles, worst inputs). One at a
+    # time, inputs stop being run once `limit` of them have failed.
+    spec = SPECS[spec_number]
+    program, _ = load_program(source)
+    runs = _run_batch(program, cases, costs) if batch else _run_each(program, cases, costs)
+    failures = []
+    checked = 0
+    worst_cycles, worst_inputs = -1, None
+    for inputs, (outputs, error, cycles) in zip(cases, runs):
+        checked += 1
+        expected = [s16(v) for v in spec.expected(inputs)]
+        if outputs != expected and len(failures) < limit:
+            failures.append((inputs, expected, outputs, error))
+        if cycles > worst_cycles:
+            worst_cycles, worst_inputs = cycles, inputs
+        if not batch and len(failures) >= limit:
+            break
+    return checked, failures, worst_cycles, worst_inputs
+
+
+def exhaustive(source, challenge, jobs=1, costs=None, limit=5):
+    # Checks the program against the challenge's oracle on every input of
+    # Spec.domain(), or until `limit` inputs have failed. After the probe the
+    # chunks run over `jobs` processes, each sharing one decoded program, but
+    # are taken in order, so the result does not depend on `jobs`. Returns a
+    # Sweep, or None if the challenge has no enumerable domain. Raises
+    # CosmoError if the source does not assemble.
+    domain = SPECS[challenge["number"]].domain()
+    if domain is None:
+        return None
+    load_program(source)
+    stride = max(1, len(domain) // SWEEP_PROBE)
+    probe = domain[::stride]
+    rest = [inputs for i, inputs in enumerate(domain) if i % stride]
+    batch = len(domain) >= BATCH_DOMAIN
+    results = [_sweep_chunk(source, challenge["number"], probe, costs, limit, False)]
+    args = [(source, challenge["number"], rest[i:i + SWEEP_CHUNK], costs, limit, batch)
+            for i in range(0, len(rest), SWEEP_CHUNK)]
+
+    def enough():
+        return sum(len(failures) for _, failures, _, _ in results) >= limit
+
+    if jobs > 1 and not enough():
+        # At most `jobs` chunks in flight, so little work is left to wait for
+        # once enough failures are in.
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            queued = iter(args)
+            running = deque(pool.submit(_sweep_chunk, *arg)
+                                        for arg in itertools.islice(queued, jobs))
+            while running and not enough():
+                results.append(running.popleft().result())
+                for arg in itertools.islice(queued, 1):
+                    running.append(pool.submit(_sweep_chunk, *arg))
+    else:
+        for arg in args:
+            if enough():
+                break
+            results.append(_sweep_chunk(*arg))
+
+    failures = sorted(failure for _, chunk_failures, _, _ in results
+                      for failure in chunk_failures)
+    worst_cycles, worst_inputs = -1, None
+    for _, _, cycles, inputs in results:
+        # Ties go to the input that comes first in the domain.
+        if cycles > worst_cycles or cycles == worst_cycles and inputs < worst_inputs:
+            worst_cycles, worst_inputs = cycles, inputs
+    return Sweep(sum(checked for checked, _, _, _ in results), failures[:limit],
+                 worst_cycles, worst_inputs)
@@ -0,0 +1,144 @@
+import sys
+
+from sim import (
+    CosmoError, HALTED, FAULTED, THREADED_HANDLERS, instruction_lines,
+    _bind_loop_detection, _Halt, _Escape,
+    OP_HLT, OP_NOP, OP_MOV, OP_ADD, OP_SUB, OP_MUL, OP_MOD, OP_AND, OP_OR,
+    OP_XOR, OP_NOT, OP_SHL, OP_SHR, OP_CMP, OP_LOAD, OP_STORE, OP_JMP, OP_JZ,
+    OP_JNZ, OP_JN, OP_JC, OP_CALL, OP_RET, OP_PUSH, OP_POP, OP_READ, OP_WRITE,
+)
+
+# Execution profiler. Runs the machine with the threaded engine's handlers in
+# a separate loop that counts every executed address and every control
+# transfer, so the normal engines carry no instrumentation at all. Hot loops
+# are found from backward transfers: a jump from `tail` back to `head` closes
+# the loop head..tail, and its trip count is the number of such jumps.
+
+OPCODE_CLASSES = {
+    'alu': (OP_MOV, OP_ADD, OP_SUB, OP_MUL, OP_MOD, OP_AND, OP_OR, OP_XOR,
+            OP_NOT, OP_SHL, OP_SHR, OP_CMP),
+    'memory': (OP_LOAD, OP_STORE),
+    'branch': (OP_JMP, OP_JZ, OP_JNZ, OP_JN, OP_JC),
+    'call': (OP_CALL, OP_RET),
+    'stack': (OP_PUSH, OP_POP),
+    'io': (OP_READ, OP_WRITE),
+    'other': (OP_HLT, OP_NOP),
+}
+
+CONDITIONAL = (OP_JZ, OP_JNZ, OP_JN, OP_JC)
+
+
+class Profiler:
+    def __init__(self, machine):
+        self.machine = machine
+        n = len(machine.code)
+        self.hits = [0] * n
+        self.taken = [0] * n
+        self.back_edges = {}
+
+    def run(self):
+        m = self.machine
+        if m.detect_loops:
+            fns = _bind_loop_detection(m)
+        else:
+            fns = [THREADED_HANDLERS[ins.op](m, ins, ip) for ip, ins in enumerate(m.code)]
+        costs = [m.op_costs[ins.op] for ins in m.code]
+        extra = [m.taken_extra[ins.op] for ins in m.code]
+        hits = self.hits
+        taken = self.taken
+        back_edges = self.back_edges
+        n = len(fns)
+        limit = m.CYCLE_LIMIT
+        ip = m.ip
+        cycles = m.cycles
+
+        try:
+            try:
+                while 0 <= ip < n:
+                    if cycles >= limit:
+                        raise CosmoError(f"Cycle limit exceeded ({limit})")
+                    cycles += costs[ip]
+                    hits[ip] += 1
+                    nxt = fns[ip]()
+                    if nxt != ip + 1:
+                        cycles += extra[ip]
+                        taken[ip] += 1
+                        if nxt <= ip:
+                            edge = (nxt, ip)
+                            back_edges[edge] = back_edges.get(edge, 0) + 1
+                    ip = nxt
+            except _Halt:
+                m.status = HALTED
+                return
+            except _Escape as escape:
+                cycles += extra[ip]
+                ip = escape.ip
+            finally:
+                m.ip = ip
+                m.cycles = cycles
+
+            # Negative IPs only run in the reference loop; they are not profiled.
+            if ip < 0:
+                m._run_loop()
+                m.status = HALTED
+                return
+            raise CosmoError(f"Execution fell off end of program at IP={ip}")
+        except CosmoError as e:
+            m.error = e
+            m.status = FAULTED
+            raise
+
+    def address_cycles(self, ip):
+        m = self.machine
+        op = m.code[ip].op
+        return self.hits[ip] * m.op_costs[op] + self.taken[ip] * m.taken_extra[op]
+
+    def class_cycles(self):
+        code = self.machine.code
+        totals = {name: 0 for name in OPCODE_CLASSES}
+        classes = {op: name for name, ops in OPCODE_CLASSES.items() for op in ops}
+        for ip in range(len(code)):
+            name = classes.get(code[ip].op, 'other')
+            totals[name] += self.address_cycles(ip)
+        return totals
+
+    def hot_loops(self, top=5):
+        # Back edges sharing a head are one loop; its body runs to the last tail.
+        loops = {}
+        for (head, tail), count in self.back_edges.items():
+            end, trips = loops.get(head, (tail, 0))
+            loops[head] = (max(end, tail), trips + count)
+        ranked = [(sum(self.address_cycles(ip) for ip in range(head, end + 1)), head, end, trips)
+                  for head, (end, trips) in loops.items()]
+        ranked.sort(reverse=True)
+        return [(head, end, trips, cycles) for cycles, head, end, trips in ranked[:top]]
+
+    def report(self, source, out=sys.stderr):
+        code = self.machine.code
+        total = sum(self.address_cycles(ip) for ip in range(len(code))) or 1
+        print("--- Profile ---", file=out)
+        print("Cycles by opcode class:", file=out)
+        for name, count in self.class_cycles().items():
+            if count:
+                print(f"  {name:<8} {count:>9} {count / total:>7.1%}", file=out)
+
+        loops = self.hot_loops()
+        lines = source.rstrip('\n').split('\n')
+        where = instruction_lines(source)
+        if loops:
+            print("Hottest loops:", file=out)
+            for head, end, trips, cycles in loops:
+                print(f"  IP {head}-{end} (line {where[head] + 1}): {trips} iterations, "
+                      f"{cycles} cycles {cycles / total:.1%}", file=out)
+
+        print("Listing (hits, taken-branch ratio):", file=out)
+        margins = {}
+        for ip, lineno in enumerate(where):
+            hits = self.hits[ip]
+            ratio = ''
+            if code[ip].op in CONDITIONAL and hits:
+                ratio = f"{self.taken[ip] / hits:.0%}"
+            margins[lineno] = f"{hits:>9} {ratio:>5}"
+        blank = ' ' * 15
+        for lineno, line in enumerate(lines):
+            print(f"{margins.get(lineno, blank)} | {line}", file=out)
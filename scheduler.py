@@ -0,0 +1,40 @@
+import asyncio
+
+from sim import RUNNING, WAITING
+
+# Time-sharing of many Cosmo8 machines on one asyncio event loop. Each machine
+# runs in slices of at most `slice_cycles` cycles and yields to the event loop
+# between slices, so a long-running program holds up the others for at most
+# one slice. A machine given an async input source suspends when a READ finds
+# no input left, and resumes once the source produces a value; when the source
+# is exhausted the READ faults as usual.
+
+SLICE_CYCLES = 1000
+
+
+async def drive(machine, input_source=None, slice_cycles=SLICE_CYCLES):
+    if input_source is not None:
+        input_source = aiter(input_source)
+        machine.input_open = True
+    while True:
+        status = machine.run_for(slice_cycles)
+        if status == RUNNING:
+            await asyncio.sleep(0)
+        elif status == WAITING:
+            try:
+                value = await anext(input_source)
+            except StopAsyncIteration:
+                machine.close_input()
+            else:
+                machine.feed([value])
+        else:
+            return status
+
+
+async def run_machines(machines, slice_cycles=SLICE_CYCLES):
+    # `machines` holds Cosmo8 instances or (machine, input_source) pairs.
+    # Returns the final status of each, in order.
+    jobs = [drive(*entry, slice_cycles=slice_cycles) if isinstance(entry, tuple)
+            else drive(entry, slice_cycles=slice_cycles)
+            for entry in machines]
+    return await asyncio.gather(*jobs)
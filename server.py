@@ -0,0 +1,221 @@
+import sys
+import os
+import argparse
+import json
+import signal
+import socket
+import socketserver
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from sim import (Cosmo8, CosmoError, PROGRAM_CACHE, ENGINES, configure_cache, cost_table,
+                 load_program)
+from challenge import CHALLENGES, SCORE_MODES, grade
+
+# Long-lived evaluation server, so that grading calls skip interpreter startup,
+# imports and parsing. Clients connect over a Unix socket or localhost TCP and
+# send one JSON request per line; each gets one JSON response line back, and a
+# connection may carry any number of requests. Every connection has its own
+# thread. With --jobs > 1 the work runs on a pool of worker processes, each
+# keeping its own warm program cache; otherwise requests run one at a time in
+# the server process against its cache, which is not thread-safe.
+#
+#   {"command": "run", "source": ..., "inputs": [...], "engine": ...,
+#    "detect_loops": false, "costs": null}
+#     -> {"ok": true, "outputs": [...], "error": null, "cycles": n, "instructions": n}
+#   {"command": "grade", "problem": n, "source": ..., "score": "size",
+#    "detect_loops": false, "costs": null, "fuzz": 0, "seed": 0,
+#    "exhaustive": false, "static_check": false}
+#     -> {"ok": true, "passed": ..., "tests": [...], "tier": ..., ...}
+#        (challenge.grade's result)
+#   {"command": "stats"} -> {"ok": true, "requests": n, "jobs": n, "cache": {...}}
+#
+# A request the server cannot handle gets {"ok": false, "error": message}.
+# An address containing ':' is HOST:PORT, anything else a socket path.
+
+DEFAULT_ADDRESS = (os.environ.get('COSMO8_SERVER')
+                   or os.path.join(os.environ.get('TMPDIR', '/tmp'), 'cosmo8.sock'))
+
+
+def parse_address(address):
+    if ':' in address:
+        host, port = address.rsplit(':', 1)
+        return host or 'localhost', int(port)
+    return address
+
+
+def run_request(request):
+    source = request['source']
+    try:
+        program, instruction_count = load_program(source)
+    except CosmoError as e:
+        return {'outputs': None, 'error': f"Parse error: {e}", 'cycles': 0,
+                'instructions': None}
+    machine = Cosmo8(program, inputs=request.get('inputs', []), engine=request.get('engine'),
+                     detect_loops=request.get('detect_loops', False),
+                     costs=request.get('costs'))
+    try:
+        machine.run()
+    except CosmoError as e:
+        return {'outputs': None, 'error': str(e), 'cycles': machine.cycles,
+                'instructions': instruction_count}
+    return {'outputs': [val for _, val in machine.outputs], 'error': None,
+            'cycles': machine.cycles, 'instructions': instruction_count}
+
+
+def grade_request(request):
+    # challenge.grade. An exhaustive check sweeps on one process; --jobs
+    # already spreads requests over the server's workers.
+    return grade(CHALLENGES[request['problem'] - 1], request['source'],
+                 detect_loops=request.get('detect_loops', False),
+                 score=request.get('score', 'size'), costs=request.get('costs'),
+                 fuzz_cases=request.get('fuzz', 0), fuzz_seed=request.get('seed', 0),
+                 sweep=request.get('exhaustive', False),
+                 static_check=request.get('static_check', False))
+
+
+COMMANDS = {'run': run_request, 'grade': grade_request}
+
+
+def check_request(request):
+    # Rejects malformed requests up front, in the server process, so that
+    # workers only ever see requests they can run.
+    command = request.get('command')
+    if command == 'stats':
+        return
+    if command not in COMMANDS:
+        raise ValueError(f"unknown command: {command}")
+    if not isinstance(request.get('source'), str):
+        raise ValueError("'source' must be a string")
+    if request.get('engine') not in (None,) + ENGINES:
+        raise ValueError(f"unknown engine: {request['engine']}")
+    if request.get('costs') is not None:
+        cost_table(request['costs'])
+    for flag in ('detect_loops', 'exhaustive', 'static_check'):
+        if not isinstance(request.get(flag, False), bool):
+            raise ValueError(f"'{flag}' must be true or false")
+    if command == 'run':
+        inputs = request.get('inputs', [])
+        if not isinstance(inputs, list) or not all(isinstance(x, int) for x in inputs):
+            raise ValueError("'inputs' must be a list of integers")
+        return
+    if request.get('problem') not in range(1, len(CHALLENGES) + 1):
+        raise ValueError(f"invalid problem number: {request.get('problem')}")
+    if request.get('score', 'size') not in SCORE_MODES:
+        raise ValueError(f"invalid score: {request['score']} "
+                         f"(choose from {', '.join(SCORE_MODES)})")
+    fuzz_cases = request.get('fuzz', 0)
+    if not isinstance(fuzz_cases, int) or isinstance(fuzz_cases, bool) or fuzz_cases < 0:
+        raise ValueError("'fuzz' must be a non-negative integer")
+    seed = request.get('seed', 0)
+    if not isinstance(seed, int) or isinstance(seed, bool):
+        raise ValueError("'seed' must be an integer")
+
+
+class EvaluationServer(socketserver.ThreadingMixIn):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def setup_server(self, jobs, cache_dir):
+        self.jobs = jobs
+        self.pool = None
+        if jobs > 1:
+            self.pool = ProcessPoolExecutor(max_workers=jobs, initializer=configure_cache,
+                                            initargs=(cache_dir,))
+        self.requests = 0
+        self.lock = threading.Lock()
+        self.run_lock = threading.Lock()
+
+    def evaluate(self, request):
+        with self.lock:
+            self.requests += 1
+        check_request(request)
+        if request['command'] == 'stats':
+            return {'requests': self.requests, 'jobs': self.jobs,
+                    'cache': PROGRAM_CACHE.stats()}
+        handler = COMMANDS[request['command']]
+        if self.pool:
+            return self.pool.submit(handler, request).result()
+        with self.run_lock:
+            return handler(request)
+
+
+class UnixEvaluationServer(EvaluationServer, socketserver.UnixStreamServer):
+    pass
+
+
+class TCPEvaluationServer(EvaluationServer, socketserver.TCPServer):
+    pass
+
+
+class RequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        for line in self.rfile:
+            if not line.strip():
+                continue
+            try:
+                request = json.loads(line)
+                if not isinstance(request, dict):
+                    raise ValueError("request must be a JSON object")
+                response = {'ok': True, **self.server.evaluate(request)}
+            except (ValueError, KeyError, TypeError) as e:
+                response = {'ok': False, 'error': str(e)}
+            self.wfile.write(json.dumps(response).encode() + b'\n')
+            self.wfile.flush()
+
+
+def make_server(address, jobs=1, cache_dir=None):
+    address = parse_address(address)
+    if isinstance(address, tuple):
+        server = TCPEvaluationServer(address, RequestHandler)
+    else:
+        if os.path.exists(address):
+            # A leftover socket from a server that did not shut down cleanly.
+            probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                probe.connect(address)
+            except OSError:
+                os.unlink(address)
+            else:
+                raise OSError(f"a server is already listening on {address}")
+            finally:
+                probe.close()
+        server = UnixEvaluationServer(address, RequestHandler)
+    server.setup_server(jobs, cache_dir)
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Cosmo-8 evaluation server")
+    parser.add_argument("--address", type=str, default=DEFAULT_ADDRESS,
+                        help="Unix socket path, or HOST:PORT for TCP "
+                             f"(default: $COSMO8_SERVER or {DEFAULT_ADDRESS})")
+    parser.add_argument("--jobs", type=int, default=1,
+                        help="Worker processes (default: 1, run in the server process)")
+    parser.add_argument("--cache-dir", type=str, default=None,
+                        help="Directory for the on-disk assembled program cache")
+    args = parser.parse_args()
+
+    if args.cache_dir:
+        configure_cache(args.cache_dir)
+    try:
+        server = make_server(args.address, args.jobs, args.cache_dir)
+    except (OSError, ValueError) as e:
+        parser.error(str(e))
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    print(f"Listening on {args.address} ({args.jobs} job{'s' if args.jobs != 1 else ''})",
+          file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if server.pool:
+            server.pool.shutdown()
+        if not isinstance(server.server_address, tuple):
+            os.unlink(server.server_address)
+
+
+if __name__ == "__main__":
+    main()
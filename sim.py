@@ -1,6 +1,15 @@
 import sys
+import os
 import argparse
+import functools
+import hashlib
+import itertools
+import marshal
+import random
 import re
+import struct
+from array import array
+from collections import OrderedDict, namedtuple
 
 
 def s16(value):
@@ -18,14 +27,191 @@ class CosmoError(Exception):
     pass
 
 
+OPCODES = (
+    'HLT', 'NOP', 'MOV', 'ADD', 'SUB', 'MUL', 'MOD', 'AND', 'OR', 'XOR',
+    'NOT', 'SHL', 'SHR', 'CMP', 'LOAD', 'STORE', 'JMP', 'JZ', 'JNZ', 'JN',
+    'JC', 'CALL', 'RET', 'PUSH', 'POP', 'READ', 'WRITE',
+)
+
+(OP_HLT, OP_NOP, OP_MOV, OP_ADD, OP_SUB, OP_MUL, OP_MOD, OP_AND, OP_OR,
+ OP_XOR, OP_NOT, OP_SHL, OP_SHR, OP_CMP, OP_LOAD, OP_STORE, OP_JMP, OP_JZ,
+ OP_JNZ, OP_JN, OP_JC, OP_CALL, OP_RET, OP_PUSH, OP_POP, OP_READ,
+ OP_WRITE) = range(len(OPCODES))
+
+# Decoding never fails: an instruction that cannot be decoded becomes OP_BAD
+# and faults with the message in `a` only if it is actually executed.
+OP_BAD = len(OPCODES)
+
+OPCODE_INDEX = {name: i for i, name in enumerate(OPCODES)}
+
+# 'threaded' runs prebound per-instruction closures; 'loop' is the reference
+# interpreter that dispatches through a single if/elif chain; 'jit' compiles
+# basic blocks to Python code (see jit.py).
+ENGINES = ('threaded', 'loop', 'jit')
+
+# A decoded instruction. `r` is the register operand (the destination, or the
+# source for STORE and WRITE). `a` and `b` are source operands holding either
+# an immediate or a register index, as told by `a_imm` and `b_imm`; for
+# LOAD/STORE `a` is the address, for jumps the resolved target and for
+# READ/WRITE the port.
+Instr = namedtuple('Instr', 'op r a a_imm b b_imm')
+
+# Cycle cost presets: opcode name -> cycles per execution, 1 if not listed.
+# TAKEN is what a conditional jump costs when it is taken, i.e. when it
+# transfers control anywhere but the next instruction.
+COST_MODELS = {
+    'unit': {},
+    'hardware': {'MUL': 3, 'MOD': 8, 'LOAD': 2, 'STORE': 2, 'JMP': 2, 'CALL': 2,
+                 'RET': 2, 'TAKEN': 2},
+}
+
+CONDITIONAL_JUMPS = (OP_JZ, OP_JNZ, OP_JN, OP_JC)
+UNIT_COSTS = (1,) * (OP_BAD + 1)
+
+
+def parse_costs(spec):
+    # "hardware", "MUL=3,MOD=8" or "hardware,MUL=4": presets and overrides,
+    # applied left to right.
+    costs = {}
+    for item in spec.split(','):
+        item = item.strip()
+        if not item:
+            continue
+        if '=' in item:
+            name, value = item.split('=', 1)
+            costs[name.strip().upper()] = int(value)
+        elif item in COST_MODELS:
+            costs.update(COST_MODELS[item])
+        else:
+            raise ValueError(f"Unknown cost model: {item}")
+    return costs
+
+
+def cost_table(costs=None):
+    # Resolves a cost model (preset name, spec string or dict) into two tuples
+    # indexed by opcode: the cycles each instruction costs, and the extra
+    # cycles a taken conditional jump adds.
+    if isinstance(costs, dict):
+        costs = tuple(sorted(costs.items()))
+    return _cost_table(costs)
+
+
+@functools.lru_cache(maxsize=64)
+def _cost_table(costs):
+    if costs is None:
+        costs = {}
+    elif isinstance(costs, str):
+        costs = parse_costs(costs)
+    else:
+        costs = dict(costs)
+    op_costs = [1] * (OP_BAD + 1)
+    for name, cycles in costs.items():
+        if name == 'TAKEN':
+            continue
+        if name not in OPCODE_INDEX:
+            raise ValueError(f"Unknown opcode in cost model: {name}")
+        if cycles < 1:
+            raise ValueError(f"Cost of {name} must be at least 1")
+        op_costs[OPCODE_INDEX[name]] = cycles
+    taken_extra = [0] * (OP_BAD + 1)
+    if 'TAKEN' in costs:
+        for op in CONDITIONAL_JUMPS:
+            if costs['TAKEN'] < op_costs[op]:
+                raise ValueError(f"TAKEN cost is below the cost of {OPCODES[op]}")
+            taken_extra[op] = costs['TAKEN'] - op_costs[op]
+    return tuple(op_costs), tuple(taken_extra)
+
+
+# Machine status returned by Cosmo8.run_for() and Cosmo8.step().
+RUNNING, HALTED, FAULTED, WAITING = 'running', 'halted', 'faulted', 'waiting'
+STATUSES = (RUNNING, HALTED, FAULTED, WAITING)
+
+
+class Snapshot:
+    # Complete machine state, as taken by Cosmo8.snapshot(). Registers, memory
+    # and stack share one array('h') of 16-bit words in that order; the
+    # program itself is not part of the state. to_bytes()/from_bytes() give a
+    # flat little-endian encoding for checkpoints or for other processes.
+    __slots__ = ('words', 'ip', 'sp', 'flags', 'cycles', 'inputs', 'input_idx',
+                 'input_open', 'outputs', 'status')
+    MAGIC = b'C8S1'
+    HEADER = struct.Struct('<4sHHHiHBBqIII')
+
+    def __init__(self, words, ip, sp, flags, cycles, inputs, input_idx, input_open, outputs,
+                 status):
+        self.words = words
+        self.ip = ip
+        self.sp = sp
+        self.flags = flags
+        self.cycles = cycles
+        self.inputs = inputs
+        self.input_idx = input_idx
+        self.input_open = input_open
+        self.outputs = outputs
+        self.status = status
+
+    def to_bytes(self):
+        regs = Cosmo8.NUM_REGS
+        header = self.HEADER.pack(self.MAGIC, regs, Cosmo8.MEM_SIZE, Cosmo8.STACK_DEPTH,
+                                  self.ip, self.sp, self.flags,
+                                  STATUSES.index(self.status) | self.input_open << 7,
+                                  self.cycles, self.input_idx, len(self.inputs),
+                                  len(self.outputs))
+        words = self.words
+        if sys.byteorder != 'little':
+            words = array('h', words)
+            words.byteswap()
+        inputs = array('i', self.inputs)
+        outputs = array('i', [x for pair in self.outputs for x in pair])
+        if sys.byteorder != 'little':
+            inputs.byteswap()
+            outputs.byteswap()
+        return header + words.tobytes() + inputs.tobytes() + outputs.tobytes()
+
+    @classmethod
+    def from_bytes(cls, data):
+        (magic, regs, mem_size, depth, ip, sp, flags, status, cycles, input_idx, n_inputs,
+         n_outputs) = cls.HEADER.unpack_from(data)
+        if magic != cls.MAGIC:
+            raise ValueError("not a Cosmo-8 snapshot")
+        if (regs, mem_size, depth) != (Cosmo8.NUM_REGS, Cosmo8.MEM_SIZE, Cosmo8.STACK_DEPTH):
+            raise ValueError(f"snapshot layout {regs}/{mem_size}/{depth} does not match "
+                             "this machine")
+        view = memoryview(data)[cls.HEADER.size:]
+        n_words = regs + mem_size + depth
+        words, inputs, outputs = array('h'), array('i'), array('i')
+        words.frombytes(view[:2 * n_words])
+        inputs.frombytes(view[2 * n_words:2 * n_words + 4 * n_inputs])
+        outputs.frombytes(view[2 * n_words + 4 * n_inputs:])
+        if sys.byteorder != 'little':
+            words.byteswap()
+            inputs.byteswap()
+            outputs.byteswap()
+        if len(words) != n_words or len(outputs) != 2 * n_outputs:
+            raise ValueError("truncated Cosmo-8 snapshot")
+        return cls(words, ip, sp, flags, cycles, tuple(inputs), input_idx,
+                   bool(status & 0x80), tuple(zip(outputs[::2], outputs[1::2])),
+                   STATUSES[status & 0x7F])
+
+
 class Cosmo8:
     CYCLE_LIMIT = 100_000
     MEM_SIZE = 256
     STACK_DEPTH = 32
     NUM_REGS = 8
 
-    def __init__(self, program, inputs=None):
+    ENGINE = 'threaded'
+    COSTS = None
+
+    def __init__(self, program, inputs=None, engine=None, detect_loops=False, output=None,
+                 costs=None):
+        if engine is None:
+            engine = self.ENGINE
+        if engine not in ENGINES:
+            raise ValueError(f"Unknown engine: {engine}")
+        self.engine = engine
         self.program = program
+        self.code = decode(program)
         self.regs = [0] * self.NUM_REGS
         self.memory = [0] * self.MEM_SIZE
         self.stack = [0] * self.STACK_DEPTH
@@ -34,18 +220,143 @@ class Cosmo8:
         self.flag_z = False
         self.flag_c = False
         self.flag_n = False
-        self.inputs = list(inputs) if inputs else []
-        self.input_idx = 0
+        self._set_inputs(inputs)
         self.outputs = []
+        # WRITE hands each (port, value) pair to `output` when one is given,
+        # instead of collecting it in `outputs`.
+        self._emit = self.outputs.append if output is None else output
         self.cycles = 0
+        # `cycles` and CYCLE_LIMIT are in weighted cycles under a cost model
+        # (see COST_MODELS); the default charges every instruction 1.
+        self.costs = self.COSTS if costs is None else costs
+        self.op_costs, self.taken_extra = cost_table(self.costs)
+        self.unit_cost = self.op_costs == UNIT_COSTS and not any(self.taken_extra)
+        self.detect_loops = detect_loops
+        # While input_open is set, a READ with no input left pauses the
+        # machine (WAITING) until feed() or close_input() is called.
+        self.input_open = False
+        self.status = RUNNING
+        self.error = None
+        self._threaded = None
+        # Observers registered with add_hook(), by event (see HOOK_EVENTS).
+        self.hooks = {event: [] for event in HOOK_EVENTS}
+        self._hooked = None
+        self._hooks_active = False
+
+    def _set_inputs(self, inputs):
+        # A list (or any sequence) is copied into `inputs`. An iterator is read
+        # lazily, one value per READ, and a dict gives each port its own
+        # iterable; neither keeps consumed values.
+        if isinstance(inputs, dict):
+            self._streams = {port: iter(values) for port, values in inputs.items()}
+        elif inputs is not None and iter(inputs) is inputs:
+            self._streams = {None: inputs}
+        else:
+            self._streams = None
+        if self._streams is None:
+            self.inputs = list(inputs) if inputs else []
+            self._read_input = self._read_list
+        else:
+            self.inputs = []
+            self._read_input = self._read_stream
+        self.input_idx = 0
 
-    def _read_input(self, port):
+    def reset(self, inputs=None, program=None):
+        # Returns the machine to its initial state for another run, optionally
+        # of another program, without building a new Cosmo8. Registers, memory,
+        # stack and outputs are cleared in place because the threaded handlers
+        # hold references to them; the handlers themselves are kept unless the
+        # program, the kind of input, or loop detection state needs new ones.
+        streamed = self._streams is not None
+        if program is not None and program is not self.program:
+            self.program = program
+            self.code = decode(program)
+            self._threaded = None
+        self.regs[:] = [0] * self.NUM_REGS
+        self.memory[:] = [0] * self.MEM_SIZE
+        self.stack[:] = [0] * self.STACK_DEPTH
+        self.ip = 0
+        self.sp = 0
+        self.flag_z = False
+        self.flag_c = False
+        self.flag_n = False
+        self._set_inputs(inputs)
+        if streamed != (self._streams is not None) or self.detect_loops:
+            self._threaded = None
+        self.outputs.clear()
+        self.cycles = 0
+        self.input_open = False
+        self.status = RUNNING
+        self.error = None
+
+    def snapshot(self):
+        # Everything needed to resume this machine later, or in another
+        # machine running the same program. Lazy inputs cannot be captured.
+        if self._streams is not None:
+            raise ValueError("cannot snapshot a machine reading lazy inputs")
+        words = array('h', self.regs + self.memory + self.stack)
+        flags = self.flag_z | self.flag_c << 1 | self.flag_n << 2
+        return Snapshot(words, self.ip, self.sp, flags, self.cycles, tuple(self.inputs),
+                        self.input_idx, self.input_open, tuple(self.outputs), self.status)
+
+    def restore(self, snapshot):
+        # Containers are refilled in place (through memoryview slices of the
+        # snapshot's words) since the threaded handlers hold references to them.
+        if isinstance(snapshot, (bytes, bytearray, memoryview)):
+            snapshot = Snapshot.from_bytes(snapshot)
+        view = memoryview(snapshot.words)
+        regs, mem_end = self.NUM_REGS, self.NUM_REGS + self.MEM_SIZE
+        self.regs[:] = view[:regs]
+        self.memory[:] = view[regs:mem_end]
+        self.stack[:] = view[mem_end:]
+        self.ip = snapshot.ip
+        self.sp = snapshot.sp
+        self.flag_z = bool(snapshot.flags & 1)
+        self.flag_c = bool(snapshot.flags & 2)
+        self.flag_n = bool(snapshot.flags & 4)
+        self.cycles = snapshot.cycles
+        if self._streams is not None:
+            self._threaded = None
+        self._set_inputs(list(snapshot.inputs))
+        self.input_idx = snapshot.input_idx
+        self.input_open = snapshot.input_open
+        self.outputs[:] = snapshot.outputs
+        self.status = snapshot.status
+        self.error = None
+        if self.detect_loops:
+            self._threaded = None
+
+    def fork(self):
+        # An independent copy of this machine: same program, settings and
+        # state. Outputs are collected in the copy's own list.
+        machine = type(self)(self.program, engine=self.engine, detect_loops=self.detect_loops,
+                             costs=self.costs)
+        if 'CYCLE_LIMIT' in self.__dict__:
+            machine.CYCLE_LIMIT = self.CYCLE_LIMIT
+        machine.restore(self.snapshot())
+        return machine
+
+    def _read_list(self, port):
         if self.input_idx >= len(self.inputs):
+            if self.input_open:
+                raise _Wait
             raise CosmoError(f"No input available on port {port} (all inputs consumed)")
         val = self.inputs[self.input_idx]
         self.input_idx += 1
         return s16(val)
 
+    def _read_stream(self, port):
+        stream = self._streams.get(port)
+        if stream is None:
+            stream = self._streams.get(None)
+        if stream is not None:
+            for val in stream:
+                self.input_idx += 1
+                return s16(val)
+        if self.input_open:
+            raise _Wait
+        raise CosmoError(f"No input available on port {port} (all inputs consumed)")
+
     def _push(self, value):
         if self.sp >= self.STACK_DEPTH:
             raise CosmoError(f"Stack overflow: SP={self.sp}")
@@ -62,232 +373,1034 @@ class Cosmo8:
         if addr < 0 or addr >= self.MEM_SIZE:
             raise CosmoError(f"Memory access out of bounds: address {addr}")
 
-    def _update_flags_zn(self, result):
-        result = s16(result)
-        self.flag_z = result == 0
-        self.flag_n = result < 0
-        return result
+    def run(self):
+        if self.run_for(None) == FAULTED:
+            raise self.error
+
+    def run_for(self, cycles):
+        # Runs until `cycles` more cycles have been spent (None: until the
+        # program stops) and returns the status. A paused machine resumes
+        # exactly where it left off on the next call.
+        if self.status == WAITING:
+            self.status = RUNNING
+        if self.status != RUNNING:
+            return self.status
+        stop = None if cycles is None else self.cycles + cycles
+        try:
+            if self._hooks_active:
+                halted = self._run_hooked(stop)
+            elif self.detect_loops:
+                halted = self._run_threaded(stop)
+            else:
+                halted = getattr(self, '_run_' + self.engine)(stop)
+        except _Wait:
+            # The READ did not happen; it runs again once input arrives.
+            self.cycles -= self.op_costs[OP_READ]
+            self.status = WAITING
+        except CosmoError as e:
+            self.error = e
+            self.status = FAULTED
+        else:
+            if halted:
+                self.status = HALTED
+        return self.status
+
+    def step(self, n=1):
+        # Runs at most `n` instructions. Under unit costs that is n cycles; a
+        # slice of one cycle always runs exactly one instruction.
+        if self.unit_cost:
+            return self.run_for(n)
+        status = self.status
+        for _ in range(n):
+            status = self.run_for(1)
+            if status != RUNNING:
+                break
+        return status
+
+    def feed(self, values, port=None):
+        # `port` only matters for lazy inputs; a list feeds every port.
+        if self._streams is None:
+            self.inputs.extend(values)
+        else:
+            self._streams[port] = itertools.chain(self._streams.get(port, ()), values)
+
+    def close_input(self):
+        self.input_open = False
+
+    def _run_jit(self, stop=None):
+        from jit import compile_program
+        limit = self.CYCLE_LIMIT if stop is None else min(stop, self.CYCLE_LIMIT)
+        run_compiled = compile_program(self.code, self.MEM_SIZE, self.STACK_DEPTH,
+                                       self.op_costs, self.taken_extra)
+        leaders = run_compiled.leaders
+        n = len(self.code)
+        # Compiled code only enters at block leaders; after it exits (the next
+        # block does not fit under `limit`, or a dynamic target mid-block),
+        # single-step until the next leader.
+        while self.cycles < limit and 0 <= self.ip < n:
+            if self.ip in leaders:
+                if run_compiled(self, limit):
+                    return True
+                if self.cycles >= limit or not 0 <= self.ip < n:
+                    break
+            if self._run_threaded(self.cycles + 1):
+                return True
+        return self._run_threaded(stop)
+
+    def add_hook(self, event, hook):
+        # Calls `hook` on every `event` from the next run_for() on. While any
+        # hook is registered the machine runs a separate instrumented loop;
+        # without hooks the engines run exactly as before.
+        if event not in self.hooks:
+            raise ValueError(f"Unknown hook event: {event}")
+        self.hooks[event].append(hook)
+        self._hooked = None
+        self._hooks_active = True
+
+    def remove_hook(self, event, hook):
+        self.hooks[event].remove(hook)
+        self._hooked = None
+        self._hooks_active = any(self.hooks.values())
+
+    def _hooked_handlers(self):
+        fns = self._threaded_handlers()
+        if self._hooked is None or self._hooked[0] is not fns:
+            self._hooked = (fns, _bind_hooks(self, fns))
+        return self._hooked[1]
+
+    def _run_hooked(self, stop=None):
+        fns = self._hooked_handlers()
+        code = self.code
+        costs = self._ip_costs
+        extra = self._ip_extra
+        retired = self.hooks['instruction']
+        n = len(fns)
+        limit = self.CYCLE_LIMIT
+        stop = limit if stop is None else min(stop, limit)
+        ip = self.ip
+        cycles = self.cycles
+        if ip < 0:
+            return self._run_loop(stop)
 
-    def _update_flags_zcn(self, result, carry=False):
-        result = s16(result)
-        self.flag_z = result == 0
-        self.flag_c = carry
-        self.flag_n = result < 0
-        return result
+        try:
+            while ip < n:
+                if cycles >= stop:
+                    if cycles >= limit:
+                        raise CosmoError(f"Cycle limit exceeded ({limit})")
+                    return False
+                cycles += costs[ip]
+                nxt = fns[ip]()
+                if nxt != ip + 1:
+                    cycles += extra[ip]
+                for hook in retired:
+                    hook(ip, code[ip])
+                ip = nxt
+        except _Halt:
+            for hook in retired:
+                hook(ip, code[ip])
+            return True
+        except _Escape as escape:
+            cycles += extra[ip]
+            for hook in retired:
+                hook(ip, code[ip])
+            ip = escape.ip
+        except CosmoError as e:
+            for hook in self.hooks['fault']:
+                hook(ip, e)
+            raise
+        finally:
+            self.ip = ip
+            self.cycles = cycles
+
+        # Negative IPs only run in the reference loop, which has no hooks.
+        if self.ip < 0:
+            return self._run_loop(stop)
+        e = CosmoError(f"Execution fell off end of program at IP={self.ip}")
+        for hook in self.hooks['fault']:
+            hook(self.ip, e)
+        raise e
+
+    def _threaded_handlers(self):
+        fns = self._threaded
+        if fns is None:
+            if self.detect_loops:
+                fns = _bind_loop_detection(self)
+            else:
+                fns = [THREADED_HANDLERS[ins.op](self, ins, ip)
+                       for ip, ins in enumerate(self.code)]
+            self._threaded = fns
+            self._ip_costs = [self.op_costs[ins.op] for ins in self.code]
+            self._ip_extra = [self.taken_extra[ins.op] for ins in self.code]
+        return fns
+
+    def _run_threaded(self, stop=None):
+        fns = self._threaded_handlers()
+        n = len(fns)
+        limit = self.CYCLE_LIMIT
+        stop = limit if stop is None else min(stop, limit)
+        ip = self.ip
+        cycles = self.cycles
+        if ip < 0:
+            return self._run_loop(stop)
 
-    def _resolve_src(self, operand):
-        if operand.upper().startswith('R'):
-            return self.regs[int(operand[1:])]
-        return s16(int(operand))
+        try:
+            if self.unit_cost:
+                while ip < n:
+                    if cycles >= stop:
+                        if cycles >= limit:
+                            raise CosmoError(f"Cycle limit exceeded ({limit})")
+                        return False
+                    cycles += 1
+                    ip = fns[ip]()
+            else:
+                costs = self._ip_costs
+                extra = self._ip_extra
+                while ip < n:
+                    if cycles >= stop:
+                        if cycles >= limit:
+                            raise CosmoError(f"Cycle limit exceeded ({limit})")
+                        return False
+                    cycles += costs[ip]
+                    nxt = fns[ip]()
+                    if nxt != ip + 1:
+                        cycles += extra[ip]
+                    ip = nxt
+        except _Halt:
+            return True
+        except _Escape as escape:
+            cycles += self._ip_extra[ip]
+            ip = escape.ip
+        finally:
+            self.ip = ip
+            self.cycles = cycles
+
+        if self.ip < 0:
+            return self._run_loop(stop)
+        raise CosmoError(f"Execution fell off end of program at IP={self.ip}")
 
-    def _reg_idx(self, operand):
-        return int(operand.upper()[1:])
+    def _run_loop(self, stop=None):
+        code = self.code
+        regs = self.regs
+        memory = self.memory
+        emit = self._emit
+        op_costs = self.op_costs
+        taken_extra = self.taken_extra
+        limit = self.CYCLE_LIMIT
+        stop = limit if stop is None else min(stop, limit)
+        ip = self.ip
+        cycles = self.cycles
+
+        try:
+            while ip < len(code):
+                if cycles >= stop:
+                    if cycles >= limit:
+                        raise CosmoError(f"Cycle limit exceeded ({limit})")
+                    return False
+
+                op, r, a, a_imm, b, b_imm = code[ip]
+                cycles += op_costs[op]
+                next_ip = ip + 1
+
+                if op == OP_HLT:
+                    return True
+
+                elif op == OP_NOP:
+                    pass
+
+                elif op == OP_MOV:
+                    val = a if a_imm else regs[a]
+                    self.flag_z = val == 0
+                    self.flag_n = val < 0
+                    regs[r] = val
+
+                elif op == OP_ADD:
+                    a = a if a_imm else regs[a]
+                    b = b if b_imm else regs[b]
+                    result = s16(a + b)
+                    self.flag_z = result == 0
+                    self.flag_c = (u16(a) + u16(b)) > 0xFFFF
+                    self.flag_n = result < 0
+                    regs[r] = result
+
+                elif op == OP_SUB:
+                    a = a if a_imm else regs[a]
+                    b = b if b_imm else regs[b]
+                    result = s16(a - b)
+                    self.flag_z = result == 0
+                    self.flag_c = u16(a) < u16(b)
+                    self.flag_n = result < 0
+                    regs[r] = result
+
+                elif op == OP_MUL:
+                    a = a if a_imm else regs[a]
+                    b = b if b_imm else regs[b]
+                    raw = a * b
+                    result = s16(raw)
+                    self.flag_z = result == 0
+                    self.flag_c = raw < -32768 or raw > 32767
+                    self.flag_n = result < 0
+                    regs[r] = result
+
+                elif op == OP_MOD:
+                    a = a if a_imm else regs[a]
+                    b = b if b_imm else regs[b]
+                    if b == 0:
+                        raise CosmoError("Division by zero in MOD")
+                    result = s16(a - b * int(a / b))
+                    self.flag_z = result == 0
+                    self.flag_c = False
+                    self.flag_n = result < 0
+                    regs[r] = result
+
+                elif op == OP_AND:
+                    a = a if a_imm else regs[a]
+                    b = b if b_imm else regs[b]
+                    result = s16(u16(a) & u16(b))
+                    self.flag_z = result == 0
+                    self.flag_n = result < 0
+                    regs[r] = result
+
+                elif op == OP_OR:
+                    a = a if a_imm else regs[a]
+                    b = b if b_imm else regs[b]
+                    result = s16(u16(a) | u16(b))
+                    self.flag_z = result == 0
+                    self.flag_n = result < 0
+                    regs[r] = result
+
+                elif op == OP_XOR:
+                    a = a if a_imm else regs[a]
+                    b = b if b_imm else regs[b]
+                    result = s16(u16(a) ^ u16(b))
+                    self.flag_z = result == 0
+                    self.flag_n = result < 0
+                    regs[r] = result
+
+                elif op == OP_NOT:
+                    val = a if a_imm else regs[a]
+                    result = s16(u16(val) ^ 0xFFFF)
+                    self.flag_z = result == 0
+                    self.flag_n = result < 0
+                    regs[r] = result
+
+                elif op == OP_SHL:
+                    val = u16(a if a_imm else regs[a])
+                    amt = b if b_imm else regs[b]
+                    if amt <= 0:
+                        carry = False
+                        raw = val
+                    elif amt > 16:
+                        carry = False
+                        raw = 0
+                    else:
+                        carry = bool(val & (1 << (16 - amt)))
+                        raw = (val << amt) & 0xFFFF
+                    result = s16(raw)
+                    self.flag_z = result == 0
+                    self.flag_c = carry
+                    self.flag_n = result < 0
+                    regs[r] = result
+
+                elif op == OP_SHR:
+                    val = u16(a if a_imm else regs[a])
+                    amt = b if b_imm else regs[b]
+                    if amt <= 0:
+                        carry = False
+                        raw = val
+                    elif amt > 16:
+                        carry = False
+                        raw = 0
+                    else:
+                        carry = bool(val & (1 << (amt - 1)))
+                        raw = val >> amt
+                    result = s16(raw)
+                    self.flag_z = result == 0
+                    self.flag_c = carry
+                    self.flag_n = result < 0
+                    regs[r] = result
+
+                elif op == OP_CMP:
+                    a = a if a_imm else regs[a]
+                    b = b if b_imm else regs[b]
+                    result = s16(a - b)
+                    self.flag_z = result == 0
+                    self.flag_c = u16(a) < u16(b)
+                    self.flag_n = result < 0
+
+                elif op == OP_LOAD:
+                    addr = a if a_imm else regs[a]
+                    self._check_mem(addr)
+                    regs[r] = memory[addr]
+
+                elif op == OP_STORE:
+                    addr = a if a_imm else regs[a]
+                    self._check_mem(addr)
+                    memory[addr] = regs[r]
+
+                elif op == OP_JMP:
+                    next_ip = a
+
+                elif op == OP_JZ:
+                    if self.flag_z and a != next_ip:
+                        next_ip = a
+                        cycles += taken_extra[op]
+
+                elif op == OP_JNZ:
+                    if not self.flag_z and a != next_ip:
+                        next_ip = a
+                        cycles += taken_extra[op]
+
+                elif op == OP_JN:
+                    if self.flag_n and a != next_ip:
+                        next_ip = a
+                        cycles += taken_extra[op]
+
+                elif op == OP_JC:
+                    if self.flag_c and a != next_ip:
+                        next_ip = a
+                        cycles += taken_extra[op]
+
+                elif op == OP_CALL:
+                    self._push(ip + 1)
+                    next_ip = a
+
+                elif op == OP_RET:
+                    next_ip = self._pop()
+
+                elif op == OP_PUSH:
+                    self._push(a if a_imm else regs[a])
+
+                elif op == OP_POP:
+                    regs[r] = self._pop()
+
+                elif op == OP_READ:
+                    regs[r] = self._read_input(a)
+
+                elif op == OP_WRITE:
+                    emit((a, regs[r]))
 
-    def run(self):
-        while self.ip < len(self.program):
-            if self.cycles >= self.CYCLE_LIMIT:
-                raise CosmoError(f"Cycle limit exceeded ({self.CYCLE_LIMIT})")
-
-            instr = self.program[self.ip]
-            op = instr[0]
-
-            self.cycles += 1
-            next_ip = self.ip + 1
-
-            if op == 'HLT':
-                return
-
-            elif op == 'NOP':
-                pass
-
-            elif op == 'MOV':
-                rd = self._reg_idx(instr[1])
-                val = self._resolve_src(instr[2])
-                val = self._update_flags_zn(val)
-                self.regs[rd] = val
-
-            elif op == 'ADD':
-                rd = self._reg_idx(instr[1])
-                a = self._resolve_src(instr[2])
-                b = self._resolve_src(instr[3])
-                raw = a + b
-                carry = (u16(a) + u16(b)) > 0xFFFF
-                result = self._update_flags_zcn(raw, carry)
-                self.regs[rd] = result
-
-            elif op == 'SUB':
-                rd = self._reg_idx(instr[1])
-                a = self._resolve_src(instr[2])
-                b = self._resolve_src(instr[3])
-                carry = u16(a) < u16(b)
-                raw = a - b
-                result = self._update_flags_zcn(raw, carry)
-                self.regs[rd] = result
-
-            elif op == 'MUL':
-                rd = self._reg_idx(instr[1])
-                a = self._resolve_src(instr[2])
-                b = self._resolve_src(instr[3])
-                raw = a * b
-                carry = (raw < -32768 or raw > 32767)
-                result = self._update_flags_zcn(raw, carry)
-                self.regs[rd] = result
-
-            elif op == 'MOD':
-                rd = self._reg_idx(instr[1])
-                a = self._resolve_src(instr[2])
-                b = self._resolve_src(instr[3])
-                if b == 0:
-                    raise CosmoError("Division by zero in MOD")
-                raw = a - b * int(a / b)
-                result = self._update_flags_zcn(raw, False)
-                self.regs[rd] = result
-
-            elif op == 'AND':
-                rd = self._reg_idx(instr[1])
-                a = self._resolve_src(instr[2])
-                b = self._resolve_src(instr[3])
-                raw = u16(a) & u16(b)
-                result = self._update_flags_zn(raw)
-                self.regs[rd] = result
-
-            elif op == 'OR':
-                rd = self._reg_idx(instr[1])
-                a = self._resolve_src(instr[2])
-                b = self._resolve_src(instr[3])
-                raw = u16(a) | u16(b)
-                result = self._update_flags_zn(raw)
-                self.regs[rd] = result
-
-            elif op == 'XOR':
-                rd = self._reg_idx(instr[1])
-                a = self._resolve_src(instr[2])
-                b = self._resolve_src(instr[3])
-                raw = u16(a) ^ u16(b)
-                result = self._update_flags_zn(raw)
-                self.regs[rd] = result
-
-            elif op == 'NOT':
-                rd = self._reg_idx(instr[1])
-                val = self._resolve_src(instr[2])
-                raw = u16(val) ^ 0xFFFF
-                result = self._update_flags_zn(raw)
-                self.regs[rd] = result
-
-            elif op == 'SHL':
-                rd = self._reg_idx(instr[1])
-                val = u16(self._resolve_src(instr[2]))
-                amt = self._resolve_src(instr[3])
-                if amt <= 0:
-                    carry = False
-                    raw = val
-                elif amt > 16:
-                    carry = False
-                    raw = 0
-                else:
-                    carry = bool(val & (1 << (16 - amt)))
-                    raw = (val << amt) & 0xFFFF
-                result = self._update_flags_zcn(raw, carry)
-                self.regs[rd] = result
-
-            elif op == 'SHR':
-                rd = self._reg_idx(instr[1])
-                val = u16(self._resolve_src(instr[2]))
-                amt = self._resolve_src(instr[3])
-                if amt <= 0:
-                    carry = False
-                    raw = val
-                elif amt > 16:
-                    carry = False
-                    raw = 0
-                else:
-                    carry = bool(val & (1 << (amt - 1)))
-                    raw = val >> amt
-                result = self._update_flags_zcn(raw, carry)
-                self.regs[rd] = result
-
-            elif op == 'CMP':
-                a = self._resolve_src(instr[1])
-                b = self._resolve_src(instr[2])
-                raw = a - b
-                carry = u16(a) < u16(b)
-                self._update_flags_zcn(raw, carry)
-
-            elif op == 'LOAD':
-                rd = self._reg_idx(instr[1])
-                operand = instr[2]
-                if operand.startswith('['):
-                    rs = self._reg_idx(operand[1:-1])
-                    addr = self.regs[rs]
-                else:
-                    addr = int(operand)
-                self._check_mem(addr)
-                self.regs[rd] = self.memory[addr]
-
-            elif op == 'STORE':
-                operand = instr[1]
-                rs = self._reg_idx(instr[2])
-                if operand.startswith('['):
-                    rd_reg = self._reg_idx(operand[1:-1])
-                    addr = self.regs[rd_reg]
                 else:
-                    addr = int(operand)
-                self._check_mem(addr)
-                self.memory[addr] = self.regs[rs]
+                    raise CosmoError(a)
 
-            elif op == 'JMP':
-                next_ip = int(instr[1])
+                ip = next_ip
+        finally:
+            self.ip = ip
+            self.cycles = cycles
 
-            elif op == 'JZ':
-                if self.flag_z:
-                    next_ip = int(instr[1])
+        raise CosmoError(f"Execution fell off end of program at IP={self.ip}")
 
-            elif op == 'JNZ':
-                if not self.flag_z:
-                    next_ip = int(instr[1])
 
-            elif op == 'JN':
-                if self.flag_n:
-                    next_ip = int(instr[1])
+# Closure-threaded engine: every instruction is prebound once per machine to a
+# zero-argument closure that executes it and returns the next IP.
+# Register-or-immediate sources are read as `sa[ia]`, where (sa, ia) is either
+# (regs, index) or ((imm,), 0), so handlers never branch on the operand kind.
 
-            elif op == 'JC':
-                if self.flag_c:
-                    next_ip = int(instr[1])
 
-            elif op == 'CALL':
-                self._push(self.ip + 1)
-                next_ip = int(instr[1])
+class _Halt(Exception):
+    pass
 
-            elif op == 'RET':
-                next_ip = self._pop()
 
-            elif op == 'PUSH':
-                val = self._resolve_src(instr[1])
-                self._push(val)
+class _Wait(Exception):
+    # Raised by READ when the input is empty but still open.
+    pass
 
-            elif op == 'POP':
-                rd = self._reg_idx(instr[1])
-                self.regs[rd] = self._pop()
 
-            elif op == 'READ':
-                rd = self._reg_idx(instr[1])
-                port = int(instr[2])
-                self.regs[rd] = self._read_input(port)
+class _Escape(Exception):
+    # Raised by a jump or RET whose target is negative; such IPs index the
+    # program from the end, which only the reference loop reproduces.
+    def __init__(self, ip):
+        self.ip = ip
+
+
+def _source(regs, value, imm):
+    if imm:
+        return (value,), 0
+    return regs, value
+
+
+def _t_hlt(m, ins, ip):
+    def hlt():
+        raise _Halt
+    return hlt
+
+
+def _t_nop(m, ins, ip):
+    nxt = ip + 1
+
+    def nop():
+        return nxt
+    return nop
+
+
+def _t_mov(m, ins, ip):
+    regs, r, nxt = m.regs, ins.r, ip + 1
+    sa, ia = _source(regs, ins.a, ins.a_imm)
+
+    def mov():
+        val = sa[ia]
+        m.flag_z = val == 0
+        m.flag_n = val < 0
+        regs[r] = val
+        return nxt
+    return mov
+
+
+def _t_add(m, ins, ip):
+    regs, r, nxt = m.regs, ins.r, ip + 1
+    sa, ia = _source(regs, ins.a, ins.a_imm)
+    sb, ib = _source(regs, ins.b, ins.b_imm)
+
+    def add():
+        x = sa[ia]
+        y = sb[ib]
+        result = ((x + y + 0x8000) & 0xFFFF) - 0x8000
+        m.flag_z = result == 0
+        m.flag_c = (x & 0xFFFF) + (y & 0xFFFF) > 0xFFFF
+        m.flag_n = result < 0
+        regs[r] = result
+        return nxt
+    return add
+
+
+def _t_sub(m, ins, ip):
+    regs, r, nxt = m.regs, ins.r, ip + 1
+    sa, ia = _source(regs, ins.a, ins.a_imm)
+    sb, ib = _source(regs, ins.b, ins.b_imm)
+
+    def sub():
+        x = sa[ia]
+        y = sb[ib]
+        result = ((x - y + 0x8000) & 0xFFFF) - 0x8000
+        m.flag_z = result == 0
+        m.flag_c = (x & 0xFFFF) < (y & 0xFFFF)
+        m.flag_n = result < 0
+        regs[r] = result
+        return nxt
+    return sub
+
+
+def _t_mul(m, ins, ip):
+    regs, r, nxt = m.regs, ins.r, ip + 1
+    sa, ia = _source(regs, ins.a, ins.a_imm)
+    sb, ib = _source(regs, ins.b, ins.b_imm)
+
+    def mul():
+        raw = sa[ia] * sb[ib]
+        result = ((raw + 0x8000) & 0xFFFF) - 0x8000
+        m.flag_z = result == 0
+        m.flag_c = raw != result
+        m.flag_n = result < 0
+        regs[r] = result
+        return nxt
+    return mul
+
+
+def _t_mod(m, ins, ip):
+    regs, r, nxt = m.regs, ins.r, ip + 1
+    sa, ia = _source(regs, ins.a, ins.a_imm)
+    sb, ib = _source(regs, ins.b, ins.b_imm)
+
+    def mod():
+        x = sa[ia]
+        y = sb[ib]
+        if y == 0:
+            raise CosmoError("Division by zero in MOD")
+        result = s16(x - y * int(x / y))
+        m.flag_z = result == 0
+        m.flag_c = False
+        m.flag_n = result < 0
+        regs[r] = result
+        return nxt
+    return mod
+
+
+def _t_and(m, ins, ip):
+    regs, r, nxt = m.regs, ins.r, ip + 1
+    sa, ia = _source(regs, ins.a, ins.a_imm)
+    sb, ib = _source(regs, ins.b, ins.b_imm)
+
+    def and_():
+        result = sa[ia] & sb[ib]
+        m.flag_z = result == 0
+        m.flag_n = result < 0
+        regs[r] = result
+        return nxt
+    return and_
+
+
+def _t_or(m, ins, ip):
+    regs, r, nxt = m.regs, ins.r, ip + 1
+    sa, ia = _source(regs, ins.a, ins.a_imm)
+    sb, ib = _source(regs, ins.b, ins.b_imm)
+
+    def or_():
+        result = sa[ia] | sb[ib]
+        m.flag_z = result == 0
+        m.flag_n = result < 0
+        regs[r] = result
+        return nxt
+    return or_
+
+
+def _t_xor(m, ins, ip):
+    regs, r, nxt = m.regs, ins.r, ip + 1
+    sa, ia = _source(regs, ins.a, ins.a_imm)
+    sb, ib = _source(regs, ins.b, ins.b_imm)
+
+    def xor():
+        result = sa[ia] ^ sb[ib]
+        m.flag_z = result == 0
+        m.flag_n = result < 0
+        regs[r] = result
+        return nxt
+    return xor
+
+
+def _t_not(m, ins, ip):
+    regs, r, nxt = m.regs, ins.r, ip + 1
+    sa, ia = _source(regs, ins.a, ins.a_imm)
+
+    def not_():
+        result = ~sa[ia]
+        m.flag_z = result == 0
+        m.flag_n = result < 0
+        regs[r] = result
+        return nxt
+    return not_
+
+
+def _t_shl(m, ins, ip):
+    regs, r, nxt = m.regs, ins.r, ip + 1
+    sa, ia = _source(regs, ins.a, ins.a_imm)
+    sb, ib = _source(regs, ins.b, ins.b_imm)
+
+    def shl():
+        val = sa[ia] & 0xFFFF
+        amt = sb[ib]
+        if amt <= 0:
+            carry = False
+            raw = val
+        elif amt > 16:
+            carry = False
+            raw = 0
+        else:
+            carry = bool(val & (1 << (16 - amt)))
+            raw = (val << amt) & 0xFFFF
+        result = ((raw + 0x8000) & 0xFFFF) - 0x8000
+        m.flag_z = result == 0
+        m.flag_c = carry
+        m.flag_n = result < 0
+        regs[r] = result
+        return nxt
+    return shl
+
+
+def _t_shr(m, ins, ip):
+    regs, r, nxt = m.regs, ins.r, ip + 1
+    sa, ia = _source(regs, ins.a, ins.a_imm)
+    sb, ib = _source(regs, ins.b, ins.b_imm)
+
+    def shr():
+        val = sa[ia] & 0xFFFF
+        amt = sb[ib]
+        if amt <= 0:
+            carry = False
+            raw = val
+        elif amt > 16:
+            carry = False
+            raw = 0
+        else:
+            carry = bool(val & (1 << (amt - 1)))
+            raw = val >> amt
+        result = ((raw + 0x8000) & 0xFFFF) - 0x8000
+        m.flag_z = result == 0
+        m.flag_c = carry
+        m.flag_n = result < 0
+        regs[r] = result
+        return nxt
+    return shr
+
+
+def _t_cmp(m, ins, ip):
+    regs, nxt = m.regs, ip + 1
+    sa, ia = _source(regs, ins.a, ins.a_imm)
+    sb, ib = _source(regs, ins.b, ins.b_imm)
+
+    def cmp():
+        x = sa[ia]
+        y = sb[ib]
+        result = ((x - y + 0x8000) & 0xFFFF) - 0x8000
+        m.flag_z = result == 0
+        m.flag_c = (x & 0xFFFF) < (y & 0xFFFF)
+        m.flag_n = result < 0
+        return nxt
+    return cmp
+
+
+def _t_load(m, ins, ip):
+    regs, memory, r, nxt = m.regs, m.memory, ins.r, ip + 1
+    size = m.MEM_SIZE
+    sa, ia = _source(regs, ins.a, ins.a_imm)
+
+    def load():
+        addr = sa[ia]
+        if addr < 0 or addr >= size:
+            raise CosmoError(f"Memory access out of bounds: address {addr}")
+        regs[r] = memory[addr]
+        return nxt
+    return load
 
-            elif op == 'WRITE':
-                port = int(instr[1])
-                rs = self._reg_idx(instr[2])
-                self.outputs.append((port, self.regs[rs]))
 
-            else:
-                raise CosmoError(f"Unknown instruction: {op}")
+def _t_store(m, ins, ip):
+    regs, memory, r, nxt = m.regs, m.memory, ins.r, ip + 1
+    size = m.MEM_SIZE
+    sa, ia = _source(regs, ins.a, ins.a_imm)
 
-            self.ip = next_ip
+    def store():
+        addr = sa[ia]
+        if addr < 0 or addr >= size:
+            raise CosmoError(f"Memory access out of bounds: address {addr}")
+        memory[addr] = regs[r]
+        return nxt
+    return store
 
-        raise CosmoError(f"Execution fell off end of program at IP={self.ip}")
+
+def _escape_to(target):
+    def escape():
+        raise _Escape(target)
+    return escape
+
+
+def _escape_if(cond, target, nxt):
+    def escape_if():
+        if cond():
+            raise _Escape(target)
+        return nxt
+    return escape_if
+
+
+def _t_jmp(m, ins, ip):
+    target = ins.a
+    if target < 0:
+        return _escape_to(target)
+
+    def jmp():
+        return target
+    return jmp
+
+
+def _t_jz(m, ins, ip):
+    target, nxt = ins.a, ip + 1
+    if target < 0:
+        return _escape_if(lambda: m.flag_z, target, nxt)
+
+    def jz():
+        return target if m.flag_z else nxt
+    return jz
+
+
+def _t_jnz(m, ins, ip):
+    target, nxt = ins.a, ip + 1
+    if target < 0:
+        return _escape_if(lambda: not m.flag_z, target, nxt)
+
+    def jnz():
+        return nxt if m.flag_z else target
+    return jnz
+
+
+def _t_jn(m, ins, ip):
+    target, nxt = ins.a, ip + 1
+    if target < 0:
+        return _escape_if(lambda: m.flag_n, target, nxt)
+
+    def jn():
+        return target if m.flag_n else nxt
+    return jn
+
+
+def _t_jc(m, ins, ip):
+    target, nxt = ins.a, ip + 1
+    if target < 0:
+        return _escape_if(lambda: m.flag_c, target, nxt)
+
+    def jc():
+        return target if m.flag_c else nxt
+    return jc
+
+
+def _t_call(m, ins, ip):
+    stack, depth = m.stack, m.STACK_DEPTH
+    target, ret = ins.a, ip + 1
+
+    def call():
+        sp = m.sp
+        if sp >= depth:
+            raise CosmoError(f"Stack overflow: SP={sp}")
+        stack[sp] = ret
+        m.sp = sp + 1
+        if target < 0:
+            raise _Escape(target)
+        return target
+    return call
+
+
+def _t_ret(m, ins, ip):
+    stack = m.stack
+
+    def ret():
+        sp = m.sp
+        if sp <= 0:
+            raise CosmoError(f"Stack underflow: SP={sp}")
+        sp -= 1
+        m.sp = sp
+        target = stack[sp]
+        if target < 0:
+            raise _Escape(target)
+        return target
+    return ret
+
+
+def _t_push(m, ins, ip):
+    stack, depth, nxt = m.stack, m.STACK_DEPTH, ip + 1
+    sa, ia = _source(m.regs, ins.a, ins.a_imm)
+
+    def push():
+        sp = m.sp
+        if sp >= depth:
+            raise CosmoError(f"Stack overflow: SP={sp}")
+        stack[sp] = sa[ia]
+        m.sp = sp + 1
+        return nxt
+    return push
+
+
+def _t_pop(m, ins, ip):
+    regs, stack, r, nxt = m.regs, m.stack, ins.r, ip + 1
+
+    def pop():
+        sp = m.sp
+        if sp <= 0:
+            raise CosmoError(f"Stack underflow: SP={sp}")
+        sp -= 1
+        m.sp = sp
+        regs[r] = stack[sp]
+        return nxt
+    return pop
+
+
+def _t_read(m, ins, ip):
+    regs, r, port, nxt = m.regs, ins.r, ins.a, ip + 1
+    read_input = m._read_input
+
+    def read():
+        regs[r] = read_input(port)
+        return nxt
+    return read
+
+
+def _t_write(m, ins, ip):
+    regs, r, port, nxt = m.regs, ins.r, ins.a, ip + 1
+    emit = m._emit
+
+    def write():
+        emit((port, regs[r]))
+        return nxt
+    return write
+
+
+def _t_bad(m, ins, ip):
+    message = ins.a
+
+    def bad():
+        raise CosmoError(message)
+    return bad
+
+
+THREADED_HANDLERS = {
+    OP_HLT: _t_hlt, OP_NOP: _t_nop, OP_MOV: _t_mov,
+    OP_ADD: _t_add, OP_SUB: _t_sub, OP_MUL: _t_mul, OP_MOD: _t_mod,
+    OP_AND: _t_and, OP_OR: _t_or, OP_XOR: _t_xor,
+    OP_NOT: _t_not, OP_SHL: _t_shl, OP_SHR: _t_shr, OP_CMP: _t_cmp,
+    OP_LOAD: _t_load, OP_STORE: _t_store,
+    OP_JMP: _t_jmp,
+    OP_JZ: _t_jz, OP_JNZ: _t_jnz, OP_JN: _t_jn, OP_JC: _t_jc,
+    OP_CALL: _t_call, OP_RET: _t_ret, OP_PUSH: _t_push, OP_POP: _t_pop,
+    OP_READ: _t_read, OP_WRITE: _t_write, OP_BAD: _t_bad,
+}
+
+
+class LoopDetector:
+    # Brent's cycle detection over whole-machine states. A state is sampled
+    # after every backward control transfer (every cycle in the IP sequence
+    # contains one) and compared with a saved state whose sampling interval
+    # doubles each time it is replaced. Memory is summarized by a hash that
+    # STOREs update incrementally, and compared in full only when everything
+    # else matches, so an equal state is never reported by accident.
+    _WEIGHTS = None
+
+    def __init__(self, machine):
+        if LoopDetector._WEIGHTS is None:
+            rng = random.Random(0x0C05A08)
+            LoopDetector._WEIGHTS = [rng.getrandbits(64) | 1 for _ in range(machine.MEM_SIZE)]
+        self.weights = LoopDetector._WEIGHTS
+        self.machine = machine
+        self.mem_hash = sum(w * (v & 0xFFFF) for w, v in zip(self.weights, machine.memory))
+        self.saved = None
+        self.saved_memory = None
+        self.power = 1
+        self.steps = 0
+
+    def store(self, addr, old, new):
+        self.mem_hash += self.weights[addr] * ((new & 0xFFFF) - (old & 0xFFFF))
+
+    def check(self, target):
+        m = self.machine
+        state = (target, tuple(m.regs), m.flag_z, m.flag_c, m.flag_n, m.sp,
+                 tuple(m.stack[:m.sp]), m.input_idx, self.mem_hash)
+        if state == self.saved and m.memory == self.saved_memory:
+            raise CosmoError(f"Infinite loop detected at IP={target}")
+        self.steps += 1
+        if self.steps >= self.power:
+            self.saved = state
+            self.saved_memory = list(m.memory)
+            self.power *= 2
+            self.steps = 0
+
+
+def _bind_loop_detection(m):
+    detector = LoopDetector(m)
+    check = detector.check
+    fns = []
+    for ip, ins in enumerate(m.code):
+        if ins.op == OP_STORE:
+            fns.append(_t_store_tracked(m, ins, ip, detector.store))
+            continue
+        fn = THREADED_HANDLERS[ins.op](m, ins, ip)
+        if ins.op in (OP_JMP, OP_JZ, OP_JNZ, OP_JN, OP_JC, OP_CALL, OP_RET):
+            fn = _backward_checked(fn, ip, check)
+        fns.append(fn)
+    return fns
+
+
+# Events a hook can observe, with the arguments the hook is called with.
+HOOK_EVENTS = {
+    'instruction': '(ip, instr) after an instruction has run',
+    'mem_read': '(address, value) for LOAD',
+    'mem_write': '(address, value) for STORE',
+    'push': '(value) for PUSH and the return address of CALL',
+    'pop': '(value) for POP and the return address of RET',
+    'input': '(port, value) for READ',
+    'output': '(port, value) for WRITE',
+    'fault': '(ip, error) when the program faults',
+}
+
+
+def _bind_hooks(m, fns):
+    # Wraps the handlers of the instructions that produce a hooked event.
+    hooks = m.hooks
+    regs, memory, stack = m.regs, m.memory, m.stack
+    bound = []
+    for ip, (fn, ins) in enumerate(zip(fns, m.code)):
+        op = ins.op
+        if op in (OP_LOAD, OP_STORE):
+            calls = hooks['mem_read' if op == OP_LOAD else 'mem_write']
+            if calls:
+                fn = _hook_memory(fn, memory, *_source(regs, ins.a, ins.a_imm), calls)
+        elif op in (OP_PUSH, OP_CALL) and hooks['push']:
+            fn = _hook_push(fn, m, stack, hooks['push'])
+        elif op in (OP_POP, OP_RET) and hooks['pop']:
+            fn = _hook_pop(fn, m, stack, hooks['pop'])
+        elif op in (OP_READ, OP_WRITE):
+            calls = hooks['input' if op == OP_READ else 'output']
+            if calls:
+                fn = _hook_io(fn, regs, ins.r, ins.a, calls)
+        bound.append(fn)
+    return bound
+
+
+def _hook_memory(fn, memory, sa, ia, calls):
+    def hooked():
+        addr = sa[ia]
+        nxt = fn()
+        for hook in calls:
+            hook(addr, memory[addr])
+        return nxt
+    return hooked
+
+
+def _hook_push(fn, m, stack, calls):
+    def hooked():
+        try:
+            nxt = fn()
+        except _Escape:
+            for hook in calls:
+                hook(stack[m.sp - 1])
+            raise
+        for hook in calls:
+            hook(stack[m.sp - 1])
+        return nxt
+    return hooked
+
+
+def _hook_pop(fn, m, stack, calls):
+    def hooked():
+        try:
+            nxt = fn()
+        except _Escape:
+            for hook in calls:
+                hook(stack[m.sp])
+            raise
+        for hook in calls:
+            hook(stack[m.sp])
+        return nxt
+    return hooked
+
+
+def _hook_io(fn, regs, r, port, calls):
+    def hooked():
+        nxt = fn()
+        for hook in calls:
+            hook(port, regs[r])
+        return nxt
+    return hooked
+
+
+def _backward_checked(fn, ip, check):
+    def checked():
+        target = fn()
+        if target <= ip:
+            check(target)
+        return target
+    return checked
+
+
+def _t_store_tracked(m, ins, ip, track):
+    regs, memory, r, nxt = m.regs, m.memory, ins.r, ip + 1
+    size = m.MEM_SIZE
+    sa, ia = _source(regs, ins.a, ins.a_imm)
+
+    def store():
+        addr = sa[ia]
+        if addr < 0 or addr >= size:
+            raise CosmoError(f"Memory access out of bounds: address {addr}")
+        track(addr, memory[addr], regs[r])
+        memory[addr] = regs[r]
+        return nxt
+    return store
 
 
 def parse(source):
+    instructions, instruction_count = PROGRAM_CACHE.get(source)[:2]
+    return [list(instr) for instr in instructions], instruction_count
+
+
+def load_program(source):
+    _, instruction_count, code = PROGRAM_CACHE.get(source)
+    return code, instruction_count
+
+
+def _parse_source(source):
     labels = {}
     instructions = []
     lines = source.strip('\n').split('\n')
@@ -322,24 +1435,437 @@ def parse(source):
     return instructions, instruction_count
 
 
-def run_program(source, inputs=None):
-    program, _ = parse(source)
-    machine = Cosmo8(program, inputs=inputs)
+def instruction_lines(source):
+    # Line number (0-based) of every instruction in `source`, by the same
+    # rules _parse_source uses to skip comments, labels and blank lines.
+    lines = []
+    for lineno, line in enumerate(source.split('\n')):
+        stripped = line.split(';')[0].split('#')[0].strip()
+        if stripped and not stripped.endswith(':'):
+            lines.append(lineno)
+    return lines
+
+
+def label_addresses(source):
+    # {label: address} for the labels in `source`, as _parse_source resolves them.
+    labels = {}
+    address = 0
+    for line in source.split('\n'):
+        stripped = line.split(';')[0].split('#')[0].strip()
+        if stripped.endswith(':'):
+            labels[stripped[:-1]] = address
+        elif stripped:
+            address += 1
+    return labels
+
+
+# Operand layout per opcode: 'r' register operand, 's' register-or-immediate
+# source, 'm' memory address ([Rn] or literal), 't' jump target, 'p' port.
+OPERAND_FORMS = {
+    OP_HLT: '', OP_NOP: '', OP_RET: '',
+    OP_MOV: 'rs', OP_NOT: 'rs',
+    OP_ADD: 'rss', OP_SUB: 'rss', OP_MUL: 'rss', OP_MOD: 'rss',
+    OP_AND: 'rss', OP_OR: 'rss', OP_XOR: 'rss', OP_SHL: 'rss', OP_SHR: 'rss',
+    OP_CMP: 'ss',
+    OP_LOAD: 'rm', OP_STORE: 'mr',
+    OP_JMP: 't', OP_JZ: 't', OP_JNZ: 't', OP_JN: 't', OP_JC: 't', OP_CALL: 't',
+    OP_PUSH: 's', OP_POP: 'r',
+    OP_READ: 'rp', OP_WRITE: 'pr',
+}
+
+
+def _decode_reg(token):
+    idx = int(token.upper()[1:])
+    if not -Cosmo8.NUM_REGS <= idx < Cosmo8.NUM_REGS:
+        raise ValueError(f"bad register {token}")
+    return idx % Cosmo8.NUM_REGS
+
+
+def _decode_operand(kind, token):
+    if kind == 's':
+        if token.upper().startswith('R'):
+            return _decode_reg(token), False
+        return s16(int(token)), True
+    if kind == 'm' and token.startswith('['):
+        return _decode_reg(token[1:-1]), False
+    return int(token), True
+
+
+@functools.lru_cache(maxsize=4096)
+def _decode_tokens(instr):
+    op = OPCODE_INDEX.get(instr[0])
+    if op is None:
+        return Instr(OP_BAD, 0, f"Unknown instruction: {instr[0]}", True, 0, True)
+
+    form = OPERAND_FORMS[op]
+    r = 0
+    sources = []
+    try:
+        if len(instr) - 1 < len(form):
+            raise IndexError("missing operand")
+        for kind, token in zip(form, instr[1:]):
+            if kind == 'r':
+                r = _decode_reg(token)
+            else:
+                sources.append(_decode_operand(kind, token))
+    except (ValueError, IndexError):
+        return Instr(OP_BAD, 0, f"Malformed instruction: {' '.join(instr)}", True, 0, True)
+
+    sources += [(0, True)] * (2 - len(sources))
+    (a, a_imm), (b, b_imm) = sources
+    return Instr(op, r, a, a_imm, b, b_imm)
+
+
+def decode_instr(instr):
+    if isinstance(instr, Instr):
+        return instr
+    return _decode_tokens(tuple(instr))
+
+
+def decode(program):
+    return tuple(decode_instr(instr) for instr in program)
+
+
+def format_instr(ins, labels=None):
+    # Inverse of decode_instr: assembly text for a decoded instruction, with
+    # jump targets named from `labels` ({address: name}) where present.
+    if ins.op == OP_BAD:
+        raise ValueError(f"cannot format undecodable instruction: {ins.a}")
+    labels = labels or {}
+    sources = iter(((ins.a, ins.a_imm), (ins.b, ins.b_imm)))
+    parts = []
+    for kind in OPERAND_FORMS[ins.op]:
+        if kind == 'r':
+            parts.append(f"R{ins.r}")
+            continue
+        value, imm = next(sources)
+        if kind == 't':
+            parts.append(labels.get(value, str(value)))
+        elif imm:
+            parts.append(str(value))
+        elif kind == 'm':
+            parts.append(f"[R{value}]")
+        else:
+            parts.append(f"R{value}")
+    return ' '.join([OPCODES[ins.op], ', '.join(parts)]).rstrip()
+
+
+def disassemble(code):
+    # Source text for decoded code, one instruction per line, with a label
+    # (L0, L1, ...) at every address that a jump or CALL targets.
+    targets = sorted({ins.a for ins in code
+                      if OPERAND_FORMS.get(ins.op) == 't' and 0 <= ins.a <= len(code)})
+    labels = {addr: f"L{i}" for i, addr in enumerate(targets)}
+    lines = []
+    for ip, ins in enumerate(code):
+        if ip in labels:
+            lines.append(f"{labels[ip]}:")
+        lines.append(format_instr(ins, labels))
+    if len(code) in labels:
+        lines.append(f"{labels[len(code)]}:")
+    return '\n'.join(lines) + '\n'
+
+
+class ProgramCache:
+    # LRU cache of assembled programs keyed by the SHA-256 of their source.
+    # Entries are (instructions, instruction_count, code) with every level
+    # made of tuples, so nothing handed out can alter a cached program.
+    # With a cache_dir, entries are also written to disk with marshal so later
+    # processes can skip parsing unchanged sources.
+    VERSION = 1
+
+    def __init__(self, maxsize=256, cache_dir=None):
+        self.maxsize = maxsize
+        self.cache_dir = cache_dir
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def stats(self):
+        return {
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "size": len(self.entries),
+            "maxsize": self.maxsize,
+        }
+
+    def clear(self):
+        self.entries.clear()
+        self.hits = self.disk_hits = self.misses = 0
+
+    def get(self, source):
+        key = hashlib.sha256(source.encode()).hexdigest()
+        entry = self.entries.get(key)
+        if entry is not None:
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+        entry = self._load(key)
+        if entry is not None:
+            self.disk_hits += 1
+        else:
+            self.misses += 1
+            instructions, instruction_count = _parse_source(source)
+            instructions = tuple(tuple(instr) for instr in instructions)
+            entry = (instructions, instruction_count, decode(instructions))
+            self._store(key, entry)
+
+        self.entries[key] = entry
+        if len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+        return entry
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.c8p")
+
+    def _load(self, key):
+        if not self.cache_dir:
+            return None
+        try:
+            with open(self._path(key), 'rb') as f:
+                version, instructions, instruction_count, code = marshal.load(f)
+        except (OSError, EOFError, ValueError, TypeError):
+            return None
+        if version != self.VERSION:
+            return None
+        return instructions, instruction_count, tuple(Instr(*ins) for ins in code)
+
+    def _store(self, key, entry):
+        if not self.cache_dir:
+            return
+        instructions, instruction_count, code = entry
+        data = marshal.dumps((self.VERSION, instructions, instruction_count,
+                              tuple(tuple(ins) for ins in code)))
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            tmp = f"{self._path(key)}.{os.getpid()}.tmp"
+            with open(tmp, 'wb') as f:
+                f.write(data)
+            os.replace(tmp, self._path(key))
+        except OSError:
+            pass
+
+
+PROGRAM_CACHE = ProgramCache(cache_dir=os.environ.get('COSMO8_CACHE_DIR') or None)
+
+
+def configure_cache(cache_dir=None, maxsize=None):
+    PROGRAM_CACHE.cache_dir = cache_dir
+    if maxsize is not None:
+        PROGRAM_CACHE.maxsize = maxsize
+
+
+# Assembled binary programs (.c8b): a header, then one fixed-width record per
+# decoded instruction, then the optional line and symbol tables.
+#   header   magic, instruction count, message count, symbol count, line table flag
+#   records  Instr fields (op, r, a, a_imm, b, b_imm); the `a` of an undecodable
+#            instruction indexes the message table
+#   lines    source line (0-based) of every instruction, if present
+#   strings  messages, then symbols as (address, name); each string is a
+#            length-prefixed UTF-8 run
+# Loading is struct unpacking only; the records map straight onto Instr.
+IMAGE_MAGIC = b'C8B1'
+IMAGE_HEADER = struct.Struct('<4sHHHH')
+IMAGE_INSTR = struct.Struct('<BBi?h?')
+IMAGE_STRING = struct.Struct('<H')
+IMAGE_SYMBOL = struct.Struct('<HH')
+
+Image = namedtuple('Image', 'code labels lines')
+
+
+def assemble(source, symbols=True):
+    # The .c8b encoding of `source`; symbols=False leaves out the label and
+    # line tables.
+    code, _ = load_program(source)
+    messages = []
+    records = []
+    for ins in code:
+        if ins.op == OP_BAD:
+            messages.append(ins.a)
+            ins = ins._replace(a=len(messages) - 1)
+        try:
+            records.append(IMAGE_INSTR.pack(*ins))
+        except struct.error:
+            raise CosmoError(f"Operand out of range for a binary program: "
+                             f"{format_instr(ins)}")
+    labels = label_addresses(source) if symbols else {}
+    lines = array('H', instruction_lines(source) if symbols else [])
+    if sys.byteorder != 'little':
+        lines.byteswap()
+    strings = [IMAGE_STRING.pack(len(text)) + text
+               for text in (message.encode() for message in messages)]
+    for name, address in labels.items():
+        name = name.encode()
+        strings.append(IMAGE_SYMBOL.pack(address, len(name)) + name)
+    header = IMAGE_HEADER.pack(IMAGE_MAGIC, len(code), len(messages), len(labels),
+                               int(symbols))
+    return b''.join([header, *records, lines.tobytes(), *strings])
+
+
+def load_image(data):
+    # Inverse of assemble(). Accepts any bytes-like object.
+    try:
+        return _load_image(memoryview(data))
+    except struct.error:
+        raise ValueError("truncated Cosmo-8 binary program")
+
+
+def _load_image(view):
+    magic, count, n_messages, n_symbols, has_lines = IMAGE_HEADER.unpack_from(view)
+    if magic != IMAGE_MAGIC:
+        raise ValueError("not a Cosmo-8 binary program")
+    pos = IMAGE_HEADER.size
+    end = pos + count * IMAGE_INSTR.size
+    code = tuple(map(Instr._make, IMAGE_INSTR.iter_unpack(view[pos:end])))
+    pos = end
+    lines = ()
+    if has_lines:
+        lines = array('H')
+        lines.frombytes(view[pos:pos + 2 * count])
+        if sys.byteorder != 'little':
+            lines.byteswap()
+        pos += 2 * count
+        lines = tuple(lines)
+
+    messages = []
+    for _ in range(n_messages):
+        size, = IMAGE_STRING.unpack_from(view, pos)
+        pos += IMAGE_STRING.size
+        messages.append(str(view[pos:pos + size], 'utf-8'))
+        pos += size
+    if messages:
+        code = tuple(ins._replace(a=messages[ins.a]) if ins.op == OP_BAD else ins
+                     for ins in code)
+    labels = {}
+    for _ in range(n_symbols):
+        address, size = IMAGE_SYMBOL.unpack_from(view, pos)
+        pos += IMAGE_SYMBOL.size
+        labels[str(view[pos:pos + size], 'utf-8')] = address
+        pos += size
+    if len(code) != count or len(lines) not in (0, count) or pos != len(view):
+        raise ValueError("truncated Cosmo-8 binary program")
+    return Image(code, labels, lines)
+
+
+def run_program(source, inputs=None, engine=None, detect_loops=False, costs=None):
+    program, _ = load_program(source)
+    machine = Cosmo8(program, inputs=inputs, engine=engine, detect_loops=detect_loops,
+                     costs=costs)
     machine.run()
     return [val for _, val in machine.outputs]
 
 
-def main():
-    parser = argparse.ArgumentParser(description='Cosmo-8 Simulator')
+STREAM_SLICE = 10_000
+
+
+def stream_program(source, inputs=None, engine=None, detect_loops=False, costs=None):
+    # Like run_program, but a generator: output values are yielded as the
+    # program writes them, at most STREAM_SLICE cycles after each WRITE.
+    program, _ = load_program(source)
+    pending = []
+    machine = Cosmo8(program, inputs=inputs, engine=engine, detect_loops=detect_loops,
+                     output=pending.append, costs=costs)
+    while True:
+        status = machine.run_for(STREAM_SLICE)
+        for _, val in pending:
+            yield val
+        pending.clear()
+        if status == FAULTED:
+            raise machine.error
+        if status != RUNNING:
+            return
+
+
+def _stdin_values(out):
+    # Reads whitespace/comma separated integers from stdin one line at a time,
+    # flushing `out` first so a program that waits for input has shown its
+    # output so far.
+    while True:
+        out.flush()
+        line = sys.stdin.readline()
+        if not line:
+            return
+        for x in re.split(r'[,\s]+', line):
+            if x:
+                yield int(x)
+
+
+def assemble_main(argv):
+    parser = argparse.ArgumentParser(prog='sim.py assemble',
+                                     description='Assemble a Cosmo-8 program to a .c8b binary')
     parser.add_argument('program', help='Path to assembly source file')
-    parser.add_argument('--input', type=str, default=None, help='Comma-separated input values')
-    args = parser.parse_args()
+    parser.add_argument('-o', '--output', type=str, default=None,
+                        help='Output path (default: the source path with a .c8b extension)')
+    parser.add_argument('--strip', action='store_true',
+                        help='Leave out the label and source-line tables')
+    args = parser.parse_args(argv)
 
     with open(args.program) as f:
         source = f.read()
+    try:
+        data = assemble(source, symbols=not args.strip)
+    except CosmoError as e:
+        print(f"Assembly error: {e}", file=sys.stderr)
+        sys.exit(1)
+    output = args.output or os.path.splitext(args.program)[0] + '.c8b'
+    with open(output, 'wb') as f:
+        f.write(data)
+    print(f"{output}: {len(load_image(data).code)} instructions, {len(data)} bytes",
+          file=sys.stderr)
+
+
+def main():
+    if sys.argv[1:2] == ['assemble']:
+        return assemble_main(sys.argv[2:])
+    if sys.argv[1:2] == ['optimize']:
+        from optimize import optimize_main
+        return optimize_main(sys.argv[2:])
+
+    parser = argparse.ArgumentParser(description='Cosmo-8 Simulator',
+                                     epilog="'sim.py assemble PROGRAM' writes a .c8b binary and "
+                                            "'sim.py optimize PROGRAM' removes redundant "
+                                            "instructions; see their --help")
+    parser.add_argument('program', help='Path to assembly source file or .c8b binary')
+    parser.add_argument('--input', type=str, default=None, help='Comma-separated input values')
+    parser.add_argument('--engine', choices=ENGINES, default=Cosmo8.ENGINE, help='Execution engine')
+    parser.add_argument('--detect-loops', action='store_true',
+                        help='Fail as soon as the machine state repeats')
+    parser.add_argument('--stream', action='store_true',
+                        help='Read stdin lazily and print each output as it is written')
+    parser.add_argument('--costs', type=str, default=None,
+                        help=f"Cycle cost model: a preset ({', '.join(COST_MODELS)}) and/or "
+                             "OP=cycles overrides, e.g. 'hardware,MUL=4'")
+    parser.add_argument('--profile', action='store_true',
+                        help='Print per-instruction hit counts, branch ratios and hot loops')
+    parser.add_argument('--debug', action='store_true',
+                        help='Run under the interactive time-travel debugger (inputs from --input)')
+    args = parser.parse_args()
+    if args.debug and args.stream:
+        parser.error('--debug cannot be combined with --stream')
+
+    with open(args.program, 'rb') as f:
+        data = f.read()
+    image = source = None
+    if data.startswith(IMAGE_MAGIC):
+        if args.profile:
+            parser.error('--profile needs the assembly source, not a binary')
+        try:
+            image = load_image(data)
+        except ValueError as e:
+            parser.error(f"{args.program}: {e}")
+    else:
+        with open(args.program) as f:
+            source = f.read()
 
     if args.input is not None:
         inputs = [int(x.strip()) for x in args.input.split(',') if x.strip()]
+    elif args.stream:
+        inputs = _stdin_values(sys.stdout)
+    elif args.debug:
+        inputs = []
     else:
         try:
             if not sys.stdin.isatty():
@@ -353,21 +1879,57 @@ def main():
         except Exception:
             inputs = []
 
-    program, instruction_count = parse(source)
-    machine = Cosmo8(program, inputs=inputs)
+    output = None
+    if args.stream:
+        write = sys.stdout.write
+        output = lambda item: write(f"{item[1]}\n")
+
+    if image:
+        program, instruction_count = image.code, len(image.code)
+    else:
+        program, instruction_count = parse(source)
+    try:
+        machine = Cosmo8(program, inputs=inputs, engine=args.engine,
+                         detect_loops=args.detect_loops, output=output, costs=args.costs)
+    except ValueError as e:
+        parser.error(str(e))
+
+    if args.debug:
+        from debugger import debug
+        if image:
+            debug(machine, None, labels=image.labels, where=image.lines)
+        else:
+            debug(machine, source)
+        return
+
+    profiler = None
+    if args.profile:
+        from profiler import Profiler
+        profiler = Profiler(machine)
 
     try:
-        machine.run()
+        if profiler:
+            profiler.run()
+        else:
+            machine.run()
     except CosmoError as e:
+        sys.stdout.flush()
         print(f"Runtime error: {e}", file=sys.stderr)
+        if profiler:
+            profiler.report(source)
         sys.exit(1)
 
     for port, value in machine.outputs:
         print(value)
+    sys.stdout.flush()
 
     print(f"--- Stats ---", file=sys.stderr)
     print(f"Instruction count: {instruction_count}", file=sys.stderr)
     print(f"Cycles used: {machine.cycles}", file=sys.stderr)
+    if args.costs:
+        print(f"Cost model: {args.costs}", file=sys.stderr)
+    if profiler:
+        profiler.report(source)
 
 
 if __name__ == '__main__':
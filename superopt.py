@@ -0,0 +1,535 @@
+import sys
+import os
+import argparse
+import random
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from sim import (
+    Cosmo8, CosmoError, Instr, OPCODES, OPERAND_FORMS, CONDITIONAL_JUMPS, load_program,
+    disassemble,
+    OP_HLT, OP_NOP, OP_MOV, OP_ADD, OP_SUB, OP_MUL, OP_MOD, OP_AND, OP_OR,
+    OP_XOR, OP_NOT, OP_SHL, OP_SHR, OP_CMP, OP_LOAD, OP_STORE, OP_JMP, OP_CALL,
+    OP_RET, OP_WRITE, OP_BAD,
+)
+import jit
+from challenge import CHALLENGES, SOLUTION_FILENAMES, SOLUTION_DIRS, get_tier
+from oracles import SPECS
+
+# Enumerative superoptimizer. Starting from a seed solution (by default the
+# shortest passing one in the shipped solution sets), it repeatedly tries
+# shorter neighbours: deleting one instruction, then replacing every window of
+# two or three instructions with one, then three with two. Replacement
+# instructions are drawn from the registers, constants and ports the program
+# already uses plus one fresh register (any unused register is equivalent, so
+# only the lowest is tried), and an instruction whose result is dead (no later
+# read of its register or flags) is never generated. Each candidate runs first
+# on the seed's cheapest tests as probes, then on the rest, then against the
+# seed itself on random valid inputs (oracles.SPECS) so that it cannot win by
+# overfitting the tests.
+# The first candidate that passes becomes the new program and the search
+# restarts from it. Without a seed, programs up to --max-length instructions
+# are enumerated from scratch, with registers numbered in order of first use.
+
+NUM_REGS = Cosmo8.NUM_REGS
+# Liveness bitmasks hold the registers in the low bits and the flags above
+# them, using the JIT's flag tables. Nothing is read at a halt here: only the
+# outputs written so far matter.
+FLAG_DEFS = {op: flags << NUM_REGS for op, flags in jit.FLAG_DEFS.items()}
+FLAG_USES = {op: flags << NUM_REGS for op, flags in jit.FLAG_USES.items() if op != OP_HLT}
+REG_MASK = (1 << NUM_REGS) - 1
+
+# Instructions whose only effect is their register and flags; they are dead
+# when neither is read afterwards.
+PURE = (OP_MOV, OP_ADD, OP_SUB, OP_MUL, OP_MOD, OP_AND, OP_OR, OP_XOR, OP_NOT,
+        OP_SHL, OP_SHR, OP_CMP, OP_LOAD)
+COMMUTATIVE = (OP_ADD, OP_MUL, OP_AND, OP_OR, OP_XOR)
+SEARCH_OPS = [op for op in range(len(OPCODES)) if op != OP_NOP]
+
+NOP = Instr(OP_NOP, 0, 0, True, 0, True)
+HLT = Instr(OP_HLT, 0, 0, True, 0, True)
+
+PROBES = 2
+SCRATCH_CYCLE_LIMIT = 200
+PROGRESS_INTERVAL = 2.0
+
+
+def _reads_writes(ins):
+    # Registers and flags an instruction reads and writes, as bitmasks.
+    form = OPERAND_FORMS[ins.op]
+    sources = iter(((ins.a, ins.a_imm), (ins.b, ins.b_imm)))
+    reads = FLAG_USES.get(ins.op, 0)
+    writes = FLAG_DEFS.get(ins.op, 0)
+    for kind in form:
+        if kind == 'r':
+            continue
+        value, imm = next(sources)
+        if kind in 'sm' and not imm:
+            reads |= 1 << value
+    if 'r' in form:
+        if ins.op in (OP_STORE, OP_WRITE):
+            reads |= 1 << ins.r
+        else:
+            writes |= 1 << ins.r
+    return reads, writes
+
+
+def _successors(code, ip, return_sites):
+    ins = code[ip]
+    if ins.op in (OP_HLT, OP_BAD):
+        targets = ()
+    elif ins.op in (OP_JMP, OP_CALL):
+        targets = (ins.a,)
+    elif ins.op in CONDITIONAL_JUMPS:
+        targets = (ins.a, ip + 1)
+    elif ins.op == OP_RET:
+        targets = return_sites
+    else:
+        targets = (ip + 1,)
+    return [t for t in targets if 0 <= t < len(code)]
+
+
+def liveness(code):
+    # Registers and flags live after each instruction.
+    n = len(code)
+    return_sites = tuple(ip + 1 for ip, ins in enumerate(code) if ins.op == OP_CALL)
+    succs = [_successors(code, ip, return_sites) for ip in range(n)]
+    effects = [_reads_writes(ins) for ins in code]
+    live_in = [0] * n
+    live_out = [0] * n
+    changed = True
+    while changed:
+        changed = False
+        for ip in range(n - 1, -1, -1):
+            out = 0
+            for succ in succs[ip]:
+                out |= live_in[succ]
+            live_out[ip] = out
+            reads, writes = effects[ip]
+            live = reads | (out & ~writes)
+            if live != live_in[ip]:
+                live_in[ip] = live
+                changed = True
+    return live_out
+
+
+def is_dead(ins, live_after):
+    if ins.op not in PURE:
+        return False
+    _, writes = _reads_writes(ins)
+    return not writes & live_after
+
+
+def splice(code, start, length, new):
+    # Replaces code[start:start + length] with `new`, moving jump targets in
+    # the kept code: targets inside the window go to its start, targets past
+    # it shift with the change in length.
+    shift = len(new) - length
+    out = []
+    for ins in code[:start] + code[start + length:]:
+        if OPERAND_FORMS[ins.op] == 't':
+            target = ins.a
+            if start <= target < start + length:
+                target = start
+            elif target >= start + length:
+                target += shift
+            ins = ins._replace(a=target)
+        out.append(ins)
+    out[start:start] = new
+    return tuple(out)
+
+
+def operands(code):
+    # Registers, constants, memory literals and ports that `code` mentions.
+    regs, consts, addrs, ports = set(), set(), set(), set()
+    for ins in code:
+        sources = iter(((ins.a, ins.a_imm), (ins.b, ins.b_imm)))
+        for kind in OPERAND_FORMS.get(ins.op, ''):
+            if kind == 'r':
+                regs.add(ins.r)
+                continue
+            value, imm = next(sources)
+            if kind == 'p':
+                ports.add(value)
+            elif kind in 'sm' and not imm:
+                regs.add(value)
+            elif kind == 's':
+                consts.add(value)
+            elif kind == 'm':
+                addrs.add(value)
+    return regs, consts, addrs, ports
+
+
+def fresh_register(regs):
+    # Any register a program leaves untouched is interchangeable with any
+    # other, so only the lowest one is ever tried.
+    for r in range(NUM_REGS):
+        if r not in regs:
+            return r
+    return NUM_REGS
+
+
+class Vocabulary:
+    # Operand choices for generated instructions.
+    def __init__(self, regs, consts, addrs, ports, targets):
+        self.regs = sorted(regs)
+        self.consts = sorted(consts)
+        self.addrs = sorted(addrs)
+        self.ports = sorted(ports)
+        self.targets = sorted(targets)
+
+    @classmethod
+    def of(cls, code, regs_from=None):
+        # Operands of `code`, plus the lowest register that `regs_from`
+        # (default: `code`) does not use. Registers are taken from `regs_from`.
+        regs, consts, addrs, ports = operands(code)
+        if regs_from is not None:
+            regs = operands(regs_from)[0]
+        regs.add(fresh_register(regs))
+        addrs |= {c for c in consts if 0 <= c < Cosmo8.MEM_SIZE}
+        return cls(regs & set(range(NUM_REGS)), consts | {0, 1, -1}, addrs, ports or {0}, ())
+
+    def with_targets(self, targets):
+        return Vocabulary(self.regs, self.consts, self.addrs, self.ports, targets)
+
+    def instructions(self, ops=SEARCH_OPS):
+        regs = self.regs
+        sources = [(r, False) for r in regs] + [(c, True) for c in self.consts]
+        memory = [(r, False) for r in regs] + [(a, True) for a in self.addrs]
+        for op in ops:
+            form = OPERAND_FORMS[op]
+            if form == '':
+                yield Instr(op, 0, 0, True, 0, True)
+            elif form == 'rs':
+                for r in regs:
+                    for a, a_imm in sources:
+                        yield Instr(op, r, a, a_imm, 0, True)
+            elif form == 'rss':
+                for r in regs:
+                    for i, (a, a_imm) in enumerate(sources):
+                        for j, (b, b_imm) in enumerate(sources):
+                            if a_imm and b_imm:
+                                continue
+                            if op in COMMUTATIVE and j < i:
+                                continue
+                            yield Instr(op, r, a, a_imm, b, b_imm)
+            elif form == 'ss':
+                for a, a_imm in sources:
+                    for b, b_imm in sources:
+                        if not (a_imm and b_imm):
+                            yield Instr(op, 0, a, a_imm, b, b_imm)
+            elif form == 'rm':
+                for r in regs:
+                    for a, a_imm in memory:
+                        yield Instr(op, r, a, a_imm, 0, True)
+            elif form == 'mr':
+                for a, a_imm in memory:
+                    for r in regs:
+                        yield Instr(op, r, a, a_imm, 0, True)
+            elif form == 't':
+                for target in self.targets:
+                    yield Instr(op, 0, target, True, 0, True)
+            elif form == 's':
+                for a, a_imm in sources:
+                    yield Instr(op, 0, a, a_imm, 0, True)
+            elif form == 'r':
+                for r in regs:
+                    yield Instr(op, r, 0, True, 0, True)
+            elif form == 'rp':
+                for r in regs:
+                    for port in self.ports:
+                        yield Instr(op, r, port, True, 0, True)
+            elif form == 'pr':
+                for port in self.ports:
+                    for r in regs:
+                        yield Instr(op, r, port, True, 0, True)
+
+
+class Evaluator:
+    def __init__(self, challenge, seed_code, validate=20, rng=None):
+        rng = rng or random.Random(0)
+        tests = challenge["tests"]
+        self.machine = Cosmo8((), engine='loop')
+        self.cases = [(test["input"], test["expected"]) for test in tests]
+        self.limit = SCRATCH_CYCLE_LIMIT
+        if seed_code:
+            # Cheapest tests first, so the probes reject most candidates
+            # quickly; a candidate may take up to four times the seed's worst.
+            seed_cycles = [self._run(seed_code, inputs, Cosmo8.CYCLE_LIMIT)[1]
+                           for inputs, _ in self.cases]
+            order = sorted(range(len(tests)), key=seed_cycles.__getitem__)
+            self.cases = [self.cases[i] for i in order]
+            self.limit = max(SCRATCH_CYCLE_LIMIT, 4 * max(seed_cycles, default=0))
+
+        self.validation = []
+        spec = SPECS[challenge["number"]]
+        for _ in range(validate if seed_code else 0):
+            inputs = spec.generate(rng)
+            outputs, cycles = self._run(seed_code, inputs, Cosmo8.CYCLE_LIMIT)
+            if outputs is not None:
+                self.validation.append((inputs, outputs))
+                # Valid inputs may be larger than any test's.
+                self.limit = max(self.limit, 4 * cycles)
+
+        self.candidates = 0
+        self.probe_failures = 0
+        self.test_failures = 0
+        self.validation_failures = 0
+
+    def _run(self, code, inputs, limit):
+        # One machine serves every run; reset() swaps in the program and input.
+        machine = self.machine
+        machine.reset(inputs, code)
+        machine.CYCLE_LIMIT = limit
+        try:
+            machine.run()
+        except CosmoError:
+            return None, machine.cycles
+        return [val for _, val in machine.outputs], machine.cycles
+
+    def check(self, code):
+        self.candidates += 1
+        if not any(ins.op == OP_HLT for ins in code):
+            self.probe_failures += 1
+            return False
+        for i, (inputs, expected) in enumerate(self.cases):
+            if self._run(code, inputs, self.limit)[0] != expected:
+                if i < PROBES:
+                    self.probe_failures += 1
+                else:
+                    self.test_failures += 1
+                return False
+        for inputs, expected in self.validation:
+            if self._run(code, inputs, self.limit)[0] != expected:
+                self.validation_failures += 1
+                return False
+        return True
+
+
+class Budget(Exception):
+    pass
+
+
+class Superoptimizer:
+    def __init__(self, challenge, seed_code=None, time_limit=60.0, max_candidates=None,
+                 validate=20, max_length=4, rng=None, log=sys.stderr):
+        self.challenge = challenge
+        self.seed_code = tuple(seed_code) if seed_code else None
+        self.evaluator = Evaluator(challenge, self.seed_code, validate, rng)
+        self.time_limit = time_limit
+        self.max_candidates = max_candidates
+        self.max_length = max_length
+        self.log = log
+        self.pruned = 0
+        self.start = self.last_report = time.perf_counter()
+
+    def _tick(self):
+        now = time.perf_counter()
+        if self.time_limit is not None and now - self.start >= self.time_limit:
+            raise Budget
+        if self.max_candidates is not None and self.evaluator.candidates >= self.max_candidates:
+            raise Budget
+        if self.log and now - self.last_report >= PROGRESS_INTERVAL:
+            self.last_report = now
+            self.report()
+
+    def report(self, best=None):
+        ev = self.evaluator
+        elapsed = time.perf_counter() - self.start
+        rate = ev.candidates / elapsed if elapsed else 0.0
+        line = (f"[{elapsed:7.1f}s] {ev.candidates} candidates ({rate:.0f}/s), "
+                f"{self.pruned} pruned, {ev.probe_failures} failed probes, "
+                f"{ev.test_failures} failed tests, {ev.validation_failures} failed validation")
+        if best is not None:
+            line += f", best {len(best)} instructions"
+        print(line, file=self.log)
+
+    def _try(self, code):
+        self._tick()
+        return self.evaluator.check(code)
+
+    def run(self):
+        best = self.seed_code
+        try:
+            if best is None:
+                best = self._from_scratch()
+                if best is None:
+                    return None
+            while True:
+                for candidate in self.neighbours(best):
+                    if self._try(candidate):
+                        best = candidate
+                        if self.log:
+                            print(f"found {len(best)} instructions", file=self.log)
+                        break
+                else:
+                    return best
+        except Budget:
+            return best
+        finally:
+            if self.log:
+                self.report(best)
+
+    def neighbours(self, code):
+        n = len(code)
+        for i in range(n):
+            yield splice(code, i, 1, ())
+        for length in (2, 3):
+            for i in range(n - length + 1):
+                yield from self._window(code, i, length, 1)
+        for i in range(n - 2):
+            yield from self._window(code, i, 3, 2)
+
+    def _window(self, code, start, length, size):
+        # Every replacement of code[start:start + length] by `size` generated
+        # instructions. A one-instruction replacement draws on every operand
+        # of the program; a longer one only on the window's own operands.
+        outside = code[:start] + code[start + length:]
+        if size == 1:
+            vocab = Vocabulary.of(code, regs_from=outside)
+        else:
+            window = code[start:start + length]
+            regs = operands(window)[0] & operands(outside)[0]
+            regs.add(fresh_register(operands(outside)[0]))
+            _, consts, addrs, ports = operands(window)
+            vocab = Vocabulary(regs, consts, addrs | {c for c in consts if 0 <= c < Cosmo8.MEM_SIZE},
+                               ports or {0}, ())
+
+        # The program with NOPs in the window gives the jump targets in final
+        # addresses and what is live after the window.
+        stub = splice(code, start, length, (NOP,) * size)
+        live_after = liveness(stub)[start + size - 1]
+        targets = {ins.a for ins in stub if OPERAND_FORMS[ins.op] == 't'}
+        targets |= {start, start + size, len(stub)}
+        vocab = vocab.with_targets(t for t in targets if 0 <= t <= len(stub))
+        instructions = list(vocab.instructions())
+
+        if size == 1:
+            for ins in instructions:
+                if is_dead(ins, live_after):
+                    self.pruned += 1
+                    continue
+                yield splice(code, start, length, (ins,))
+            return
+
+        for second in instructions:
+            if is_dead(second, live_after):
+                self.pruned += len(instructions)
+                continue
+            reads, writes = _reads_writes(second)
+            live_between = reads | (live_after & ~writes)
+            for first in instructions:
+                if is_dead(first, live_between):
+                    self.pruned += 1
+                    continue
+                yield splice(code, start, length, (first, second))
+
+    def _from_scratch(self):
+        for length in range(1, self.max_length + 1):
+            vocab = Vocabulary(range(max(1, length - 1)), (0, 1, -1), (0, 1), (0,),
+                               range(length + 1))
+            instructions = list(vocab.instructions())
+            for code in self._programs(instructions, length, (), 0):
+                live_after = liveness(code)
+                if any(is_dead(ins, live) for ins, live in zip(code, live_after)):
+                    self.pruned += 1
+                    continue
+                if self._try(code):
+                    return code
+        return None
+
+    def _programs(self, instructions, length, prefix, used):
+        # Programs ending in HLT whose registers are first used in the order
+        # R0, R1, ...: every other numbering is a renaming of one of these.
+        # Falling into the HLT straight after an instruction that neither
+        # writes an output nor jumps would make that instruction useless.
+        if len(prefix) == length - 1:
+            if not prefix or prefix[-1].op == OP_WRITE or OPERAND_FORMS[prefix[-1].op] == 't':
+                yield prefix + (HLT,)
+            return
+        for ins in instructions:
+            reads, writes = _reads_writes(ins)
+            regs = (reads | writes) & REG_MASK
+            if (used | regs) & ((used | regs) + 1):
+                continue
+            if prefix and is_dead(prefix[-1], reads | ~writes):
+                continue
+            yield from self._programs(instructions, length, prefix + (ins,), used | regs)
+
+
+def find_seed(challenge):
+    # Shortest solution in the shipped solution sets that passes every test.
+    best = None
+    for solutions_dir in SOLUTION_DIRS:
+        path = os.path.join(solutions_dir, SOLUTION_FILENAMES[challenge["number"]])
+        try:
+            with open(path) as f:
+                code, count = load_program(f.read())
+        except (OSError, CosmoError):
+            continue
+        if not code:
+            continue
+        evaluator = Evaluator(challenge, code, validate=0)
+        if evaluator.check(code) and (best is None or count < best[1]):
+            best = (code, count, path)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Cosmo-8 Superoptimizer")
+    parser.add_argument("--problem", type=int, required=True, help="Challenge number (1-10)")
+    parser.add_argument("--seed", type=str, default=None,
+                        help="Seed solution (default: shortest passing shipped solution)")
+    parser.add_argument("--time", type=float, default=60.0,
+                        help="Time budget in seconds (default: 60)")
+    parser.add_argument("--max-candidates", type=int, default=None,
+                        help="Stop after evaluating this many candidates")
+    parser.add_argument("--validate", type=int, default=20,
+                        help="Random inputs a candidate must agree with the seed on (default: 20)")
+    parser.add_argument("--max-length", type=int, default=4,
+                        help="Longest program to enumerate when there is no seed (default: 4)")
+    parser.add_argument("--random-seed", type=int, default=0,
+                        help="Seed for the validation inputs (default: 0)")
+    parser.add_argument("--output", type=str, default=None,
+                        help="Write the best program to this file")
+    args = parser.parse_args()
+
+    if args.problem < 1 or args.problem > len(CHALLENGES):
+        print(f"Invalid problem number: {args.problem} (must be 1-{len(CHALLENGES)})")
+        sys.exit(1)
+    challenge = CHALLENGES[args.problem - 1]
+
+    if args.seed:
+        with open(args.seed) as f:
+            seed_code, _ = load_program(f.read())
+        print(f"Seed: {args.seed} ({len(seed_code)} instructions)", file=sys.stderr)
+    else:
+        found = find_seed(challenge)
+        seed_code = found[0] if found else None
+        if found:
+            print(f"Seed: {found[2]} ({found[1]} instructions)", file=sys.stderr)
+        else:
+            print("No passing seed found; enumerating from scratch", file=sys.stderr)
+
+    optimizer = Superoptimizer(challenge, seed_code, time_limit=args.time,
+                               max_candidates=args.max_candidates, validate=args.validate,
+                               max_length=args.max_length,
+                               rng=random.Random(args.random_seed))
+    best = optimizer.run()
+    if best is None:
+        print("No program found within the budget", file=sys.stderr)
+        sys.exit(1)
+
+    source = disassemble(best)
+    tier = get_tier(len(best), challenge["thresholds"])
+    print(f"Best: {len(best)} instructions ({tier})", file=sys.stderr)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(source)
+    else:
+        print(source, end="")
+
+
+if __name__ == "__main__":
+    main()